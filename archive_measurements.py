@@ -0,0 +1,21 @@
+from pathlib import Path
+
+from utils.archive import archive_store, benchmark_codecs, parse_setting
+from utils.args import args_archive
+
+
+def print_stats(stats: dict) -> None:
+    print(f"{stats['setting']:<24} ratio {stats['ratio']:6.2f}  "
+          f"{stats['throughput_mb_s']:8.1f} MB/s  ({stats['per_core_mb_s']:7.1f} MB/s per core)  "
+          f"{stats['raw_mb']:9.1f} MB -> {stats['archived_mb']:8.1f} MB", flush=True)
+
+
+if __name__ == "__main__":
+    args = args_archive()
+    n_workers = args.n_workers if args.n_workers > 0 else None
+    if args.benchmark:
+        for stats in benchmark_codecs(args.path, n_chunks=args.n_chunks, n_workers=n_workers):
+            print_stats(stats)
+    else:
+        path_dst = Path(args.output) if args.output else Path(f'{Path(args.path).resolve()}_archive')
+        print_stats(archive_store(args.path, path_dst, n_workers=n_workers, **parse_setting(args.setting)))
@@ -0,0 +1,157 @@
+import struct
+import sys
+from pathlib import Path
+from time import perf_counter_ns
+
+import numpy as np
+
+from devices.Camera import HEIGHT_IMAGE_TAU2, WIDTH_IMAGE_TAU2
+from devices.Camera.Tau.Tau2Grabber import FTDI_PACKET_SIZE
+from devices.Camera.utils import BytesBuffer, TeaxFrameDecoder, BUFFER_SIZE, TEAX_LEN, BORDER_VALUE, FRAME_VALID, \
+    decode_frame_into, is_8bit_image_borders_valid
+from utils.args import args_benchmark_frame_path
+
+sys.path.append(str(Path().cwd().parent))
+
+FRAME_SIZE = 2 * HEIGHT_IMAGE_TAU2 * WIDTH_IMAGE_TAU2 + 6 + 4 * HEIGHT_IMAGE_TAU2
+
+
+class BytesConcatBuffer:
+    """ The former BytesBuffer, which concatenates immutable bytes. Kept here as the reference for the benchmark. """
+
+    def __init__(self) -> None:
+        self._buffer: bytes = b''
+
+    def clear_buffer(self) -> None:
+        self._buffer = b''
+
+    def sync_teax(self) -> bool:
+        idx_sync = self._buffer.rfind(b'TEAX')
+        if idx_sync != -1:
+            self._buffer = self._buffer[idx_sync + TEAX_LEN:]
+            return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def __iadd__(self, other: bytes):
+        self._buffer += other
+        if len(self._buffer) > BUFFER_SIZE:
+            self._buffer = self._buffer[-BUFFER_SIZE:]
+        return self
+
+    def __getitem__(self, item: slice) -> bytes:
+        return self._buffer[item]
+
+
+def decode_frame_copying(res: bytes, height: int = HEIGHT_IMAGE_TAU2, width: int = WIDTH_IMAGE_TAU2):
+    """ The former decoding in Tau2Grabber.grab(). Kept here as the reference for the benchmark. """
+    magic_word = struct.unpack('h', res[6:8])[0]
+    frame_width = struct.unpack('h', res[1:3])[0] - 2
+    if magic_word != 0x4000 or frame_width != width:
+        return None
+    raw_image_8bit = np.frombuffer(res[6:], dtype='uint8')
+    if len(raw_image_8bit) != (2 * (width + 2)) * height:
+        return None
+    raw_image_8bit = raw_image_8bit.reshape((-1, 2 * (width + 2)))
+    if not is_8bit_image_borders_valid(raw_image_8bit, height):
+        return None
+    raw_image_16bit = 0x3FFF & np.array(raw_image_8bit).view('uint16')[:, 1:-1]
+    if (raw_image_16bit == 0).all():
+        return None
+    if (raw_image_16bit >= ((2 ** 14) - 1)).all():
+        return None
+    return raw_image_16bit
+
+
+def make_synthetic_frame(height: int = HEIGHT_IMAGE_TAU2, width: int = WIDTH_IMAGE_TAU2) -> bytes:
+    """ A frame as sent by the Tau2 over the FTDI, including the TEAX sync word. """
+    rows = np.random.randint(low=1000, high=2 ** 14 - 1, size=(height, width + 2), dtype='uint16')
+    rows[:, 0] = 0x4000  # the magic word, and a zero in the first border column
+    rows = rows.view('uint8')
+    rows[:, -1] = BORDER_VALUE
+    rows[-1, -1] = 0  # the last row differs in the border
+    header = bytearray(6)
+    header[1:3] = struct.pack('h', width + 2)
+    return b'TEAX' + bytes(header) + rows.tobytes()
+
+
+def make_stream(n_frames: int) -> list:
+    """ The synthetic stream, chunked into FTDI packets. """
+    stream = make_synthetic_frame() * n_frames
+    return [stream[i:i + FTDI_PACKET_SIZE] for i in range(0, len(stream), FTDI_PACKET_SIZE)]
+
+
+def bench_append(buffer, packets: list) -> float:
+    """ Appends the packets without clearing the buffer, as Tau2Grabber._th_reader_func() does.
+    Returns the mean time per packet in [usec]. """
+    t_start = perf_counter_ns()
+    for packet in packets:
+        buffer += packet
+    return 1e-3 * (perf_counter_ns() - t_start) / len(packets)
+
+
+def bench_buffer(buffer, packets: list) -> (float, int):
+    """ Cuts frames from the packets as Tau2Grabber.grab() does.
+    Returns the mean time per frame in [msec] and the number of frames. """
+    packets, n_frames, t_total = iter(packets), 0, 0
+    while True:
+        t_start = perf_counter_ns()
+        try:
+            buffer.clear_buffer()
+            while not buffer.sync_teax():
+                buffer += next(packets)
+            while len(buffer) < FRAME_SIZE:
+                buffer += next(packets)
+        except StopIteration:
+            break
+        buffer[:FRAME_SIZE]
+        t_total += perf_counter_ns() - t_start
+        n_frames += 1
+    return 1e-6 * t_total / max(1, n_frames), n_frames
+
+
+def bench_decoder(packets: list) -> (float, int):
+    """ Feeds the packets to the streaming decoder used by Tau2Grabber.
+    Returns the mean time per frame in [msec] and the number of frames. """
+    decoder = TeaxFrameDecoder(frame_size=FRAME_SIZE, on_frame=lambda res: None)
+    t_start = perf_counter_ns()
+    for packet in packets:
+        decoder.feed(packet)
+    return 1e-6 * (perf_counter_ns() - t_start) / max(1, decoder.n_frames), decoder.n_frames
+
+
+def bench_decode(n_frames: int) -> (float, float):
+    """ Returns the mean time per frame in [usec] of the former decoding and of decode_frame_into(). """
+    frames = [make_synthetic_frame()[TEAX_LEN:] for _ in range(min(n_frames, 32))]
+    out = np.empty((HEIGHT_IMAGE_TAU2, WIDTH_IMAGE_TAU2), dtype='uint16')
+    for res in frames:
+        if decode_frame_into(res, out, HEIGHT_IMAGE_TAU2, WIDTH_IMAGE_TAU2) != FRAME_VALID or \
+                not np.array_equal(out, decode_frame_copying(res)):
+            raise RuntimeError('decode_frame_into() differs from the former decoding.')
+    t_start = perf_counter_ns()
+    for idx in range(n_frames):
+        decode_frame_copying(frames[idx % len(frames)])
+    t_copying = perf_counter_ns() - t_start
+    t_start = perf_counter_ns()
+    for idx in range(n_frames):
+        decode_frame_into(frames[idx % len(frames)], out, HEIGHT_IMAGE_TAU2, WIDTH_IMAGE_TAU2)
+    t_fused = perf_counter_ns() - t_start
+    return 1e-3 * t_copying / n_frames, 1e-3 * t_fused / n_frames
+
+
+if __name__ == "__main__":
+    args = args_benchmark_frame_path()
+    packets = make_stream(args.n_frames)
+    print(f'Streaming {args.n_frames} frames in {len(packets)} packets of {FTDI_PACKET_SIZE} bytes.', flush=True)
+    for name, buffer in (('bytes concatenation', BytesConcatBuffer()), ('ring buffer', BytesBuffer())):
+        t_frame, n_frames = bench_buffer(buffer, packets)
+        buffer.clear_buffer()
+        t_packet = bench_append(buffer, packets)
+        print(f'{name:>20}: grab {t_frame:.3f} msec per frame ({n_frames} frames), '
+              f'append {t_packet:.1f} usec per packet.', flush=True)
+    t_frame, n_frames = bench_decoder(packets)
+    print(f'{"stream decoder":>20}: {t_frame:.3f} msec per frame ({n_frames} frames).', flush=True)
+    t_copying, t_fused = bench_decode(args.n_frames)
+    print(f'{"decode":>20}: former {t_copying:.1f} usec per frame, fused {t_fused:.1f} usec per frame.', flush=True)
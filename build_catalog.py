@@ -0,0 +1,13 @@
+from utils.args import args_catalog
+from utils.catalog import update_catalog
+
+if __name__ == "__main__":
+    args = args_catalog()
+    catalog = update_catalog(args.path, rebuild=args.rebuild)
+    print(catalog, flush=True)
+    ranges = {name: getattr(args, name) for name in ('fpa', 'housing', 'blackbody') if getattr(args, name)}
+    if ranges:
+        hits = catalog.query(**ranges)
+        for hit in hits:
+            print(f'{hit.path} [{hit.frames.start}:{hit.frames.stop}]', flush=True)
+        print(f'{sum(hit.frames.stop - hit.frames.start for hit in hits)} frames in {len(hits)} slices.', flush=True)
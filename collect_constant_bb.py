@@ -1,4 +1,3 @@
-import pickle
 import signal
 import sys
 import threading as th
@@ -10,13 +9,15 @@ import matplotlib.pyplot as plt
 from tqdm import tqdm
 
 from devices.BlackBodyCtrl import BlackBodyThread
-from devices.Camera import INIT_CAMERA_PARAMETERS, T_FPA, T_HOUSING
+from devices.Camera import INIT_CAMERA_PARAMETERS
 from devices.Camera.CameraProcess import (
     TEMPERATURE_ACQUIRE_FREQUENCY_SECONDS, CameraCtrl)
 from devices.Oven.OvenProcess import (OVEN_RECORDS_FILENAME, OvenCtrl)
 from devices.Oven.plots import plot_oven_records_in_path, mp_realttime_plot
 from utils.args import args_const_tbb
+from utils.catalog import update_catalog
 from utils.common import save_run_parameters
+from utils.store import MeasurementStore, StoreWriter, STORE_CHUNK_FRAMES
 
 sys.path.append(str(Path().cwd().parent))
 
@@ -26,6 +27,12 @@ def _stop(a, b, **kwargs) -> None:
         oven.setpoint = 0  # turn the oven off
     except:
         pass
+    try:
+        writer.close()  # flushes the frames that were already grabbed
+        update_catalog(path_to_save)
+        print('Measurements saved.', flush=True)
+    except (ValueError, TypeError, AttributeError, RuntimeError, NameError, KeyError, AssertionError):
+        pass
     try:
         camera.terminate()
         print('Camera terminated.', flush=True)
@@ -106,20 +113,33 @@ if __name__ == "__main__":
     # measurements
     t_bb = args.blackbody
     oven.setpoint = 120  # the Soft limit of the oven is 120C
-    dict_meas = dict(camera_params=params.copy(), arguments=vars(args), blackbody=t_bb)
-    filename = f"{now}_bb_{int(100 * t_bb):d}.pkl" if not args.filename else Path(args.filename).with_suffix('.pkl')
+    name = f"{now}_bb_{int(100 * t_bb):d}" if not args.filename else Path(args.filename).stem
+    with MeasurementStore(path_to_save / name, mode='a') as store:
+        store.set_attrs(camera_params=params.copy(), arguments=vars(args))
+    writer = StoreWriter(path_to_save / name, max_frames=STORE_CHUNK_FRAMES)
+    writer.start()
 
     blackbody.temperature = t_bb  # set the blackbody to the constant temperature
+    slot, frames = writer.reserve()
+    columns, n_frames = dict(time_ns=[], fpa=[], housing=[]), 0
     with tqdm() as progressbar:
-        while (fpa := camera.fpa) < limit_fpa:
-            dict_meas.setdefault('frames', []).append(camera.image)
-            dict_meas.setdefault(T_FPA, []).append(fpa)
-            dict_meas.setdefault(T_HOUSING, []).append(camera.housing)
+        while (record := camera.snapshot(timeout=None)).fpa < limit_fpa:
+            fpa = record.fpa
+            frames[n_frames] = record.frame
+            for name, values in columns.items():
+                values.append(getattr(record, name))
+            n_frames += 1
+            if n_frames == writer.max_frames:  # the chunk is full, stream it to the disk
+                writer.commit(slot, n_frames=n_frames, blackbody=round(100 * t_bb), **columns)
+                slot, frames = writer.reserve()
+                columns, n_frames = dict(time_ns=[], fpa=[], housing=[]), 0
             sleep(rate_sleep_value)  # limits the Hz of the camera
             progressbar.set_postfix_str(f'FPA {fpa / 100:.1f}C, Remaining {(limit_fpa - fpa) / 100:.1f}C')
             progressbar.update()
+    if n_frames:
+        writer.commit(slot, n_frames=n_frames, blackbody=round(100 * t_bb), **columns)
+    writer.close()
     oven.setpoint = 0  # turn the oven off
-    pickle.dump(dict_meas, open(str(path_to_save / filename), 'wb'))
     print('Experiment Ended', flush=True)
 
     # save temperature plot
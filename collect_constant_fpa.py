@@ -1,4 +1,3 @@
-import pickle
 import signal
 import sys
 import threading as th
@@ -11,7 +10,7 @@ import numpy as np
 from tqdm import tqdm
 
 from devices.BlackBodyCtrl import BlackBodyDummyThread, BlackBodyThread
-from devices.Camera import INIT_CAMERA_PARAMETERS, T_FPA, T_HOUSING
+from devices.Camera import INIT_CAMERA_PARAMETERS
 from devices.Camera.CameraProcess import (
     TEMPERATURE_ACQUIRE_FREQUENCY_SECONDS, CameraCtrl)
 from devices.Oven.DummyOven import DummyOven
@@ -19,13 +18,21 @@ from devices.Oven.OvenProcess import (OVEN_RECORDS_FILENAME, OvenCtrl,
                                       set_oven_and_settle)
 from devices.Oven.plots import plot_oven_records_in_path, mp_realttime_plot
 from utils.args import args_const_fpa
+from utils.catalog import update_catalog
 from utils.common import save_run_parameters
 from utils.misc import tqdm_waiting
+from utils.store import MeasurementStore, StoreWriter, STORE_CHUNK_FRAMES
 
 sys.path.append(str(Path().cwd().parent))
 
 
 def _stop(a, b, **kwargs) -> None:
+    try:
+        writer.close()  # flushes the frames that were already grabbed
+        update_catalog(path_to_save)
+        print('Measurements saved.', flush=True)
+    except (ValueError, TypeError, AttributeError, RuntimeError, NameError, KeyError, AssertionError):
+        pass
     try:
         camera.terminate()
         print('Camera terminated.', flush=True)
@@ -115,8 +122,11 @@ if __name__ == "__main__":
     # measurements
     if oven_temperature != 0:
         set_oven_and_settle(setpoint=oven_temperature, settling_time_minutes=settling_time, oven=oven, camera=camera)
-    dict_meas = dict(camera_params=params.copy(), arguments=vars(args), oven_setpoint=oven_temperature)
-    filename = f"{now}_fpa_{int(camera.fpa):d}.pkl" if not args.filename else Path(args.filename).with_suffix('.pkl')
+    name = f"{now}_fpa_{int(camera.fpa):d}" if not args.filename else Path(args.filename).stem
+    with MeasurementStore(path_to_save / name, mode='a') as store:
+        store.set_attrs(camera_params=params.copy(), arguments=vars(args), oven_setpoint=oven_temperature)
+    writer = StoreWriter(path_to_save / name, max_frames=min(n_images, STORE_CHUNK_FRAMES))
+    writer.start()
     try:
         if abs(blackbody.temperature - list_t_bb[-1]) < abs(blackbody.temperature - list_t_bb[0]):
             list_t_bb = list(reversed(list_t_bb))
@@ -129,11 +139,17 @@ if __name__ == "__main__":
         sleep(0.5)  # clears the buffer after the FFC
         tqdm_waiting(time_to_wait_seconds=2 * 60, postfix='Settle camera to the blackbody temperature')
         t_bb *= 100
-        for _ in tqdm(range(n_images), postfix=f'BlackBody {t_bb / 100}C'):
-            dict_meas.setdefault('frames', {}).setdefault(t_bb, []).append(camera.image)
-            dict_meas.setdefault(T_FPA, {}).setdefault(t_bb, []).append(camera.fpa)
-            dict_meas.setdefault(T_HOUSING, {}).setdefault(t_bb, []).append(camera.housing)
-    pickle.dump(dict_meas, open(str(path_to_save / filename), 'wb'))
+        seq = None
+        with tqdm(total=n_images, postfix=f'BlackBody {t_bb / 100}C') as progressbar:
+            for start in range(0, n_images, writer.max_frames):
+                slot, frames = writer.reserve()
+                batch = camera.grab_n(n_frames=min(writer.max_frames, n_images - start), out=frames,
+                                      after_seq=seq, timeout=None)
+                seq = int(batch.seq[-1])
+                writer.commit(slot, n_frames=len(batch.frames), time_ns=batch.time_ns, fpa=batch.fpa,
+                              housing=batch.housing, blackbody=t_bb)
+                progressbar.update(len(batch.frames))
+    writer.close()
 
     # save temperature plot
     if oven_temperature != 0:
@@ -1,7 +1,9 @@
+import signal
 import sys
 import threading as th
+from functools import partial
 from itertools import count
-from multiprocessing import Process, Semaphore
+from multiprocessing import Process
 from pathlib import Path
 from time import sleep
 
@@ -14,8 +16,9 @@ from devices.Oven.OvenProcess import OVEN_RECORDS_FILENAME, set_oven_and_settle
 from devices.Oven.plots import mp_realttime_plot
 from utils.args import args_fpa_with_ffc
 from utils.bb_iterators import TbbGenSawTooth
+from utils.store import StoreWriter, STORE_DIRNAME
 from utils.common import init_camera_and_oven, save_run_parameters, \
-    continuous_collection, wait_for_devices_without_bb, mp_save_measurements_to_zip
+    continuous_collection, stop_writer, wait_for_devices_without_bb
 sys.path.append(str(Path().cwd().parent))
 
 
@@ -75,11 +78,11 @@ if __name__ == "__main__":
     blackbody.set_temperature_non_blocking(args.blackbody_start)
     sleep(1)  # to flush the tqdm progress bar
 
-    # save measurements to zip
-    lock_zip = Semaphore(value=0)
-    mp_zip_saver = Process(target=mp_save_measurements_to_zip, args=(path_to_save, lock_zip, ), name='mp_zip_saver',
-                           daemon=True)
-    mp_zip_saver.start()
+    # measurements are written to a chunked store in the background
+    writer = StoreWriter(path_to_save / STORE_DIRNAME, max_frames=args.n_samples)
+    writer.start()
+    signal.signal(signal.SIGINT, partial(stop_writer, writer=writer, path_to_save=path_to_save))
+    signal.signal(signal.SIGTERM, partial(stop_writer, writer=writer, path_to_save=path_to_save))
 
     # perform FFC after ambient temperature is settled
     while not camera.ffc:
@@ -92,7 +95,6 @@ if __name__ == "__main__":
     for idx in count(start=1, step=1):
         continuous_collection(bb_generator=bb_generator, blackbody=blackbody, camera=camera,
                               n_samples=args.n_samples, time_to_collect_minutes=minutes_in_chunk,
-                              sample_rate=args.sample_rate, filename=f"{now}_{idx}.npz", path_to_save=path_to_save)
-        lock_zip.release()
+                              sample_rate=args.sample_rate, writer=writer, path_to_save=path_to_save)
     oven.setpoint = 0  # turn the oven off
     print('######### END OF RUN #########', flush=True)
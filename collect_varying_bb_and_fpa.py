@@ -1,7 +1,9 @@
+from functools import partial
 from itertools import count
+import signal
 import sys
 import threading as th
-from multiprocessing import Process, Semaphore
+from multiprocessing import Process
 from pathlib import Path
 from time import sleep, time_ns
 
@@ -11,8 +13,9 @@ from devices.Oven.OvenProcess import OVEN_RECORDS_FILENAME
 from devices.Oven.plots import mp_realttime_plot
 from utils.args import args_var_bb_fpa
 from utils.bb_iterators import TbbGenRand, TbbGenSawTooth
-from utils.common import continuous_collection, mp_save_measurements_to_zip, wait_for_devices_to_start, init_devices, \
-    save_run_parameters, wait_for_fpa
+from utils.store import StoreWriter, STORE_DIRNAME
+from utils.common import continuous_collection, wait_for_devices_to_start, init_devices, \
+    save_run_parameters, stop_writer, wait_for_fpa
 
 sys.path.append(str(Path().cwd().parent))
 
@@ -95,14 +98,13 @@ if __name__ == "__main__":
     mp_plot = Process(target=mp_realttime_plot, args=(path_to_save,), name='mp_realtime_plot', daemon=True)
     mp_plot.start()
 
-    # save measurements to zip
-    lock_zip = Semaphore(value=0)
-    mp_zip_saver = Process(target=mp_save_measurements_to_zip, args=(path_to_save, lock_zip, ), name='mp_zip_saver',
-                           daemon=True)
-    mp_zip_saver.start()
+    # measurements are written to a chunked store in the background
+    writer = StoreWriter(path_to_save / STORE_DIRNAME, max_frames=args.n_samples)
+    writer.start()
+    signal.signal(signal.SIGINT, partial(stop_writer, writer=writer, path_to_save=path_to_save))
+    signal.signal(signal.SIGTERM, partial(stop_writer, writer=writer, path_to_save=path_to_save))
 
     # start measurements
-    filename = f"{now}.npz" if not args.filename else Path(args.filename).with_suffix('.npz')
     t_ffc = wait_for_fpa(t_ffc=args.ffc, camera=camera, wait_time_camera=TEMPERATURE_ACQUIRE_FREQUENCY_SECONDS)
     minutes_in_chunk = int(args.minutes_in_chunk)
     assert minutes_in_chunk > 0, f'argument minutes_in_chunk must be > 0, got {minutes_in_chunk}.'
@@ -110,5 +112,4 @@ if __name__ == "__main__":
         continuous_collection(bb_generator=bb_generator, blackbody=blackbody, camera=camera,
                               n_samples=args.n_samples, time_to_collect_minutes=minutes_in_chunk,
                               sample_rate=args.sample_rate,
-                              filename=f"{now}_{idx}.npz", path_to_save=path_to_save)
-        lock_zip.release()  # release the lock to save the measurements to zip
+                              writer=writer, path_to_save=path_to_save)
@@ -3,19 +3,20 @@ from datetime import datetime
 from functools import partial
 from pathlib import Path
 from threading import Event, Thread
-from time import time_ns
 
 from PIL import ImageTk, ImageDraw, ImageFont
 from tqdm import tqdm
 
-from devices.Camera import INIT_CAMERA_PARAMETERS, T_FPA, T_HOUSING
-from devices.Camera.CameraProcess import CameraCtrl
+from devices.Camera import INIT_CAMERA_PARAMETERS
+from devices.Camera.CameraProcess import CameraCtrl, MAX_FRAME_RATE_HZ
 from devices.Scanner.ScannerCtrl import Scanner
-from utils.common import save_results
+from utils.catalog import update_catalog
 from utils.misc import normalize_image
+from utils.store import REQUIRED_COLUMNS, StoreWriter
 
 HEIGHT_VIEWER = int(2 * 336)
 WIDTH_VIEWER = int(2 * 256)
+SCANNER_BATCH_FRAMES = MAX_FRAME_RATE_HZ  # about a second of frames per chunk
 
 
 def closer():
@@ -35,28 +36,42 @@ def save_key(event) -> None:
 
 
 def th_saver():
+    """ Streams the frames into a store while the acquisition runs. The frames are grabbed straight into the slots
+    of a StoreWriter, which compresses and writes them in the background, so no frame is missed while writing.
+    Each batch continues from the last frame of the previous one. There is no blackbody in the scene, so the store
+    leaves the blackbody column unset. """
     path_to_save = Path.cwd() / 'measurements'
     if not path_to_save.is_dir():
         path_to_save.mkdir()
     while True:
         event_run.wait()
         now = datetime.now().strftime("%Y%m%d_h%Hm%Ms%S")
-        dict_meas = {}
-        with tqdm() as progressbar:
-            while event_run.is_set():
-                fpa = camera.fpa
-                dict_meas.setdefault('frames', []).append(camera.image)
-                dict_meas.setdefault('blackbody', []).append(-1)  # compatibility with save_results()
-                dict_meas.setdefault(T_FPA, []).append(fpa)
-                dict_meas.setdefault(T_HOUSING, []).append(camera.housing)
-                dict_meas.setdefault('time_ns', []).append(time_ns())
-                progressbar.update()
-            progressbar.set_postfix_str(f'FPA {fpa / 100:.1f}C')
-            save_results(path_to_save=path_to_save, filename=f'{now}.npz', dict_meas=dict_meas)
+        fpa, seq = -float('inf'), None
+        writer = StoreWriter(path_to_save / now, max_frames=SCANNER_BATCH_FRAMES, columns=REQUIRED_COLUMNS)
+        writer.start()
+        try:
+            with tqdm() as progressbar:
+                while event_run.is_set():
+                    slot, frames = writer.reserve()
+                    batch = camera.grab_n(n_frames=SCANNER_BATCH_FRAMES, out=frames, after_seq=seq)
+                    writer.commit(slot, n_frames=len(batch.frames), time_ns=batch.time_ns, fpa=batch.fpa,
+                                  housing=batch.housing)
+                    if len(batch.frames) == 0:
+                        continue
+                    seq, fpa = int(batch.seq[-1]), int(batch.fpa[-1])
+                    progressbar.update(len(batch.frames))
+                    progressbar.set_postfix_str(f'FPA {fpa / 100:.1f}C')
+        finally:
+            writer.close()
+        update_catalog(path_to_save)
 
 
 def th_viewer():
-    image = camera.image
+    record = camera.snapshot()
+    if record is None:
+        lmain.after(ms=1000 // 30, func=th_viewer)
+        return
+    image = record.frame
     size_root = (root.winfo_height(), root.winfo_width())
     size_canvas = (lmain.winfo_height(), lmain.winfo_width())
     if size_canvas != size_root:
@@ -66,7 +81,7 @@ def th_viewer():
     # add text to the upper-left corner with ImageDraw
     fnt = ImageFont.truetype("Pillow/Tests/fonts/FreeMono.ttf", 24)
     drawer = partial(ImageDraw.Draw(image).text, fill='red', font=fnt, stroke_width=1)
-    drawer((2, 1), f'FPA {camera.fpa / 100:.1f}C')
+    drawer((2, 1), f'FPA {record.fpa / 100:.1f}C')
     drawer((root.winfo_width() - 5 * fnt.size, root.winfo_height() - fnt.size - 2),
            'Sampling' if event_run.is_set() else '')
     image_tk = ImageTk.PhotoImage(image)
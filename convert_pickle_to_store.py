@@ -0,0 +1,14 @@
+from pathlib import Path
+
+from utils.args import args_convert_pickle
+from utils.store import store_from_pickle
+
+if __name__ == "__main__":
+    args = args_convert_pickle()
+    for path in map(Path, args.paths):
+        for path_pkl in sorted(path.rglob('*.pkl')) if path.is_dir() else [path]:
+            try:
+                store = store_from_pickle(path_pkl)
+                print(f'{path_pkl} -> {store}', flush=True)
+            except FileExistsError as err:
+                print(f'Skipped {path_pkl}: {err}', flush=True)
@@ -1,31 +1,110 @@
 import multiprocessing as mp
 import threading as th
-from ctypes import c_ushort, c_byte
+from ctypes import c_double, c_ushort, c_byte
 from itertools import cycle
-from time import sleep
+from math import ceil
+from pathlib import Path
+from time import sleep, time_ns
+from typing import Iterator
 
-from numpy import copyto, frombuffer, uint16
+from numpy import empty, ndarray
 from usb.core import USBError
 
 from devices import DeviceAbstract
 from devices.Camera import CameraAbstract, INIT_CAMERA_PARAMETERS, HEIGHT_IMAGE_TAU2, WIDTH_IMAGE_TAU2, T_HOUSING, T_FPA
+from devices.Camera.Correction import CorrectionTable
+from devices.Camera.FrameRing import FrameBatch, FrameRecord, FrameRing, FRAME_RING_SLOTS, SEQ_EMPTY
 from devices.Camera.Tau.Tau2Grabber import Tau2Grabber
+from devices.Camera.Tau.tau2_config import FPS_CODE_DICT
 from utils.logger import make_logging_handlers
 
 TEMPERATURE_ACQUIRE_FREQUENCY_SECONDS = 0.5
+TEMPERATURE_PERIOD_MIN_SECONDS = 0.1  # while the FPA is ramping
+TEMPERATURE_PERIOD_MAX_SECONDS = 1.0  # once the FPA has settled
+FPA_RESOLUTION = 10  # [100C], the FPA is rounded to 0.1C
+FRAME_WAIT_TIMEOUT_SECONDS = 1
+MAX_FRAME_RATE_HZ = max(FPS_CODE_DICT)
+TEMPERATURE_STATS_KEYS = ('n_reads', 'period_ms', 'fpa_rate_c_per_min', 'latency_mean_ms', 'latency_max_ms',
+                          'stall_mean_ms', 'stall_max_ms')
+
+
+class TemperatureScheduler:
+    """ Decides when the temperatures are read, inline with the frame stream.
+
+    The FPA and housing are read in turns, each time a frame arrives after the current period has passed.
+    The period adapts to the rate of change of the FPA, so that consecutive FPA reads are about FPA_RESOLUTION apart:
+    it shrinks to TEMPERATURE_PERIOD_MIN_SECONDS while the oven ramps, and grows to TEMPERATURE_PERIOD_MAX_SECONDS
+    once the FPA is settled.
+    The latency of each read, and the stall it causes to the next frame, are accumulated for statistics.
+    """
+
+    def __init__(self, period_min: float = TEMPERATURE_PERIOD_MIN_SECONDS,
+                 period_max: float = TEMPERATURE_PERIOD_MAX_SECONDS, smoothing: float = 0.5) -> None:
+        self._period_min_ns, self._period_max_ns = int(period_min * 1e9), int(period_max * 1e9)
+        self._period_ns = self._period_min_ns
+        self._smoothing = smoothing
+        self._t_types = cycle([T_FPA, T_HOUSING])
+        self._t_last_read_ns = 0
+        self._last_fpa, self._t_last_fpa_ns = None, 0
+        self._fpa_rate = 0.0  # [100C] per second
+        self._t_last_frame_ns, self._frame_interval_ns = 0, 0.0
+        self._is_after_read = False
+        self.n_reads, self.latency_sum_ns, self.latency_max_ns = 0, 0, 0
+        self.n_stalls, self.stall_sum_ns, self.stall_max_ns = 0, 0, 0
+
+    def next_read(self, t_ns: int) -> (str, None):
+        """ Returns the temperature type to read at t_ns, or None if no read is due. """
+        if t_ns - self._t_last_read_ns < self._period_ns:
+            return None
+        return next(self._t_types)
+
+    def on_frame(self, t_ns: int) -> None:
+        if self._t_last_frame_ns:
+            interval_ns = t_ns - self._t_last_frame_ns
+            if self._is_after_read:
+                stall_ns = max(0, int(interval_ns - self._frame_interval_ns))
+                self.n_stalls += 1
+                self.stall_sum_ns += stall_ns
+                self.stall_max_ns = max(self.stall_max_ns, stall_ns)
+            elif self._frame_interval_ns:
+                self._frame_interval_ns += 0.1 * (interval_ns - self._frame_interval_ns)
+            else:
+                self._frame_interval_ns = float(interval_ns)
+        self._t_last_frame_ns, self._is_after_read = t_ns, False
+
+    def on_read(self, t_type: str, value: (int, None), t_start_ns: int, t_end_ns: int) -> None:
+        latency_ns = t_end_ns - t_start_ns
+        self.n_reads += 1
+        self.latency_sum_ns += latency_ns
+        self.latency_max_ns = max(self.latency_max_ns, latency_ns)
+        self._t_last_read_ns, self._is_after_read = t_end_ns, True
+        if t_type != T_FPA or value is None:
+            return
+        if self._last_fpa is not None and t_end_ns > self._t_last_fpa_ns:
+            rate = abs(value - self._last_fpa) / (1e-9 * (t_end_ns - self._t_last_fpa_ns))
+            self._fpa_rate += self._smoothing * (rate - self._fpa_rate)
+            # the FPA and the housing are read in turns, so the FPA is read every second period
+            period_ns = 1e9 * FPA_RESOLUTION / (2 * self._fpa_rate) if self._fpa_rate > 0 else self._period_max_ns
+            self._period_ns = int(min(max(period_ns, self._period_min_ns), self._period_max_ns))
+        self._last_fpa, self._t_last_fpa_ns = value, t_end_ns
+
+    @property
+    def stats(self) -> tuple:
+        """ The values of TEMPERATURE_STATS_KEYS. """
+        return (self.n_reads, 1e-6 * self._period_ns, 60 * self._fpa_rate / 100,
+                1e-6 * self.latency_sum_ns / max(1, self.n_reads), 1e-6 * self.latency_max_ns,
+                1e-6 * self.stall_sum_ns / max(1, self.n_stalls), 1e-6 * self.stall_max_ns)
 
 
 class CameraCtrl(DeviceAbstract):
     _camera: (CameraAbstract, None) = None
 
-    def __init__(self, camera_parameters: dict = INIT_CAMERA_PARAMETERS, is_dummy: bool = False):
+    def __init__(self, camera_parameters: dict = INIT_CAMERA_PARAMETERS, is_dummy: bool = False,
+                 n_frames_in_ring: int = FRAME_RING_SLOTS, correction: (str, Path, CorrectionTable, None) = None):
         super().__init__()
         self._event_connected = mp.Event()
         self._event_connected.clear() if not is_dummy else self._event_connected.set()
         self._lock_camera = th.RLock()
-        self._lock_image = mp.Lock()
-        self._event_new_image = mp.Event()
-        self._event_new_image.clear()
         self._semaphore_ffc_do = mp.Semaphore(value=0)
         self._semaphore_ffc_finished = mp.Semaphore(value=0)
         self._semaphore_ffc_mode_do = mp.Semaphore(value=0)
@@ -37,14 +116,21 @@ class CameraCtrl(DeviceAbstract):
         self._ffc_mode_result: mp.Value = mp.Value(typecode_or_type=c_byte)
         self._ffc_mode_result.value = 0
 
-        # process-safe image
-        self._image_array = mp.RawArray(c_ushort, HEIGHT_IMAGE_TAU2 * WIDTH_IMAGE_TAU2)
-        self._image_array = frombuffer(self._image_array, dtype=uint16)
-        self._image_array = self._image_array.reshape(HEIGHT_IMAGE_TAU2, WIDTH_IMAGE_TAU2)
+        # process-safe ring of the last frames, with the temperatures and time of each frame
+        self._frames = FrameRing(n_slots=n_frames_in_ring, height=HEIGHT_IMAGE_TAU2, width=WIDTH_IMAGE_TAU2)
+        self._seq_image = SEQ_EMPTY  # the last frame returned by image, kept separately by each process
+
+        # the frames corrected to temperature in [C], published with the same seq as the raw frames.
+        # The correction tables are loaded once, by the camera process.
+        self._correction, self._frames_corrected = correction, None
+        if correction is not None:
+            self._frames_corrected = FrameRing(n_slots=n_frames_in_ring, height=HEIGHT_IMAGE_TAU2,
+                                               width=WIDTH_IMAGE_TAU2, dtype='float32')
 
         # process-safe temperature
         self._fpa: mp.Value = mp.Value(typecode_or_type=c_ushort)  # uint16
         self._housing: mp.Value = mp.Value(typecode_or_type=c_ushort)  # uint16
+        self._temperature_stats = mp.Array(c_double, len(TEMPERATURE_STATS_KEYS))
 
         self._camera_params = camera_parameters
 
@@ -65,14 +151,9 @@ class CameraCtrl(DeviceAbstract):
             self._semaphore_ffc_finished.release()
         except (ValueError, TypeError, AttributeError, RuntimeError, NameError, KeyError):
             pass
-        try:
-            self._event_new_image.set()
-        except (ValueError, TypeError, AttributeError, RuntimeError, NameError, KeyError):
-            pass
 
     def _run(self) -> None:
         self._workers_dict['conn'] = th.Thread(target=self._th_connect, name='th_cam_conn', daemon=False)
-        self._workers_dict['get_t'] = th.Thread(target=self._th_getter_temperature, name='th_cam_get_t', daemon=True)
         self._workers_dict['getter'] = th.Thread(target=self._th_getter_image, name='th_cam_getter', daemon=False)
         self._workers_dict['ffc'] = th.Thread(target=self._th_ffc_func, name='th_cam_ffc', daemon=True)
         self._workers_dict['mode'] = th.Thread(target=self._th_ffc_mode_to_ext, name='th_cam_ffc_mode', daemon=True)
@@ -107,7 +188,8 @@ class CameraCtrl(DeviceAbstract):
             self._ffc_mode_result.value = int(self._camera.ffc_mode == 'external')
             self._semaphore_ffc_mode_finished.release()
 
-    def _getter_temperature(self, t_type: str):  # this function exists for the th_connect function, otherwise redundant
+    def _getter_temperature(self, t_type: str) -> (int, None):
+        """ Reads the temperature from the camera, and returns it in [100C] or None if the read failed. """
         with self._lock_camera:
             t = self._camera.get_inner_temperature(t_type) if self._camera is not None else None
         if t is not None and t != 0.0 and t != -float('inf'):
@@ -115,33 +197,142 @@ class CameraCtrl(DeviceAbstract):
                 t = round(t * 100)
                 if t_type == T_FPA:
                     self._fpa.value = round(t, -1)  # precision for the fpa is 0.1C
+                    return self._fpa.value
                 elif t_type == T_HOUSING:
                     self._housing.value = t  # precision of the housing is 0.01C
+                    return self._housing.value
             except (BrokenPipeError, RuntimeError):
                 pass
-
-    def _th_getter_temperature(self) -> None:
-        self._event_connected.wait()
-        for t_type in cycle([T_FPA, T_HOUSING]):
-            self._getter_temperature(t_type=t_type)
-            sleep(TEMPERATURE_ACQUIRE_FREQUENCY_SECONDS)
+        return None
 
     def _th_getter_image(self) -> None:
+        """ Grabs the frames, and reads the temperatures in between them when the scheduler says a read is due.
+        Both share the serial port of the camera, so running them in one thread avoids contending for it. """
         self._event_connected.wait()
+        scheduler = TemperatureScheduler()
+        correction = self._correction
+        if correction is not None and not isinstance(correction, CorrectionTable):
+            correction = CorrectionTable.load(correction)
+        corrected = empty(self._frames.shape, dtype='float32')
         while self._flag_run:
             with self._lock_camera:
-                image = self._camera.grab() if self._camera is not None else None
+                image, t_frame_ns = self._camera.grab_with_time() if self._camera is not None else (None, None)
+            t_ns = time_ns()
             if image is not None:
-                with self._lock_image:
-                    copyto(self._image_array, image)
-                    self._event_new_image.set()
+                scheduler.on_frame(t_ns)
+                fpa, housing = self._fpa.value, self._housing.value
+                self._frames.publish(image, fpa=fpa, housing=housing, t_ns=t_frame_ns)
+                if correction is not None:
+                    correction.apply(image, fpa=fpa, out=corrected)
+                    self._frames_corrected.publish(corrected, fpa=fpa, housing=housing, t_ns=t_frame_ns)
+            if (t_type := scheduler.next_read(t_ns)) is not None:
+                value = self._getter_temperature(t_type=t_type)
+                scheduler.on_read(t_type, value, t_start_ns=t_ns, t_end_ns=time_ns())
+                self._temperature_stats[:] = scheduler.stats
+
+    def terminate(self) -> None:
+        super().terminate()
+        try:
+            self._frames.unlink()
+        except (ValueError, TypeError, AttributeError, RuntimeError, NameError, KeyError):
+            pass
+        try:
+            self._frames_corrected.unlink()
+        except (ValueError, TypeError, AttributeError, RuntimeError, NameError, KeyError):
+            pass
+
+    def _ring(self, corrected: bool) -> FrameRing:
+        if not corrected:
+            return self._frames
+        if self._frames_corrected is None:
+            raise ValueError('The camera was started without a correction.')
+        return self._frames_corrected
+
+    @property
+    def has_correction(self) -> bool:
+        return self._frames_corrected is not None
 
     @property
-    def image(self):
-        self._event_new_image.wait()
-        with self._lock_image:
-            self._event_new_image.clear()
-            return self._image_array.copy()
+    def image(self) -> (ndarray, None):
+        """ Returns a copy of the first frame newer than the one returned by the previous call. """
+        while not self._event_terminate.is_set():
+            record = self.next_frame(after_seq=self._seq_image)
+            if record is not None:
+                self._seq_image = record.seq
+                return record.frame
+        return None
+
+    @property
+    def latest_seq(self) -> int:
+        """ The seq of the last frame captured, or SEQ_EMPTY if no frame was captured yet. """
+        return self._frames.latest_seq
+
+    def next_frame(self, after_seq: int = SEQ_EMPTY, timeout: (float, None) = FRAME_WAIT_TIMEOUT_SECONDS,
+                   copy: bool = True, corrected: bool = False) -> (FrameRecord, None):
+        """ Waits for the first frame captured after after_seq, and returns it with its temperatures and time.
+
+        record.seq - after_seq - 1 frames were dropped because the ring was lapped. Returns None on timeout.
+        With copy=False, record.frame is a view of the ring slot, which is valid while is_frame_valid(record.seq).
+        With corrected=True the frame is the temperature image in [C], of the correction the camera was started with.
+        """
+        ring = self._ring(corrected)
+        while (seq := ring.wait(after_seq=after_seq, timeout=timeout)) != SEQ_EMPTY:
+            if (record := ring.record(seq, copy=copy)) is not None:
+                return record
+            after_seq = seq  # lapped by the writer while reading, try the next frame
+        return None
+
+    def snapshot(self, timeout: (float, None) = FRAME_WAIT_TIMEOUT_SECONDS,
+                 corrected: bool = False) -> (FrameRecord, None):
+        """ Returns a copy of the last frame captured, with the FPA, housing and time_ns of its capture. """
+        return self.next_frame(after_seq=max(self._ring(corrected).latest_seq, 0) - 1, timeout=timeout,
+                               corrected=corrected)
+
+    def iter_frames(self, n_frames: (int, None) = None, after_seq: (int, None) = None,
+                    timeout: (float, None) = None, corrected: bool = False) -> Iterator[FrameRecord]:
+        """ Yields consecutive frames captured after after_seq (default - from now on) as FrameRecords.
+
+        Stops after n_frames frames, or when no frame arrives within timeout seconds.
+        Frames that were overwritten before they were read are skipped, and are counted by the gaps in record.seq.
+        """
+        seq = self._ring(corrected).latest_seq if after_seq is None else after_seq
+        n_yielded = 0
+        while n_frames is None or n_yielded < n_frames:
+            if (record := self.next_frame(after_seq=seq, timeout=timeout, corrected=corrected)) is None:
+                return
+            seq = record.seq
+            n_yielded += 1
+            yield record
+
+    def grab_n(self, n_frames: int, out: (ndarray, None) = None, timeout: (float, None) = FRAME_WAIT_TIMEOUT_SECONDS,
+               after_seq: (int, None) = None, corrected: bool = False) -> FrameBatch:
+        """ Collects n_frames consecutive frames into out, an (n, height, width) uint16 array,
+        or float32 for the corrected frames.
+
+        If out is None, it is allocated. The frames are copied once, from the ring straight into out.
+        The frames start after after_seq, or from now on if it is None. Passing the last seq of the previous batch
+        continues it without a gap, as long as the ring still holds the frames.
+        Returns a FrameBatch, which is shorter than n_frames only if the camera stopped for timeout seconds.
+        """
+        ring = self._ring(corrected)
+        if out is None:
+            out = empty((n_frames, *ring.shape), dtype=ring.dtype)
+        assert len(out) >= n_frames, f'out must hold at least {n_frames} frames, got {len(out)}.'
+        after_seq = ring.latest_seq if after_seq is None else after_seq
+        return ring.read_into(out[:n_frames], after_seq=after_seq, timeout=timeout)
+
+    def grab_for(self, seconds: float, out: (ndarray, None) = None,
+                 timeout: (float, None) = FRAME_WAIT_TIMEOUT_SECONDS, corrected: bool = False) -> FrameBatch:
+        """ Collects consecutive frames for the given seconds into out, or until out is full.
+        If out is None, it is allocated to hold the frames of the fastest frame rate of the camera. """
+        ring = self._ring(corrected)
+        if out is None:
+            out = empty((ceil(seconds * MAX_FRAME_RATE_HZ) + 1, *ring.shape), dtype=ring.dtype)
+        return ring.read_into(out, after_seq=ring.latest_seq, timeout=timeout,
+                              deadline_ns=time_ns() + int(seconds * 1e9))
+
+    def is_frame_valid(self, seq: int) -> bool:
+        return self._frames.is_valid(seq)
 
     def ffc(self) -> bool:
         self._semaphore_ffc_do.release()
@@ -157,6 +348,12 @@ class CameraCtrl(DeviceAbstract):
     def housing(self) -> float:
         return self._housing.value
 
+    @property
+    def temperature_stats(self) -> dict:
+        """ The number of temperature reads, the current read period, the rate of change of the FPA in [C/min],
+        and the mean and max latency of a read and of the stall it caused to the frame stream, in [ms]. """
+        return dict(zip(TEMPERATURE_STATS_KEYS, self._temperature_stats[:]))
+
     @property
     def is_connected(self) -> bool:
         return self._event_connected.is_set()
@@ -0,0 +1,101 @@
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+from utils.calibration import RadiometricCalibration
+
+KELVIN2CELSIUS = 273.15
+TLINEAR_GAIN = 0.04  # [K] per grey level, of the T-Linear mode of the Tau2
+CORRECTION_SAMPLES_BB = 2 ** 5  # blackbody temperatures sampled to linearize a calibration of order_bb > 1
+CORRECTION_FPA_POINTS = 2 ** 5  # the default FPA grid of the tables of a calibration
+
+
+class CorrectionTable:
+    """ Per-pixel gain and offset tables that turn raw frames into temperature images:
+        temperature(pixel) = gain(pixel, fpa) * GL(pixel) + offset(pixel, fpa)
+
+    The tables are kept on a grid of FPA temperatures in [100C], and are linearly interpolated on the current FPA.
+    A single grid point is a plain gain/offset correction, independent of the FPA.
+    The interpolated tables are cached until the FPA changes, and apply() writes into a preallocated array,
+    so correcting a frame costs two vectorized operations and no allocations.
+    """
+
+    def __init__(self, fpa_grid: np.ndarray, gain: np.ndarray, offset: np.ndarray) -> None:
+        self.fpa_grid = np.atleast_1d(np.asarray(fpa_grid, dtype='float64'))
+        self.gain = np.asarray(gain, dtype='float32').reshape(len(self.fpa_grid), *np.shape(gain)[-2:])
+        self.offset = np.asarray(offset, dtype='float32').reshape(self.gain.shape)
+        assert np.all(np.diff(self.fpa_grid) > 0), 'The FPA grid must be increasing.'
+        self._gain_fpa, self._offset_fpa = self.gain[0].copy(), self.offset[0].copy()
+        self._cached_fpa = None
+
+    def __repr__(self) -> str:
+        return f'CorrectionTable({len(self.fpa_grid)} FPA points of shape {self.shape})'
+
+    @property
+    def shape(self) -> tuple:
+        return self.gain.shape[1:]
+
+    def _interpolate(self, fpa: float) -> None:
+        if fpa == self._cached_fpa:
+            return
+        idx = int(np.clip(np.searchsorted(self.fpa_grid, fpa) - 1, 0, max(0, len(self.fpa_grid) - 2)))
+        if len(self.fpa_grid) == 1:
+            weight = 0.0
+        else:
+            weight = float(np.clip((fpa - self.fpa_grid[idx]) / (self.fpa_grid[idx + 1] - self.fpa_grid[idx]), 0, 1))
+        for table, out in ((self.gain, self._gain_fpa), (self.offset, self._offset_fpa)):
+            np.multiply(table[idx], 1 - weight, out=out)
+            if weight > 0:
+                out += weight * table[idx + 1]
+        self._cached_fpa = fpa
+
+    def apply(self, frame: np.ndarray, fpa: float, out: (np.ndarray, None) = None) -> np.ndarray:
+        """ Corrects a raw frame captured at the given FPA temperature in [100C], into out if given. """
+        self._interpolate(fpa)
+        out = np.empty(self.shape, dtype='float32') if out is None else out
+        np.multiply(frame, self._gain_fpa, out=out)
+        out += self._offset_fpa
+        return out
+
+    def save(self, path: Union[str, Path]) -> None:
+        np.savez(path, fpa_grid=self.fpa_grid, gain=self.gain, offset=self.offset)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'CorrectionTable':
+        """ Loads the tables saved by save(), or builds them from a calibration saved by RadiometricCalibration. """
+        with np.load(path) as fp:
+            if 'gain' in fp.files:
+                return cls(fpa_grid=fp['fpa_grid'], gain=fp['gain'], offset=fp['offset'])
+        return cls.from_calibration(RadiometricCalibration.load(path))
+
+    @classmethod
+    def tlinear(cls, height: int, width: int) -> 'CorrectionTable':
+        """ The fixed T-Linear formula of the camera, in [C]. """
+        return cls(fpa_grid=[0], gain=np.full((height, width), TLINEAR_GAIN),
+                   offset=np.full((height, width), -KELVIN2CELSIUS))
+
+    @classmethod
+    def from_calibration(cls, calibration: RadiometricCalibration, fpa_grid: (np.ndarray, None) = None,
+                         in_celsius: bool = True, n_samples: int = CORRECTION_SAMPLES_BB) -> 'CorrectionTable':
+        """ Tabulates the inverse of a RadiometricCalibration on a grid of FPA temperatures in [100C].
+
+        in_celsius tells whether the calibration was fitted on temperatures in [C] or in [100C].
+        The grid defaults to CORRECTION_FPA_POINTS points over the FPA range of the data the calibration was fitted on.
+        At each FPA, the blackbody temperature is fitted as a linear function of the grey level of each pixel,
+        over the blackbody range of that data.
+        """
+        to_100c = 100 if in_celsius else 1
+        if fpa_grid is None:
+            fpa_grid = to_100c * np.linspace(calibration.low[1], calibration.high[1], CORRECTION_FPA_POINTS)
+        fpa_grid = np.atleast_1d(np.asarray(fpa_grid, dtype='float64'))
+        blackbody = np.linspace(calibration.low[0], calibration.high[0], n_samples)
+        gain = np.empty((len(fpa_grid), *calibration.coefficients.shape[2:]), dtype='float32')
+        offset = np.empty_like(gain)
+        for idx, fpa in enumerate(fpa_grid):
+            gl = calibration.predict(blackbody, np.full(n_samples, fpa / to_100c))  # (n_samples, h, w)
+            gl_mean, bb_mean = gl.mean(0), blackbody.mean()
+            gl_centered = gl - gl_mean
+            gain[idx] = np.einsum('nhw,n->hw', gl_centered, blackbody - bb_mean) / np.square(gl_centered).sum(0)
+            offset[idx] = bb_mean - gain[idx] * gl_mean
+        return cls(fpa_grid=fpa_grid, gain=gain, offset=offset)
@@ -0,0 +1,209 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from time import time_ns
+from typing import NamedTuple
+
+import numpy as np
+
+from devices.Camera import HEIGHT_IMAGE_TAU2, WIDTH_IMAGE_TAU2
+
+FRAME_RING_SLOTS = 2 ** 6  # ~1 second of frames at 60Hz
+SEQ_EMPTY = -1
+
+# per-frame metadata. Temperatures are in [100C], same as CameraCtrl.fpa and CameraCtrl.housing.
+FRAME_META_DTYPE = np.dtype([('seq', np.int64), ('time_ns', np.int64), ('fpa', np.uint16), ('housing', np.uint16)])
+
+
+class FrameRecord(NamedTuple):
+    """ A frame with the FPA and housing temperatures in [100C] and the time_ns at which it was captured. """
+    seq: int
+    time_ns: int
+    fpa: int
+    housing: int
+    frame: np.ndarray
+
+
+class FrameBatch(NamedTuple):
+    """ Consecutive frames in one (n, height, width) array, with the per-frame vectors of their metadata. """
+    seq: np.ndarray
+    time_ns: np.ndarray
+    fpa: np.ndarray
+    housing: np.ndarray
+    frames: np.ndarray
+
+    @property
+    def n_dropped(self) -> int:
+        """ The number of frames that were captured between the first and last frames of the batch, but missed. """
+        return 0 if len(self.seq) == 0 else int(self.seq[-1] - self.seq[0] + 1 - len(self.seq))
+
+
+class FrameRing:
+    """ A ring of N frames and their metadata in a single multiprocessing.shared_memory block.
+
+    A single writer publishes frames with increasing sequence numbers, starting at 0.
+    Frame seq is kept in slot (seq % n_slots), so any reader can get at the last n_slots frames without a copy.
+    Each slot carries its own seq, which is invalidated while the slot is written. A reader that holds a view of
+    a slot can check is_valid(seq) after using it, to know that the writer did not lap it in the meantime.
+    A gap between consecutive sequence numbers returned by wait() means frames were dropped by the reader.
+    """
+
+    def __init__(self, n_slots: int = FRAME_RING_SLOTS,
+                 height: int = HEIGHT_IMAGE_TAU2, width: int = WIDTH_IMAGE_TAU2, dtype: str = 'uint16') -> None:
+        assert n_slots > 0, f'n_slots must be positive, got {n_slots}.'
+        self._n_slots, self._height, self._width, self._dtype = n_slots, height, width, np.dtype(dtype)
+        self._shm = shared_memory.SharedMemory(create=True, size=self._nbytes(n_slots, height, width, self._dtype))
+        self._cond = mp.Condition(mp.Lock())
+        self._make_views()
+        self._head[0] = SEQ_EMPTY
+        self._meta['seq'] = SEQ_EMPTY
+
+    @staticmethod
+    def _nbytes(n_slots: int, height: int, width: int, dtype: np.dtype) -> int:
+        return np.dtype(np.int64).itemsize + n_slots * (FRAME_META_DTYPE.itemsize + dtype.itemsize * height * width)
+
+    def _make_views(self) -> None:
+        buf, offset = self._shm.buf, 0
+        self._head = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._head.nbytes
+        self._meta = np.ndarray((self._n_slots,), dtype=FRAME_META_DTYPE, buffer=buf, offset=offset)
+        offset += self._meta.nbytes
+        self._frames = np.ndarray((self._n_slots, self._height, self._width),
+                                  dtype=self._dtype, buffer=buf, offset=offset)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for key in ('_head', '_meta', '_frames'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._make_views()
+
+    @property
+    def n_slots(self) -> int:
+        return self._n_slots
+
+    @property
+    def shape(self) -> tuple:
+        return self._height, self._width
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    @property
+    def latest_seq(self) -> int:
+        """ The seq of the last published frame, or SEQ_EMPTY if no frame was published yet. """
+        return int(self._head[0])
+
+    @property
+    def oldest_seq(self) -> int:
+        """ The seq of the oldest frame still held by the ring, or SEQ_EMPTY if the ring is empty. """
+        latest = self.latest_seq
+        return SEQ_EMPTY if latest == SEQ_EMPTY else max(0, latest - self._n_slots + 1)
+
+    def publish(self, frame: np.ndarray, fpa: int = 0, housing: int = 0, t_ns: (int, None) = None) -> int:
+        """ Copies the frame into the next slot and wakes up all the readers. Only one process may publish. """
+        seq = self.latest_seq + 1
+        idx = seq % self._n_slots
+        meta = self._meta[idx:idx + 1]
+        meta['seq'] = SEQ_EMPTY
+        np.copyto(self._frames[idx], frame, casting='unsafe')
+        meta['time_ns'] = time_ns() if t_ns is None else t_ns
+        meta['fpa'] = fpa
+        meta['housing'] = housing
+        meta['seq'] = seq
+        with self._cond:
+            self._head[0] = seq
+            self._cond.notify_all()
+        return seq
+
+    def is_valid(self, seq: int) -> bool:
+        return seq >= 0 and int(self._meta['seq'][seq % self._n_slots]) == seq
+
+    def wait(self, after_seq: int = SEQ_EMPTY, timeout: (float, None) = None) -> int:
+        """ Blocks until a frame newer than after_seq is published.
+
+        Returns the seq of the first such frame that is still in the ring, which is after_seq + 1 unless the reader
+        fell behind by more than n_slots frames. Returns SEQ_EMPTY on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.latest_seq > after_seq, timeout=timeout):
+                return SEQ_EMPTY
+        return max(after_seq + 1, self.oldest_seq)
+
+    def view(self, seq: int) -> (tuple, None):
+        """ Returns a zero-copy (frame, metadata) pair of views of seq, or None if the slot no longer holds it.
+        The views alias the slot, so is_valid(seq) should be checked after they are used. """
+        if not self.is_valid(seq):
+            return None
+        idx = seq % self._n_slots
+        return self._frames[idx], self._meta[idx]
+
+    def read(self, seq: int, out: (np.ndarray, None) = None) -> (tuple, None):
+        """ Copies the frame seq and its metadata, or returns None if the writer overwrote the slot. """
+        idx = seq % self._n_slots
+        if not self.is_valid(seq):
+            return None
+        meta = self._meta[idx].copy()
+        if out is None:
+            out = self._frames[idx].copy()
+        else:
+            np.copyto(out, self._frames[idx])
+        if not self.is_valid(seq):
+            return None
+        return out, meta
+
+    def record(self, seq: int, copy: bool = True) -> (FrameRecord, None):
+        """ Returns seq as a FrameRecord, or None if the writer overwrote the slot.
+        With copy=False the frame is a view of the slot, and is_valid(seq) should be checked after it is used. """
+        res = self.read(seq) if copy else self.view(seq)
+        if res is None:
+            return None
+        frame, meta = res
+        record = FrameRecord(seq=seq, time_ns=int(meta['time_ns']), fpa=int(meta['fpa']),
+                             housing=int(meta['housing']), frame=frame)
+        return record if copy or self.is_valid(seq) else None
+
+    def read_into(self, frames: np.ndarray, after_seq: int = SEQ_EMPTY, timeout: (float, None) = None,
+                  deadline_ns: (int, None) = None) -> FrameBatch:
+        """ Copies consecutive frames captured after after_seq straight into the preallocated frames array.
+
+        Stops when frames is full, when no frame arrives within timeout seconds or when time_ns() passes deadline_ns.
+        The returned FrameBatch holds the filled part of frames, which may be shorter than frames on a timeout.
+        """
+        meta = np.empty(len(frames), dtype=FRAME_META_DTYPE)
+        n_filled, seq = 0, after_seq
+        while n_filled < len(frames):
+            timeout_wait = timeout
+            if deadline_ns is not None:
+                time_remaining = 1e-9 * (deadline_ns - time_ns())
+                if time_remaining <= 0:
+                    break
+                timeout_wait = time_remaining if timeout is None else min(timeout, time_remaining)
+            if (seq_next := self.wait(after_seq=seq, timeout=timeout_wait)) == SEQ_EMPTY:
+                break
+            seq, idx = seq_next, seq_next % self._n_slots
+            meta[n_filled] = self._meta[idx]
+            np.copyto(frames[n_filled], self._frames[idx])
+            if self.is_valid(seq):  # otherwise the slot was lapped while copying, and is refilled by the next frame
+                n_filled += 1
+        meta = meta[:n_filled]
+        return FrameBatch(seq=meta['seq'].copy(), time_ns=meta['time_ns'].copy(), fpa=meta['fpa'].copy(),
+                          housing=meta['housing'].copy(), frames=frames[:n_filled])
+
+    def close(self) -> None:
+        self._head = self._meta = self._frames = None
+        try:
+            self._shm.close()
+        except (BufferError, FileNotFoundError, OSError):
+            pass
+
+    def unlink(self) -> None:
+        """ Frees the shared memory. Should be called once, by the process that created the ring. """
+        self.close()
+        try:
+            self._shm.unlink()
+        except (FileNotFoundError, OSError):
+            pass
@@ -1,7 +1,9 @@
 import logging
+import queue
 import struct
 import threading as th
 from pathlib import Path
+from time import time_ns
 
 import numpy as np
 import yaml
@@ -10,13 +12,15 @@ from usb.core import USBError
 
 import devices.Camera.Tau.tau2_config as ptc
 from devices.Camera.Tau.TauCameraCtrl import Tau
-from devices.Camera.utils import connect_ftdi, is_8bit_image_borders_valid, BytesBuffer, \
-    REPLY_HEADER_BYTES, parse_incoming_message, make_packet, generate_subsets_indices_in_string
+from devices.Camera.utils import connect_ftdi, TeaxFrameDecoder, UartReplyParser, decode_frame_into, FRAME_VALID, \
+    make_packet
 from utils.logger import make_logger, make_logging_handlers
 
 KELVIN2CELSIUS = 273.15
 FTDI_PACKET_SIZE = 512 * 8
 SYNC_MSG = b'SYNC' + struct.pack(4 * 'B', *[0, 0, 0, 0])
+FRAMES_QUEUE_SIZE = 2 ** 7  # about 2 seconds at 60Hz
+GRAB_TIMEOUT_SECONDS = 1
 
 
 class Tau2Grabber(Tau):
@@ -41,12 +45,22 @@ class Tau2Grabber(Tau):
         self._event_frame_header_in_buffer.clear()
 
         self._frame_size = 2 * self.height * self.width + 6 + 4 * self.height  # 6 byte header, 4 bytes pad per row
-        self._len_command_in_bytes = 0
-
-        self._buffer = BytesBuffer(size_to_signal=self._frame_size)
+        self._uart_parser = UartReplyParser()
+
+        # continuous frame stream, started by the first call to grab()
+        self._event_stream = th.Event()
+        self._event_stream.clear()
+        self._event_command_idle = th.Event()  # the stream yields the FTDI to commands
+        self._event_command_idle.set()
+        self._frames = queue.Queue(maxsize=FRAMES_QUEUE_SIZE)
+        self._n_frames_dropped = 0
+        self._n_frames_invalid = 0
+        self._frame_decoder = TeaxFrameDecoder(frame_size=self._frame_size, on_frame=self._put_frame)
 
         self._thread_read = th.Thread(target=self._th_reader_func, name='th_tau2grabber_reader', daemon=True)
         self._thread_read.start()
+        self._thread_stream = th.Thread(target=self._th_stream_func, name='th_tau2grabber_stream', daemon=True)
+        self._thread_stream.start()
         self._log.info('Ready.')
 
     def __del__(self) -> None:
@@ -58,6 +72,10 @@ class Tau2Grabber(Tau):
             self._event_frame_header_in_buffer.set()
         if hasattr(self, '_event_read') and isinstance(self._event_read, th.Event):
             self._event_read.set()
+        if hasattr(self, '_event_stream') and isinstance(self._event_stream, th.Event):
+            self._event_stream.set()
+        if hasattr(self, '_event_command_idle') and isinstance(self._event_command_idle, th.Event):
+            self._event_command_idle.set()
         if hasattr(self, '_log') and isinstance(self._log, logging.Logger):
             try:
                 self._log.critical('Exit.')
@@ -79,22 +97,23 @@ class Tau2Grabber(Tau):
             params = yaml.safe_load(yaml_or_dict)
         else:
             params = yaml_or_dict.copy()
-        self.lens_number = params.get('lens_number', 1)
-        self.gain = params.get('gain', 'high')
-        self.ffc_period = params.get('ffc_period', 0)  # default is no ffc
-        self.ffc_temp_delta = params.get('ffc_temp_delta', 1000)  # 100.1C
-        self.fps = params.get('fps', ptc.FPS_CODE_DICT[60])  # 60Hz NTSC
-        self.cmos_depth = params.get('cmos_depth', 0)  # 14bit pre AGC
-        self.ffc_mode = params.get('ffc_mode', 'external')
-        self.ace = params.get('ace', 0)
-        self.tlinear = params.get('tlinear', 0)
-        self.isotherm = params.get('isotherm', 0)
-        self.dde = params.get('dde', 0)
-        self.agc = params.get('agc', 'manual')
-        self.sso = params.get('sso', 0)
-        self.contrast = params.get('contrast', 0)
-        self.brightness = params.get('brightness', 0)
-        self.brightness_bias = params.get('brightness_bias', 0)
+        self.set_params(dict(
+            lens_number=params.get('lens_number', 1),
+            gain=params.get('gain', 'high'),
+            ffc_period=params.get('ffc_period', 0),  # default is no ffc
+            ffc_temp_delta=params.get('ffc_temp_delta', 1000),  # 100.1C
+            fps=params.get('fps', ptc.FPS_CODE_DICT[60]),  # 60Hz NTSC
+            cmos_depth=params.get('cmos_depth', 0),  # 14bit pre AGC
+            ffc_mode=params.get('ffc_mode', 'external'),
+            ace=params.get('ace', 0),
+            tlinear=params.get('tlinear', 0),
+            isotherm=params.get('isotherm', 0),
+            dde=params.get('dde', 0),
+            agc=params.get('agc', 'manual'),
+            sso=params.get('sso', 0),
+            contrast=params.get('contrast', 0),
+            brightness=params.get('brightness', 0),
+            brightness_bias=params.get('brightness_bias', 0)))
         ####### self.correction_mask = params.get('corr_mask', 0)  # Always OFF!!!
 
     def _th_reader_func(self) -> None:
@@ -104,56 +123,87 @@ class Tau2Grabber(Tau):
                 data = self._ftdi.read_data(FTDI_PACKET_SIZE)
             except (ValueError, TypeError, AttributeError, RuntimeError, NameError, KeyError, FtdiError):
                 return None
-            if data is not None and isinstance(self._buffer, BytesBuffer):
-                self._buffer += data
-            if len(generate_subsets_indices_in_string(self._buffer, b'UART')) == self._len_command_in_bytes:
+            if data and self._uart_parser.feed(data):
                 self._event_reply_ready.set()
                 self._event_read.clear()
 
     def send_command(self, command: ptc.Code, argument: (bytes, None)) -> (None, bytes):
         data = make_packet(command, argument)
+        self._event_command_idle.clear()
         with self._lock_parse_command:
-            self._buffer.clear_buffer()  # ready for the reply
-            self._len_command_in_bytes = command.reply_bytes + REPLY_HEADER_BYTES
+            self._uart_parser.reset(command)  # ready for the reply
+            self._event_reply_ready.clear()
             self._event_read.set()
             self._write(data)
-            self._event_reply_ready.clear()  # counts the number of bytes in the buffer
-            self._event_reply_ready.wait(timeout=10)  # blocking until the number of bytes for the reply are reached
-            parsed_msg = parse_incoming_message(buffer=self._buffer.buffer, command=command)
+            self._event_reply_ready.wait(timeout=10)  # blocking until the reply is parsed
             self._event_read.clear()
+            parsed_msg = self._uart_parser.reply
+            self._frame_decoder.reset()  # the frame that was streaming during the command is incomplete
             if parsed_msg is not None:
                 self._log.debug(f"Received {parsed_msg}")
+        self._event_command_idle.set()
         return parsed_msg
 
-    def grab(self, to_temperature: bool = False):
-        with self._lock_parse_command:
-            self._buffer.clear_buffer()
-
-            while not self._buffer.sync_teax():
-                self._buffer += self._ftdi.read_data(FTDI_PACKET_SIZE)
-
-            while len(self._buffer) < self._frame_size:
-                self._buffer += self._ftdi.read_data(min(FTDI_PACKET_SIZE, self._frame_size - len(self._buffer)))
-
-            res = self._buffer[:self._frame_size]
-        if not res:
-            return None
-        magic_word = struct.unpack('h', res[6:8])[0]
-        frame_width = struct.unpack('h', res[1:3])[0] - 2
-        if magic_word != 0x4000 or frame_width != self.width:
-            return None
-        raw_image_8bit = np.frombuffer(res[6:], dtype='uint8')
-        if len(raw_image_8bit) != (2 * (self.width + 2)) * self.height:
-            return None
-        raw_image_8bit = raw_image_8bit.reshape((-1, 2 * (self.width + 2)))
-        if not is_8bit_image_borders_valid(raw_image_8bit, self.height):
-            return None
-
-        raw_image_16bit = 0x3FFF & np.array(raw_image_8bit).view('uint16')[:, 1:-1]
-        if (raw_image_16bit == 0).all():  # all pixels are empty
-            return None
-        if (raw_image_16bit >= ((2**14) - 1)).all():  # all pixels are saturated
-            return None
+    def _th_stream_func(self) -> None:
+        self._event_stream.wait()
+        while True:
+            self._event_command_idle.wait()
+            with self._lock_parse_command:
+                try:
+                    data = self._ftdi.read_data(FTDI_PACKET_SIZE)
+                except (ValueError, TypeError, AttributeError, RuntimeError, NameError, KeyError, FtdiError):
+                    return None
+                if data:
+                    self._frame_decoder.feed(data)
+
+    def _put_frame(self, res: memoryview) -> None:
+        t_ns = time_ns()  # the frame was just received, so this is its capture time up to the transfer
+        image = self._decode_frame(res)
+        if image is None:
+            self._n_frames_invalid += 1
+            return
+        while True:
+            try:
+                self._frames.put_nowait((image, t_ns))
+                return
+            except queue.Full:  # the consumer is too slow, so the oldest frame is dropped
+                try:
+                    self._frames.get_nowait()
+                    self._n_frames_dropped += 1
+                except queue.Empty:
+                    pass
+
+    @property
+    def frames(self) -> queue.Queue:
+        """ The decoded frames as (image, t_ns) in the order they were received, with the time each was received.
+        Filled after the first call to grab(). """
+        return self._frames
+
+    @property
+    def n_frames_dropped(self) -> int:
+        return self._n_frames_dropped
+
+    @property
+    def n_frames_invalid(self) -> int:
+        return self._n_frames_invalid
+
+    def grab(self, to_temperature: bool = False, timeout: float = GRAB_TIMEOUT_SECONDS):
+        return self.grab_with_time(to_temperature=to_temperature, timeout=timeout)[0]
+
+    def grab_with_time(self, to_temperature: bool = False, timeout: float = GRAB_TIMEOUT_SECONDS) -> tuple:
+        """ The next frame and the time_ns() it was received at, or (None, None) on timeout.
+        The time is stamped when the frame is decoded, so frames that waited in the queue keep their own time. """
+        self._event_stream.set()
+        try:
+            raw_image_16bit, t_ns = self._frames.get(timeout=timeout)
+        except queue.Empty:
+            return None, None
         if to_temperature:
             raw_image_16bit = 0.04 * raw_image_16bit - KELVIN2CELSIUS
-        return raw_image_16bit
+        return raw_image_16bit, t_ns
+
+    def _decode_frame(self, res: memoryview) -> (np.ndarray, None):
+        image = np.empty((self.height, self.width), dtype='uint16')
+        if decode_frame_into(res, out=image, height=self.height, width=self.width) != FRAME_VALID:
+            return None
+        return image
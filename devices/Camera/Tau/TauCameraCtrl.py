@@ -1,8 +1,9 @@
 import logging
 import struct
+from functools import partial
 from pathlib import Path
 from time import sleep
-from typing import Union
+from typing import Callable, Union
 
 import numpy as np
 import serial
@@ -14,9 +15,13 @@ from devices.Camera.Tau.tau2_config import ARGUMENT_FPA, ARGUMENT_HOUSING, SET_S
 from utils.logger import make_logging_handlers, make_logger
 
 
+# registers that hold a code from a dict of modes
+REGISTERS_CODE_DICTS = dict(gain=ptc.GAIN_CODE_DICT, agc=ptc.AGC_CODE_DICT, fps=ptc.FPS_CODE_DICT,
+                            ffc_mode=ptc.FFC_MODE_CODE_DICT)
+
+
 class Tau(CameraAbstract):
     conn = None
-    _ffc_mode = None
 
     def __init__(self, port=None, vid: int = 0x10C4, pid: int = 0xEA60,
                  baud=921600, logging_handlers: tuple = make_logging_handlers(None, True),
@@ -28,6 +33,11 @@ class Tau(CameraAbstract):
         self._width = WIDTH_IMAGE_TAU2
         self._height = HEIGHT_IMAGE_TAU2
 
+        # the last known value of each register, invalidated by a reset or an FFC
+        self._registers = {}
+        self._is_batch = False
+        self._unverified = {}
+
         if not port:
             port = list(filter(lambda x: x.vid == vid and x.pid == pid, comports()))
             port = port[0].device if port else None
@@ -55,6 +65,7 @@ class Tau(CameraAbstract):
         raise NotImplementedError
 
     def _reset(self):
+        self._registers.clear()
         self.send_command(command=ptc.CAMERA_RESET, argument=None)
 
     @property
@@ -86,6 +97,36 @@ class Tau(CameraAbstract):
         fmt = 'h' if len(res) == 2 else 'hh'
         return struct.unpack('>' + fmt, res)[0]
 
+    def _get_register(self, name: str, read_register: Callable[[], int]) -> int:
+        if name not in self._registers:
+            value = read_register()
+            if value == 0xffff:  # failed reads are not cached
+                return value
+            self._registers[name] = value
+        return self._registers[name]
+
+    def _store_register(self, name: str, value: int, result: bool) -> bool:
+        if result:
+            self._registers[name] = value
+        else:
+            self._registers.pop(name, None)
+        return result
+
+    def _current_register(self, name: str):
+        """ The current value of the register, as used by the setters to skip values that are already set.
+        During set_params() an uncached register is not read, since the batch already found it differs. """
+        if self._is_batch and name not in self._registers:
+            return None
+        return getattr(self, name)
+
+    def _defer_verification(self, name: str, value) -> bool:
+        """ Setters that can only verify by reading the register back defer the read to the end of set_params().
+        Returns True if the verification was deferred. """
+        if not self._is_batch:
+            return False
+        self._unverified[name] = value
+        return True
+
     def _set_values_with_2bytes_send_recv(self, value: int, current_value: int, command: ptc.Code) -> bool:
         if value == current_value:
             return True
@@ -115,6 +156,57 @@ class Tau(CameraAbstract):
     def set_params_by_dict(self, yaml_or_dict: (Path, dict)):
         pass
 
+    @staticmethod
+    def _to_register(name: str, value):
+        """ The value that the getter of `name` returns after it was set to `value`. """
+        if name in REGISTERS_CODE_DICTS and isinstance(value, str):
+            return REGISTERS_CODE_DICTS[name].get(value.lower(), value)
+        if name == 'lens_number':
+            return value - 1  # the terms of lenses is 0x0001 or 0x0000
+        return value
+
+    def _is_register(self, name: str, value) -> bool:
+        """ Reads the register of `name` and compares it with `value` as a register - the getters of some
+        parameters return names instead of the codes in the registers. """
+        getattr(self, name)
+        return self._registers.get(name) == self._to_register(name, value)
+
+    def set_params(self, params: dict) -> bool:
+        """ Sets the parameters in the order of the dict, and sends only those that differ from the cached registers.
+
+        Each setter sends its value without reading the register first. Setters whose reply echoes the value are
+        verified by the echo, and the rest are read back once, at the end of the batch.
+        Returns True if all the parameters were set.
+        """
+        unknown = [name for name in params if not isinstance(getattr(type(self), name, None), property)]
+        if unknown:
+            raise AttributeError(f'{", ".join(unknown)} are not parameters of the camera.')
+        changed = {name: value for name, value in params.items()
+                   if self._registers.get(name) != self._to_register(name, value)}
+        self._is_batch, self._unverified = True, {}
+        try:
+            for name, value in changed.items():
+                setattr(self, name, value)
+        finally:
+            self._is_batch = False
+
+        failed = []
+        for name, value in self._unverified.items():  # the verification pass
+            self._registers.pop(name, None)
+            if not self._is_register(name, value):
+                failed.append(name)
+        failed.extend(name for name in changed if name not in self._unverified and name not in self._registers)
+        self._unverified = {}
+
+        for name in failed:  # falls back to the setter with its own read-back and retries
+            setattr(self, name, params[name])
+            self._registers.pop(name, None)
+        failed = [name for name in failed if not self._is_register(name, params[name])]
+        self._log.info(f'Set {len(changed)} of {len(params)} parameters, the rest were already set.')
+        if failed:
+            self._log.warning(f'Setting {", ".join(failed)} failed.')
+        return not failed
+
     @property
     def is_dummy(self) -> bool:
         return False
@@ -134,6 +226,7 @@ class Tau(CameraAbstract):
             while self.shutter_position != ptc.SHUTTER_POSITION_DICT['open']:
                 self.shutter_position = ptc.SHUTTER_POSITION_DICT['open']
                 sleep(0.2)  # wait for shutter to open
+        self._registers.clear()
         if res and struct.unpack('H', res)[0] == 0xffff:
             t_fpa = self.get_inner_temperature(T_FPA)
             t_housing = self.get_inner_temperature(T_HOUSING)
@@ -150,25 +243,22 @@ class Tau(CameraAbstract):
 
     @property
     def ffc_mode(self) -> str:
-        if self._ffc_mode is None:
-            res = 0xffff
-            while res == 0xffff:
-                res = self._get_values_without_arguments(ptc.GET_FFC_MODE)
-            self._ffc_mode = {v: k for k, v in ptc.FFC_MODE_CODE_DICT.items()}[res]
-        return self._ffc_mode
+        res = 0xffff
+        while res == 0xffff:
+            res = self._get_register('ffc_mode', partial(self._get_values_without_arguments, ptc.GET_FFC_MODE))
+        return {v: k for k, v in ptc.FFC_MODE_CODE_DICT.items()}[res]
 
     @ffc_mode.setter
     def ffc_mode(self, mode: str):
-        if self._mode_setter(mode=mode, current_value=ptc.FFC_MODE_CODE_DICT[self.ffc_mode],
-                             setter_code=ptc.SET_FFC_MODE, code_dict=ptc.FFC_MODE_CODE_DICT, name='FCC'):
-            if isinstance(mode, int):
-                self._ffc_mode = {v: k for k, v in ptc.FFC_MODE_CODE_DICT.items()}[mode]
-            else:
-                self._ffc_mode = mode
+        current_value = self._current_register('ffc_mode')
+        current_value = ptc.FFC_MODE_CODE_DICT[current_value] if current_value is not None else None
+        res = self._mode_setter(mode=mode, current_value=current_value,
+                                setter_code=ptc.SET_FFC_MODE, code_dict=ptc.FFC_MODE_CODE_DICT, name='FCC')
+        self._store_register('ffc_mode', self._to_register('ffc_mode', mode), res)
 
     @property
     def ffc_period(self) -> int:
-        return self._get_values_without_arguments(ptc.GET_FFC_PERIOD)
+        return self._get_register('ffc_period', partial(self._get_values_without_arguments, ptc.GET_FFC_PERIOD))
 
     @ffc_period.setter
     def ffc_period(self, period: int):
@@ -180,11 +270,13 @@ class Tau(CameraAbstract):
             if res is True:
                 break
             sleep(1)
+        self._store_register('ffc_period', period, res)
         self._log_set_values(value=period, result=res, value_name='FFC Period')
 
     @property
     def ffc_temp_delta(self) -> int:
-        return self._get_values_without_arguments(ptc.GET_FFC_TEMP_DELTA)
+        return self._get_register('ffc_temp_delta',
+                                  partial(self._get_values_without_arguments, ptc.GET_FFC_TEMP_DELTA))
 
     @ffc_temp_delta.setter
     def ffc_temp_delta(self, delta: int):
@@ -196,6 +288,7 @@ class Tau(CameraAbstract):
             if res is True:
                 break
             sleep(1)
+        self._store_register('ffc_temp_delta', delta, res)
         self._log_set_values(value=delta, result=res, value_name='FFC temperature delta')
 
     @property
@@ -209,31 +302,39 @@ class Tau(CameraAbstract):
 
     @property
     def gain(self):
-        return self._get_values_without_arguments(ptc.GET_GAIN_MODE)
+        return self._get_register('gain', partial(self._get_values_without_arguments, ptc.GET_GAIN_MODE))
 
     @gain.setter
     def gain(self, mode: str):
-        self._mode_setter(mode, self.gain, ptc.SET_GAIN_MODE, ptc.GAIN_CODE_DICT, 'Gain')
+        res = self._mode_setter(mode, self._current_register('gain'), ptc.SET_GAIN_MODE, ptc.GAIN_CODE_DICT, 'Gain')
+        self._store_register('gain', self._to_register('gain', mode), res)
 
     @property
-    def agc(self):
-        return self._get_values_without_arguments(ptc.GET_AGC_ALGORITHM)  # todo: does this function even works????
+    def agc(self):  # todo: does this function even works????
+        return self._get_register('agc', partial(self._get_values_without_arguments, ptc.GET_AGC_ALGORITHM))
 
     @agc.setter
     def agc(self, mode: str):
-        self._mode_setter(mode, self.agc, ptc.SET_AGC_ALGORITHM, ptc.AGC_CODE_DICT, 'AGC')
+        res = self._mode_setter(mode, self._current_register('agc'), ptc.SET_AGC_ALGORITHM, ptc.AGC_CODE_DICT, 'AGC')
+        self._store_register('agc', self._to_register('agc', mode), res)
 
-    @property
-    def sso(self) -> int:
+    def _get_sso(self) -> int:
         res = self.send_command(command=ptc.GET_AGC_THRESHOLD, argument=struct.pack('>h', 0x0400))
         return struct.unpack('>h', res)[0] if res else 0xffff
 
+    @property
+    def sso(self) -> int:
+        return self._get_register('sso', self._get_sso)
+
     @sso.setter
     def sso(self, percentage: (int, tuple)):
-        if percentage == self.sso:
+        if percentage == self._current_register('sso'):
             self._log.info(f'Set SSO to {percentage}')
             return
         self.send_command(command=ptc.SET_AGC_THRESHOLD, argument=struct.pack('>hh', 0x0400, percentage))
+        self._registers.pop('sso', None)
+        if self._defer_verification('sso', percentage):
+            return
         if self.sso == percentage:
             self._log.info(f'Set SSO to {percentage}%')
             return
@@ -241,60 +342,69 @@ class Tau(CameraAbstract):
 
     @property
     def contrast(self) -> int:
-        return self._get_values_without_arguments(ptc.GET_CONTRAST)
+        return self._get_register('contrast', partial(self._get_values_without_arguments, ptc.GET_CONTRAST))
 
     @contrast.setter
     def contrast(self, value: int):
-        self._log_set_values(value, self._set_values_with_2bytes_send_recv(value, self.contrast, ptc.SET_CONTRAST),
-                             'AGC contrast')
+        result = self._set_values_with_2bytes_send_recv(value, self._current_register('contrast'), ptc.SET_CONTRAST)
+        self._log_set_values(value, self._store_register('contrast', value, result), 'AGC contrast')
 
     @property
     def brightness(self) -> int:
-        return self._get_values_without_arguments(ptc.GET_BRIGHTNESS)
+        return self._get_register('brightness', partial(self._get_values_without_arguments, ptc.GET_BRIGHTNESS))
 
     @brightness.setter
     def brightness(self, value: int):
-        self._log_set_values(value, self._set_values_with_2bytes_send_recv(value, self.brightness, ptc.SET_BRIGHTNESS),
-                             'AGC brightness')
+        result = self._set_values_with_2bytes_send_recv(value, self._current_register('brightness'),
+                                                        ptc.SET_BRIGHTNESS)
+        self._log_set_values(value, self._store_register('brightness', value, result), 'AGC brightness')
 
     @property
     def brightness_bias(self) -> int:
-        return self._get_values_without_arguments(ptc.GET_BRIGHTNESS_BIAS)
+        return self._get_register('brightness_bias',
+                                  partial(self._get_values_without_arguments, ptc.GET_BRIGHTNESS_BIAS))
 
     @brightness_bias.setter
     def brightness_bias(self, value: int):
-        result = self._set_values_with_2bytes_send_recv(value, self.brightness_bias, ptc.SET_BRIGHTNESS_BIAS)
-        self._log_set_values(value, result, 'AGC brightness_bias')
+        result = self._set_values_with_2bytes_send_recv(value, self._current_register('brightness_bias'),
+                                                        ptc.SET_BRIGHTNESS_BIAS)
+        self._log_set_values(value, self._store_register('brightness_bias', value, result), 'AGC brightness_bias')
 
     @property
     def isotherm(self) -> int:
-        return self._get_values_without_arguments(ptc.GET_ISOTHERM)
+        return self._get_register('isotherm', partial(self._get_values_without_arguments, ptc.GET_ISOTHERM))
 
     @isotherm.setter
     def isotherm(self, value: int):
-        result = self._set_values_with_2bytes_send_recv(value, self.isotherm, ptc.SET_ISOTHERM)
-        self._log_set_values(value, result, 'IsoTherm')
+        result = self._set_values_with_2bytes_send_recv(value, self._current_register('isotherm'), ptc.SET_ISOTHERM)
+        self._log_set_values(value, self._store_register('isotherm', value, result), 'IsoTherm')
 
     @property
     def dde(self) -> int:
-        return self._get_values_without_arguments(ptc.GET_MANUAL_DDE)
+        return self._get_register('dde', partial(self._get_values_without_arguments, ptc.GET_MANUAL_DDE))
 
     @dde.setter
     def dde(self, value: int):
-        result = self._set_values_with_2bytes_send_recv(value, self.dde, ptc.SET_MANUAL_DDE)
-        self._log_set_values(value, result, 'DDE')
+        result = self._set_values_with_2bytes_send_recv(value, self._current_register('dde'), ptc.SET_MANUAL_DDE)
+        self._log_set_values(value, self._store_register('dde', value, result), 'DDE')
 
-    @property
-    def tlinear(self):
+    def _get_tlinear(self) -> int:
         res = self.send_command(command=ptc.GET_TLINEAR_MODE, argument=struct.pack('>h', 0x0040))
         return struct.unpack('>h', res)[0] if res else 0xffff
 
+    @property
+    def tlinear(self):
+        return self._get_register('tlinear', self._get_tlinear)
+
     @tlinear.setter
     def tlinear(self, value: int):
-        if value == self.tlinear:
+        if value == self._current_register('tlinear'):
             self._log.info(f'Set TLinear to {value}.')
             return
         self.send_command(command=ptc.SET_TLINEAR_MODE, argument=struct.pack('>hh', 0x0040, value))
+        self._registers.pop('tlinear', None)
+        if self._defer_verification('tlinear', value):
+            return
         if value == self.tlinear:
             self._log_set_values(value, True, 'tlinear mode')
             return
@@ -314,54 +424,60 @@ class Tau(CameraAbstract):
 
     @property
     def lvds(self):
-        return self._digital_output_getter(ptc.GET_LVDS_MODE, struct.pack('>h', 0x0400))
+        return self._get_register('lvds', partial(self._digital_output_getter, ptc.GET_LVDS_MODE,
+                                                  struct.pack('>h', 0x0400)))
 
     @lvds.setter
     def lvds(self, mode: int):
-        res = self._digital_output_setter(mode, self.lvds, ptc.SET_LVDS_MODE, 0x05)
-        self._log_set_values(mode, res, 'lvds mode')
+        res = self._digital_output_setter(mode, self._current_register('lvds'), ptc.SET_LVDS_MODE, 0x05)
+        self._log_set_values(mode, self._store_register('lvds', mode, res), 'lvds mode')
 
     @property
     def lvds_depth(self):
-        return self._digital_output_getter(ptc.GET_LVDS_DEPTH, struct.pack('>h', 0x0900))
+        return self._get_register('lvds_depth', partial(self._digital_output_getter, ptc.GET_LVDS_DEPTH,
+                                                        struct.pack('>h', 0x0900)))
 
     @lvds_depth.setter
     def lvds_depth(self, mode: int):
-        res = self._digital_output_setter(mode, self.lvds_depth, ptc.SET_LVDS_DEPTH, 0x07)
-        self._log_set_values(mode, res, 'lvds depth')
+        res = self._digital_output_setter(mode, self._current_register('lvds_depth'), ptc.SET_LVDS_DEPTH, 0x07)
+        self._log_set_values(mode, self._store_register('lvds_depth', mode, res), 'lvds depth')
 
     @property
     def xp(self):
-        return self._digital_output_getter(ptc.GET_XP_MODE, struct.pack('>h', 0x0200))
+        return self._get_register('xp', partial(self._digital_output_getter, ptc.GET_XP_MODE,
+                                                struct.pack('>h', 0x0200)))
 
     @xp.setter
     def xp(self, mode: int):
-        res = self._digital_output_setter(mode, self.xp, ptc.SET_XP_MODE, 0x03)
-        self._log_set_values(mode, res, 'xp mode')
+        res = self._digital_output_setter(mode, self._current_register('xp'), ptc.SET_XP_MODE, 0x03)
+        self._log_set_values(mode, self._store_register('xp', mode, res), 'xp mode')
 
     @property
     def cmos_depth(self):
-        return self._digital_output_getter(ptc.GET_CMOS_DEPTH, struct.pack('>h', 0x0800))
+        return self._get_register('cmos_depth', partial(self._digital_output_getter, ptc.GET_CMOS_DEPTH,
+                                                        struct.pack('>h', 0x0800)))
 
     @cmos_depth.setter
     def cmos_depth(self, mode: int):
-        res = self._digital_output_setter(mode, self.cmos_depth, ptc.SET_CMOS_DEPTH, 0x06)
-        self._log_set_values(mode, res, 'CMOS Depth')
+        res = self._digital_output_setter(mode, self._current_register('cmos_depth'), ptc.SET_CMOS_DEPTH, 0x06)
+        self._log_set_values(mode, self._store_register('cmos_depth', mode, res), 'CMOS Depth')
 
     @property
     def fps(self):
-        return self._get_values_without_arguments(ptc.GET_FPS)
+        return self._get_register('fps', partial(self._get_values_without_arguments, ptc.GET_FPS))
 
     @fps.setter
     def fps(self, mode: str):
-        self._mode_setter(mode, self.fps, ptc.SET_FPS, ptc.FPS_CODE_DICT, 'FPS')
+        res = self._mode_setter(mode, self._current_register('fps'), ptc.SET_FPS, ptc.FPS_CODE_DICT, 'FPS')
+        self._store_register('fps', self._to_register('fps', mode), res)
 
     def reset(self):
+        self._registers.clear()
         return self.send_command(command=ptc.CAMERA_RESET, argument=None)
 
     @property
     def ace(self):
-        return self._get_values_without_arguments(ptc.GET_AGC_ACE_CORRECT)
+        return self._get_register('ace', partial(self._get_values_without_arguments, ptc.GET_AGC_ACE_CORRECT))
 
     @ace.setter
     def ace(self, value: int):
@@ -369,13 +485,16 @@ class Tau(CameraAbstract):
             return
         for _ in range(5):
             self.send_command(command=ptc.SET_AGC_ACE_CORRECT, argument=struct.pack('>h', value))
+            self._registers.pop('ace', None)
+            if self._defer_verification('ace', value):
+                return
             if value == self.ace:
                 self._log.info(f'Set ACE to {value}.')
                 return
 
     @property
     def lens_number(self):
-        return self._get_values_without_arguments(ptc.GET_LENS_NUMBER)
+        return self._get_register('lens_number', partial(self._get_values_without_arguments, ptc.GET_LENS_NUMBER))
 
     @lens_number.setter
     def lens_number(self, value: int):
@@ -389,8 +508,10 @@ class Tau(CameraAbstract):
             except (TypeError, struct.error, IndexError, RuntimeError, AttributeError):
                 continue
             if value == res:
+                self._registers['lens_number'] = value
                 self._log.info(f'Set Lens number to {value + 1}.')
                 return
+        self._registers.pop('lens_number', None)
 
     @property
     def shutter_position(self):
@@ -1,8 +1,7 @@
 import binascii
-import re
 import struct
 import threading as th
-from typing import List
+from typing import Callable, List
 
 import numpy as np
 import usb
@@ -17,78 +16,229 @@ TEAX_LEN = 4
 UART_PREAMBLE_LENGTH = 6
 REPLY_HEADER_BYTES = 10
 BORDER_VALUE = 64
+FRAME_HEADER_BYTES = 6
+MAGIC_WORD = 0x4000
+MAX_VALUE_14BIT = 2 ** 14 - 1
+
+# frame validity codes
+FRAME_VALID = 0
+FRAME_INVALID_SIZE = 1
+FRAME_INVALID_HEADER = 2
+FRAME_INVALID_BORDERS = 3
+FRAME_EMPTY = 4
+FRAME_SATURATED = 5
 
 
 class BytesBuffer:
-    def __init__(self, size_to_signal: int = 0) -> None:
-        self._buffer: bytes = b''
+    """ A preallocated ring of BUFFER_SIZE bytes.
+
+    Incoming data is copied once into the free tail of the buffer, and reads are handed out as memoryviews of the
+    buffer itself. When the tail is exhausted, only the unread bytes are moved to the head of the buffer, so the cost
+    of an append is proportional to the unread data (about one frame) and not to the size of the buffer.
+    On overflow, the newest half of the buffer is kept.
+    The views returned by __getitem__, __call__ and buffer are valid until the next append or clear_buffer.
+    """
+
+    def __init__(self, size_to_signal: int = 0, size: int = BUFFER_SIZE) -> None:
+        self._data = bytearray(size)
+        self._view = memoryview(self._data)
+        self._start = self._end = 0
         self._lock = th.RLock()
         self._size_to_signal = size_to_signal
 
+    @property
+    def capacity(self) -> int:
+        return len(self._data)
+
     def clear_buffer(self) -> None:
         with self._lock:
-            self._buffer = b''
+            self._start = self._end = 0
 
     def sync_teax(self) -> bool:
         with self._lock:
-            idx_sync = self._buffer.rfind(b'TEAX')
+            idx_sync = self._data.rfind(b'TEAX', self._start, self._end)
             if idx_sync != -1:
-                self._buffer = self._buffer[idx_sync + TEAX_LEN:]
+                self._start = idx_sync + TEAX_LEN
                 return True
             return False
 
-    def __len__(self) -> int:
+    def _make_room(self, size: int) -> None:
+        if self._end + size > self.capacity:
+            n_keep = self._end - self._start
+            if n_keep + size > self.capacity:  # overflow drops the oldest half, so the moves are amortized
+                n_keep = min(n_keep, self.capacity // 2, self.capacity - size)
+            self._view[:n_keep] = self._view[self._end - n_keep:self._end]
+            self._start, self._end = 0, n_keep
+
+    def reserve(self, size: int) -> memoryview:
+        """ Returns a writable view of `size` free bytes at the tail of the buffer, to be filled by a readinto-style
+        call and followed by commit(). The oldest data is dropped if the buffer cannot hold `size` more bytes. """
         with self._lock:
-            return len(self._buffer)
+            size = min(size, self.capacity)
+            self._make_room(size)
+            return self._view[self._end:self._end + size]
 
-    def __add__(self, other: bytes):
+    def commit(self, n_bytes: int) -> None:
+        """ Marks `n_bytes` written into the view returned by reserve() as valid data. """
         with self._lock:
-            self._buffer += other
-            if len(self._buffer) > BUFFER_SIZE:
-                self._buffer = self._buffer[-BUFFER_SIZE:]
-            return self._buffer
+            self._end = min(self._end + n_bytes, self.capacity)
 
-    def __iadd__(self, other: bytes):
+    def append(self, data: (bytes, bytearray, memoryview)) -> None:
+        n_bytes = len(data)
+        with self._lock:
+            if n_bytes > self.capacity:
+                data, n_bytes = data[-self.capacity:], self.capacity
+            self._make_room(n_bytes)
+            self._view[self._end:self._end + n_bytes] = data
+            self._end += n_bytes
+
+    def find(self, sub: bytes, start: int = 0) -> int:
+        """ The index of `sub` in the unread data, searched from `start`. -1 if not found. """
         with self._lock:
-            self._buffer += other
-            if len(self._buffer) > BUFFER_SIZE:
-                self._buffer = self._buffer[-BUFFER_SIZE:]
-            return self
+            idx = self._data.find(sub, self._start + start, self._end)
+            return idx - self._start if idx != -1 else -1
 
-    def __getitem__(self, item: slice) -> bytes:
+    def consume(self, n_bytes: int) -> None:
+        """ Discards the first `n_bytes` of the unread data. """
         with self._lock:
-            if isinstance(item, slice):
-                return self._buffer[item]
+            self._start = min(self._start + max(0, n_bytes), self._end)
+            if self._start == self._end:
+                self._start = self._end = 0
 
-    def __call__(self) -> bytes:
+    def __len__(self) -> int:
         with self._lock:
-            return self._buffer
+            return self._end - self._start
 
-    @property
-    def buffer(self) -> bytes:
+    def __add__(self, other: bytes) -> memoryview:
+        self.append(other)
+        return self.buffer
+
+    def __iadd__(self, other: bytes):
+        self.append(other)
+        return self
+
+    def __getitem__(self, item: slice) -> memoryview:
         with self._lock:
-            return self._buffer
+            if isinstance(item, slice):
+                return self._view[self._start:self._end][item]
 
+    def __call__(self) -> memoryview:
+        return self.buffer
 
-def generate_subsets_indices_in_string(input_string: (BytesWarning, bytes, bytes, map, filter),
-                                       subset: (bytes, str)) -> list:
-    reg = re.compile(subset)
-    if isinstance(input_string, BytesBuffer):
-        return [i.start() for i in reg.finditer(input_string())]
-    return [i.start() for i in reg.finditer(input_string)]
+    @property
+    def buffer(self) -> memoryview:
+        with self._lock:
+            return self._view[self._start:self._end]
+
+
+class TeaxFrameDecoder:
+    """ Cuts a continuous FTDI stream into frames.
+
+    Each call to feed() scans only the newly arrived bytes for the TEAX sync word, and resumes a partially received
+    frame from where the previous call stopped. Every complete frame is passed to `on_frame` as a view of the buffer,
+    which is valid only during the callback.
+    """
+
+    def __init__(self, frame_size: int, on_frame: Callable[[memoryview], None]) -> None:
+        self._buffer = BytesBuffer()
+        self._frame_size = frame_size
+        self._on_frame = on_frame
+        self._is_synced = False
+        self.n_frames = 0
+        self.n_bytes_discarded = 0
+
+    def reset(self) -> None:
+        """ Drops the partial frame, e.g. after the stream was interrupted by a command. """
+        self._buffer.clear_buffer()
+        self._is_synced = False
+
+    def feed(self, data: (bytes, bytearray, memoryview)) -> int:
+        """ Appends the data to the stream, and returns the number of complete frames found. """
+        self._buffer += data
+        n_frames = 0
+        while True:
+            if not self._is_synced:
+                idx_sync = self._buffer.find(b'TEAX')
+                if idx_sync == -1:  # keeps the tail, which may hold the beginning of the sync word
+                    n_discard = max(0, len(self._buffer) - (TEAX_LEN - 1))
+                    self._buffer.consume(n_discard)
+                    self.n_bytes_discarded += n_discard
+                    return n_frames
+                self._buffer.consume(idx_sync + TEAX_LEN)
+                self.n_bytes_discarded += idx_sync
+                self._is_synced = True
+            if len(self._buffer) < self._frame_size:
+                return n_frames
+            self._on_frame(self._buffer[:self._frame_size])
+            self._buffer.consume(self._frame_size)
+            self._is_synced = False
+            self.n_frames += 1
+            n_frames += 1
+
+
+class UartReplyParser:
+    """ Extracts the reply to a command from the FTDI stream, as the bytes arrive.
+
+    Each byte of the reply is wrapped in a UART record of UART_PREAMBLE_LENGTH bytes ('UART', length, byte), and the
+    records are interleaved with video data. feed() jumps between the records of the new bytes only, and carries at
+    most an incomplete record to the next call. The reply is complete when the last received bytes form a packet with
+    the header, the function code and both CRCs of the command.
+    """
+
+    def __init__(self) -> None:
+        self._lock = th.Lock()
+        self.reset(command=None)
+
+    def reset(self, command: (Code, None)) -> None:
+        with self._lock:
+            self._command = command
+            self._len_reply = command.reply_bytes + REPLY_HEADER_BYTES if command is not None else 0
+            self._pending = b''
+            self._data = bytearray()
+            self._reply = None
 
+    @property
+    def reply(self) -> (bytes, None):
+        with self._lock:
+            return self._reply
 
-def generate_overlapping_list_chunks(generator: (map, filter), n: int):
-    lst = list(generator)
-    subset_generator = map(lambda idx: lst[idx:idx + n], range(len(lst)))
-    return filter(lambda sub: len(sub) == n, subset_generator)
+    def feed(self, data: (bytes, bytearray, memoryview)) -> bool:
+        """ Returns True when the reply is complete. """
+        with self._lock:
+            if self._command is None or self._reply is not None:
+                return self._reply is not None
+            data = self._pending + bytes(data)
+            idx_end = 0
+            idx = data.find(b'UART')
+            while idx != -1:
+                idx_end = idx + UART_PREAMBLE_LENGTH
+                if idx_end > len(data):  # the record continues in the next call
+                    self._pending = data[idx:]
+                    return False
+                self._data.append(data[idx_end - 1])
+                if self._is_reply_complete():
+                    return True
+                idx = data.find(b'UART', idx_end)
+            self._pending = data[max(idx_end, len(data) - (len(b'UART') - 1)):]  # may hold a split marker
+            return False
+
+    def _is_reply_complete(self) -> bool:
+        if len(self._data) > self._len_reply:
+            del self._data[:-self._len_reply]
+        if len(self._data) < self._len_reply:
+            return False
+        packet, n_bytes = self._data, self._command.reply_bytes
+        if packet[0] != 0x6E or packet[3] != self._command.code:  # header is 0x6E (110)
+            return False
+        if get_crc(packet[:6]) != list(packet[6:8]) or get_crc(packet[8:8 + n_bytes]) != list(packet[-2:]):
+            return False
+        self._reply = bytes(packet[8:8 + n_bytes])
+        return True
 
 
 def get_crc(data) -> List[int]:
-    crc = struct.pack(len(data) * 'B', *data)
-    crc = binascii.crc_hqx(crc, 0)
-    crc = [((crc & 0xFF00) >> 8).to_bytes(1, 'big'), (crc & 0x00FF).to_bytes(1, 'big')]
-    return list(map(lambda x: int.from_bytes(x, 'big'), crc))
+    crc = binascii.crc_hqx(bytes(data), 0)
+    return [(crc & 0xFF00) >> 8, crc & 0x00FF]
 
 
 def connect_ftdi(vid, pid) -> Ftdi:
@@ -122,32 +272,43 @@ def is_8bit_image_borders_valid(raw_image_8bit: np.ndarray, height: int) -> bool
     return True
 
 
-def parse_incoming_message(buffer: bytes, command: Code) -> (List, None):
-    len_in_bytes = command.reply_bytes + REPLY_HEADER_BYTES
-    argument_length = len_in_bytes * UART_PREAMBLE_LENGTH
-
-    idx_list = generate_subsets_indices_in_string(buffer, b'UART')
-    if not idx_list:
-        return None
-    try:
-        data = map(lambda idx: buffer[idx:idx + argument_length][5::6], idx_list)
-        data = map(lambda d: d[0], data)
-        data = generate_overlapping_list_chunks(data, len_in_bytes)
-        data = filter(lambda res: len(res) >= len_in_bytes, data)  # length of message at least as expected
-        data = filter(lambda res: res[0] == 110, data)  # header is 0x6E (110)
-        data = list(filter(lambda res: res[3] == command.code, data))
-    except IndexError:
-        data = None
-    if not data:
-        return None
-    data = data[-1]
-    crc_1 = get_crc(data[:6])
-    crc_2 = get_crc(data[8:8 + command.reply_bytes])
-    if not crc_1 == data[6:8] or not crc_2 == data[-2:]:
-        return None
-    ret_value = data[8:8 + command.reply_bytes]
-    ret_value = struct.pack('<' + len(ret_value) * 'B', *ret_value)
-    return ret_value
+def decode_frame_into(res: (bytes, memoryview), out: np.ndarray, height: int, width: int) -> int:
+    """ Validates a raw Tau2 frame and writes its 14-bit pixels into `out`, a (height, width) uint16 array.
+
+    The frame is read through a single uint16 view, so the only full-frame passes are the masked write into `out`
+    and one reduction for empty frames. Returns FRAME_VALID or one of the FRAME_* error codes.
+    `out` holds garbage unless FRAME_VALID is returned.
+    """
+    if len(res) != FRAME_HEADER_BYTES + 2 * (width + 2) * height:
+        return FRAME_INVALID_SIZE
+    if struct.unpack_from('<h', res, 1)[0] - 2 != width:
+        return FRAME_INVALID_HEADER
+    words = np.frombuffer(res, dtype='<u2', offset=FRAME_HEADER_BYTES).reshape(height, width + 2)
+    if words[0, 0] != MAGIC_WORD:
+        return FRAME_INVALID_HEADER
+
+    # the low byte of the first column is zero, and the high byte of the last column is BORDER_VALUE except at the
+    # bottom row
+    if (words[:, 0] & 0x00FF).any():
+        return FRAME_INVALID_BORDERS
+    border = words[:, -1] >> 8
+    if border[-1] == BORDER_VALUE or (border[:-1] != BORDER_VALUE).any():
+        return FRAME_INVALID_BORDERS
+
+    np.bitwise_and(words[:, 1:-1], MAX_VALUE_14BIT, out=out)
+    max_value = out.max()
+    if max_value == 0:  # all pixels are empty
+        return FRAME_EMPTY
+    if max_value >= MAX_VALUE_14BIT and out.min() >= MAX_VALUE_14BIT:  # all pixels are saturated
+        return FRAME_SATURATED
+    return FRAME_VALID
+
+
+def parse_incoming_message(buffer: (bytes, memoryview), command: Code) -> (bytes, None):
+    parser = UartReplyParser()
+    parser.reset(command)
+    parser.feed(buffer)
+    return parser.reply
 
 
 def make_packet(command: ptc.Code, argument: (bytes, None) = None) -> bytes:
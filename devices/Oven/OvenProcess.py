@@ -1,11 +1,11 @@
 import multiprocessing as mp
 import threading as th
 from collections import deque
+from datetime import datetime
 from pathlib import Path
 from time import sleep, time_ns
 
 import numpy as np
-import pandas as pd
 from devices.Oven.PyCampbellCR1000.device import CR1000
 from devices.Oven.PyCampbellCR1000.exceptions import NoDeviceException
 from serial import SerialException, SerialTimeoutException
@@ -14,13 +14,12 @@ from tqdm import tqdm
 
 from devices import DeviceAbstract
 from devices.Camera.CameraProcess import CameraCtrl
-from devices.Oven.utils import get_last_measurements, get_offset
+from devices.Oven.records import OVEN_RECORDS_FILENAME, OvenRecordsWriter
+from devices.Oven.utils import OvenRecordsCollector, get_offset
 from .constants import *
 from utils.logger import make_logging_handlers
 from utils.misc import tqdm_waiting, get_time
 
-OVEN_RECORDS_FILENAME = 'oven_records.csv'
-
 
 def make_oven(logging_handlers: tuple = make_logging_handlers(None, True), logging_level: int = 20):
     list_ports = comports()
@@ -144,24 +143,30 @@ class OvenCtrl(DeviceAbstract):
         oven_keys = [t['FieldName'].decode() for t in oven_keys]
         oven_keys.insert(0, DATETIME)
         oven_keys.append(T_FPA), oven_keys.append(T_HOUSING)
-        df = pd.DataFrame(columns=oven_keys)
-        df = df.set_index(DATETIME)
 
-        while self._flag_run:
-            self._semaphore_collect.acquire()
-            try:
-                if not (records := get_last_measurements(self._oven)):
-                    continue
-            except (NoDeviceException, RuntimeError, ValueError, AttributeError, IOError, KeyError):
-                self._oven.log.critical('Oven not connected.')
-                return
-            records[DATETIME] = get_time()  # update inaccurate oven time
-            records[T_FPA] = float(self._temperatures[T_FPA]) / 100
-            records[T_HOUSING] = float(self._temperatures[T_HOUSING]) / 100
-            records = pd.DataFrame(records, index=[records.pop(DATETIME)])
-            df = pd.concat([df, pd.DataFrame(records)], ignore_index=False).drop_duplicates().sort_values('RecNbr')
-            df.to_csv(self._records_path, index_label=DATETIME)
-            self._oven.log.debug("Added a line to the oven logs.")
+        with OvenRecordsWriter(self._records_path, oven_keys) as writer:
+            collector = OvenRecordsCollector(self._oven, last_number=writer.last_number)
+            while self._flag_run:
+                self._semaphore_collect.acquire()
+                try:
+                    if not (records := collector.collect()):
+                        continue
+                except (NoDeviceException, RuntimeError, ValueError, AttributeError, IOError, KeyError):
+                    self._oven.log.critical('Oven not connected.')
+                    return
+                if n_invalid := sum(not isinstance(record[DATETIME], datetime) for record in records):
+                    self._oven.log.warning(f'Skipped {n_invalid} oven records without a valid time.')
+                    if not (records := [record for record in records if isinstance(record[DATETIME], datetime)]):
+                        continue
+                now, t_newest = get_time(), records[-1][DATETIME]
+                for record in records:  # update inaccurate oven time, keeping the intervals between the records
+                    record[DATETIME] = now - (t_newest - record[DATETIME])
+                    # the camera temperatures are of now, so the back-filled records don't have them
+                    is_newest = record is records[-1]
+                    record[T_FPA] = float(self._temperatures[T_FPA]) / 100 if is_newest else np.nan
+                    record[T_HOUSING] = float(self._temperatures[T_HOUSING]) / 100 if is_newest else np.nan
+                    if writer.append(record):
+                        self._oven.log.debug("Added a line to the oven logs.")
 
     def _th_setter_setpoint(self):
         self._event_connected.wait()
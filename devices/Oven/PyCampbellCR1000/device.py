@@ -235,7 +235,11 @@ class CR1000(object):
             mode = 0x03  # collect all
             p1 = 0
             p2 = 0
+        return self._collect_data_mode(tablename, mode, p1, p2)
 
+    def _collect_data_mode(self, tablename, mode, p1=0, p2=0):
+        '''Collect fragment data from `tablename` with the collect `mode` and
+        its parameters `p1` and `p2` as ListDict.'''
         tabledef = self.table_def
         # Get table number
         tablenbr = None
@@ -314,6 +318,55 @@ class CR1000(object):
             else:
                 more = False
 
+    def get_data_since(self, tablename, recnbr=None):
+        '''Get the records of `tablename` that were stored after the record
+        number `recnbr` as ListDict, oldest first. By default only the newest
+        record is downloaded.
+
+        :param tablename: Table name that contains the data.
+        :param recnbr: The number of the last record that was collected.'''
+        records = ListDict()
+        for items in self.get_data_since_generator(tablename, recnbr):
+            records.extend(items)
+        return records
+
+    def get_data_since_generator(self, tablename, recnbr=None):
+        '''Get the records of `tablename` that were stored after the record
+        number `recnbr` as generator, oldest first. The records are collected
+        by their number, so the records that were already collected are never
+        downloaded nor parsed again. By default only the newest record is
+        downloaded.
+
+        :param tablename: Table name that contains the data.
+        :param recnbr: The number of the last record that was collected.
+        '''
+        self.ping_node()
+        more = True
+        while more:
+            if recnbr is None:
+                mode, p1 = 0x05, 1  # collect the newest p1 records
+            else:
+                mode, p1 = 0x04, recnbr + 1  # collect from p1 to the newest record
+            data, more = self._collect_data_mode(tablename, mode, p1)
+            records = ListDict()
+            for rec in data:
+                if not rec["NbrOfRecs"]:  # no records, or a fragment of a record
+                    continue
+                for item in rec['RecFrag']:
+                    if recnbr is not None and item['RecNbr'] <= recnbr:
+                        continue
+                    new_rec = Dict()
+                    new_rec[DATETIME] = item['TimeOfRec']
+                    new_rec["RecNbr"] = item['RecNbr']
+                    for key in item['Fields']:
+                        new_rec["%s" % key] = item['Fields'][key]
+                    records.append(new_rec)
+                    recnbr = item['RecNbr']
+            if records:
+                yield records
+            else:
+                more = False
+
     def get_raw_packets(self, tablename):
         '''Get all raw packets from table `tablename`.
 
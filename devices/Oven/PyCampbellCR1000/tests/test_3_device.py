@@ -11,9 +11,13 @@
 '''
 from __future__ import unicode_literals
 from datetime import datetime, timedelta
-from utils.constants import DATETIME
+from ...constants import DATETIME
 from ..logger import active_logger
 from ..device import CR1000
+from ..pakbus import PakBus
+from ..utils import hex_to_bytes
+from .ressources import TABLEDEF
+from .test_1_pakbus import FakeLink
 
 
 active_logger()
@@ -96,3 +100,49 @@ class TestDevice:
         osversion = device.getprogstat()['OSVer'].decode('utf-8')
         osversion = osversion.split(".")[0]
         assert (osversion == "CR800" or osversion == "CR1000")
+
+
+COLLECTDATA = '00 02 00 01 5B DC 00 06 2A 72 AB 30 00 00 00 00 45 51 13'\
+              '90 09 CA 09 B1 09 CB 09 DE A7 E0 BE AC 47 74 24 BD 45 51'\
+              '13 90 09 CA 09 B1 09 CB 09 DE A7 DB BE A4 47 50 24 C7 45'\
+              '51 13 90 09 CA 09 B1 09 CB 09 DE A7 D5 BE B0 47 6F 24 BF'\
+              '45 51 13 90 09 CB 09 B1 09 CB 09 DE A7 B0 BE B6 47 4A 24'\
+              'C2 45 51 13 90 09 CA 09 B1 09 CB 09 DE A7 D0 BE AD 47 CB'\
+              '24 BD 45 51 13 90 09 CA 09 B1 09 CB 09 DE A7 C8 BE D4 47'\
+              '64 24 B3 00'
+
+
+class FakeCollectDevice(CR1000):
+    '''A device without a link, which answers the collect data commands by
+    record number from the records 89052 to 89057 of COLLECTDATA.'''
+
+    def __init__(self):
+        pakbus = PakBus(FakeLink())
+        self.data, _ = pakbus.parse_collectdata(hex_to_bytes(COLLECTDATA),
+                                                pakbus.parse_tabledef(hex_to_bytes(TABLEDEF)))
+        self.commands = []
+
+    def ping_node(self):
+        pass
+
+    def _collect_data_mode(self, tablename, mode, p1=0, p2=0):
+        self.commands.append((mode, p1))
+        records = self.data[0]['RecFrag']
+        if mode == 0x04:
+            records = [rec for rec in records if rec['RecNbr'] >= p1]
+        elif mode == 0x05:
+            records = records[-p1:]
+        frag = dict(self.data[0], RecFrag=records, NbrOfRecs=len(records),
+                    BegRecNbr=records[0]['RecNbr'] if records else None)
+        return [frag], 0
+
+
+def test_get_data_since():
+    device = FakeCollectDevice()
+    newest = device.get_data_since('Table1')
+    assert [item['RecNbr'] for item in newest] == [89057]
+    assert len(device.get_data_since('Table1', 89057)) == 0
+    records = device.get_data_since('Table1', 89054)
+    assert [item['RecNbr'] for item in records] == [89055, 89056, 89057]
+    assert records[0][DATETIME] < records[-1][DATETIME]
+    assert device.commands == [(0x05, 1), (0x04, 89058), (0x04, 89055)]
@@ -1,11 +1,12 @@
-from functools import partial
+from io import StringIO
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
 from matplotlib.animation import FuncAnimation
 
-from devices.Oven.OvenProcess import OVEN_RECORDS_FILENAME
+from devices.Oven.records import OVEN_RECORDS_FILENAME, read_records
 from devices.Oven.constants import T_FLOOR, T_INSULATION, T_CAMERA, T_FPA, T_HOUSING, SETPOINT, DATETIME, \
     OVEN_LOG_TIME_SECONDS
 from utils.constants import TEMPERATURE_LABEL
@@ -13,6 +14,9 @@ from utils.constants import TEMPERATURE_LABEL
 COLOR_FLOOR = {'color': 'blue'}
 COLOR_CTRLSIGNAL = {'color': 'magenta'}
 COLOR_SETPOINT = {'linestyle': 'dashed', 'color': 'red'}
+OVEN_PLOT_COLUMNS = (T_FLOOR, T_INSULATION, T_CAMERA, T_FPA, T_HOUSING, SETPOINT)
+OVEN_PLOT_MAX_POINTS = 2 ** 11  # points drawn per line, however long the run is
+OVEN_PLOT_SKIP_ROWS = 3  # the first rows of the records are usually not valid
 
 
 def plot_oven_records_in_path(idx, *, fig: plt.Figure, ax: plt.Subplot, path_to_log: Path, n_ticks: int = 10):
@@ -44,14 +48,164 @@ def plot_oven_records_in_path(idx, *, fig: plt.Figure, ax: plt.Subplot, path_to_
     return fig
 
 
-def get_dataframe(log_path: (Path, str)) -> pd.DataFrame:
-    df = pd.read_csv(log_path, index_col=DATETIME)
+def _rename_columns(df: pd.DataFrame) -> pd.DataFrame:
     return df.rename(columns={name: name.split('_Avg')[0] for name in df.columns}, inplace=False)
 
 
+def get_dataframe(log_path: (Path, str)) -> pd.DataFrame:
+    return _rename_columns(read_records(log_path))
+
+
+class DecimatedSeries:
+    """ A min/max decimated time series for long live plots.
+
+    The points are reduced in buckets of the same number of points, and each bucket keeps its min and its max in
+    time order, so peaks are never lost. When there are more than max_points points, adjacent buckets are merged and
+    the bucket size doubles - the memory and drawing time are bounded, however long the run is.
+    The points of the last bucket, which is not full yet, are kept as they are.
+    """
+
+    def __init__(self, max_points: int = OVEN_PLOT_MAX_POINTS) -> None:
+        self._max_buckets = max(2, max_points // 2)
+        self._bucket = 2  # a bucket of two points keeps both of them
+        self._t, self._y = np.empty((0, 2)), np.empty((0, 2))  # (min, max) of each full bucket
+        self._t_tail, self._y_tail = np.empty(0), np.empty(0)
+
+    def __len__(self) -> int:
+        return 2 * len(self._t) + len(self._t_tail)
+
+    def extend(self, t: np.ndarray, y: np.ndarray) -> None:
+        self._t_tail = np.concatenate((self._t_tail, np.asarray(t, dtype='float64')))
+        self._y_tail = np.concatenate((self._y_tail, np.asarray(y, dtype='float64')))
+        n_full = len(self._t_tail) // self._bucket * self._bucket
+        if n_full:
+            t_new, y_new = self._reduce(self._t_tail[:n_full].reshape(-1, self._bucket),
+                                        self._y_tail[:n_full].reshape(-1, self._bucket))
+            self._t, self._y = np.concatenate((self._t, t_new)), np.concatenate((self._y, y_new))
+            self._t_tail, self._y_tail = self._t_tail[n_full:], self._y_tail[n_full:]
+        while len(self._t) > self._max_buckets:
+            n_even = len(self._t) // 2 * 2
+            t_merged, y_merged = self._reduce(self._t[:n_even].reshape(-1, 4), self._y[:n_even].reshape(-1, 4))
+            self._t_tail = np.concatenate((self._t[n_even:].ravel(), self._t_tail))  # an odd bucket is redone
+            self._y_tail = np.concatenate((self._y[n_even:].ravel(), self._y_tail))
+            self._t, self._y, self._bucket = t_merged, y_merged, 2 * self._bucket
+            if len(self._t_tail) >= self._bucket:
+                self.extend(np.empty(0), np.empty(0))
+
+    @staticmethod
+    def _reduce(t: np.ndarray, y: np.ndarray) -> tuple:
+        """ The (min, max) points of each row, in time order. NaN are ignored. """
+        rows = np.arange(len(y))
+        y_filled = np.where(np.isnan(y), np.inf, y)
+        idx_min = y_filled.argmin(1)
+        idx_max = np.where(np.isnan(y), -np.inf, y).argmax(1)
+        first, last = np.minimum(idx_min, idx_max), np.maximum(idx_min, idx_max)
+        return np.stack((t[rows, first], t[rows, last]), 1), np.stack((y[rows, first], y[rows, last]), 1)
+
+    @property
+    def data(self) -> tuple:
+        """ The (t, y) points to draw. """
+        return np.concatenate((self._t.ravel(), self._t_tail)), np.concatenate((self._y.ravel(), self._y_tail))
+
+
+class OvenRecordsTail:
+    """ Reads only the rows that were added to the oven records since the last read.
+
+    The records are rewritten with the same rows and the new ones after them, so the bytes that were already read
+    are skipped. A partly written last line is left for the next read. If the file got shorter or its header
+    changed, it is read again from the start, and reset is True until the next read.
+    """
+
+    def __init__(self, path_to_log: (Path, str)) -> None:
+        self._path = Path(path_to_log)
+        self._offset, self._header, self.reset = 0, '', False
+
+    def read(self) -> pd.DataFrame:
+        """ The new rows, indexed by their time. An empty DataFrame if there are none. """
+        self.reset = False
+        with open(self._path, 'rb') as fp:
+            header = fp.readline().decode()
+            if not header.endswith('\n'):
+                return pd.DataFrame()
+            size = fp.seek(0, 2)
+            if header != self._header or size < self._offset:
+                self._header, self._offset, self.reset = header, len(header.encode()), bool(self._header)
+            fp.seek(self._offset)
+            text = fp.read(size - self._offset)
+        text = text[:text.rfind(b'\n') + 1]
+        if not text:
+            return pd.DataFrame()
+        self._offset += len(text)
+        df = _rename_columns(pd.read_csv(StringIO(self._header + text.decode()), index_col=DATETIME))
+        df.index = pd.to_datetime(df.index)
+        return df
+
+
+class OvenLivePlot:
+    """ A live plot of the oven records, for FuncAnimation. Each call reads only the new records, adds them to the
+    decimated series of each column, and sets the data of the existing lines. """
+
+    def __init__(self, fig: plt.Figure, ax: plt.Subplot, path_to_log: Path, n_ticks: int = 10,
+                 max_points: int = OVEN_PLOT_MAX_POINTS) -> None:
+        self._fig, self._ax, self._n_ticks, self._max_points = fig, ax, n_ticks, max_points
+        self._tail = OvenRecordsTail(path_to_log)
+        self._legend = None
+        self._clear()
+
+    def _clear(self) -> None:
+        if self._legend is not None:  # a figure legend is not removed by ax.cla()
+            self._legend.remove()
+            self._legend = None
+        self._t0, self._n_skipped = None, 0
+        self._series = {name: DecimatedSeries(self._max_points) for name in OVEN_PLOT_COLUMNS}
+        self._lines = {}
+
+    def _make_lines(self) -> None:
+        ax = self._ax
+        ax.cla()
+        for name in OVEN_PLOT_COLUMNS:
+            self._lines[name], = ax.plot([], [], label=name.split('T_')[-1].capitalize())
+        self._legend = self._fig.legend(loc='lower left')
+        ax.set_xlabel('Time [Minutes]')
+        ax.set_ylabel(TEMPERATURE_LABEL)
+        ax.xaxis.set_major_locator(plt.MaxNLocator(self._n_ticks))
+        ax.xaxis.set_minor_locator(plt.MaxNLocator(self._n_ticks))
+        ax.yaxis.set_major_locator(plt.MaxNLocator(self._n_ticks))
+        ax.yaxis.set_minor_locator(plt.MaxNLocator(self._n_ticks))
+        ax.grid()
+        self._fig.tight_layout()
+
+    def __call__(self, idx=None):
+        try:
+            df = self._tail.read()
+        except (KeyError, ValueError, RuntimeError, AttributeError, FileNotFoundError, IsADirectoryError,
+                IndexError, pd.errors.ParserError):
+            return
+        if self._tail.reset:
+            self._clear()
+        n_skip = min(len(df), OVEN_PLOT_SKIP_ROWS - self._n_skipped)
+        df, self._n_skipped = df.iloc[n_skip:], self._n_skipped + n_skip
+        if df.empty or not set(OVEN_PLOT_COLUMNS).issubset(df.columns):
+            return
+        if self._t0 is None:
+            self._t0 = df.index[0]
+        df = df[(df[T_FPA] != 0.0) & (df[T_HOUSING] != 0.0)]
+        if df.empty:
+            return
+        if not self._lines:
+            self._make_lines()
+        t = (df.index - self._t0).total_seconds().to_numpy() / 60  # seconds -> minutes
+        for name in OVEN_PLOT_COLUMNS:
+            self._series[name].extend(t, df[name].to_numpy(dtype='float64'))
+            self._lines[name].set_data(*self._series[name].data)
+        self._ax.relim()
+        self._ax.autoscale_view()
+        return list(self._lines.values())
+
+
 def mp_realttime_plot(path_to_save: Path):
     fig = plt.figure(figsize=(12, 6))
     ax = plt.subplot()
-    plot = partial(plot_oven_records_in_path, fig=fig, ax=ax, path_to_log=path_to_save / OVEN_RECORDS_FILENAME)
-    ani = FuncAnimation(fig, plot, interval=OVEN_LOG_TIME_SECONDS * 1e3)
+    plot = OvenLivePlot(fig=fig, ax=ax, path_to_log=path_to_save / OVEN_RECORDS_FILENAME)
+    ani = FuncAnimation(fig, plot, interval=OVEN_LOG_TIME_SECONDS * 1e3, cache_frame_data=False)
     plt.show()
@@ -0,0 +1,148 @@
+import csv
+import os
+from pathlib import Path
+from time import time_ns
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from devices.Oven.constants import DATETIME
+
+OVEN_RECORDS_FILENAME = 'oven_records.csv'
+OVEN_RECORDS_SIDECAR_SUFFIX = '.bin'  # oven_records.csv.bin - the same rows as float64 columns, for fast reloads
+RECORDS_NUMBER = 'RecNbr'
+RECORDS_FSYNC_ROWS = 10  # the records are fsync-ed to the disk every RECORDS_FSYNC_ROWS rows,
+RECORDS_FSYNC_SECONDS = 300  # or every RECORDS_FSYNC_SECONDS, whichever comes first
+
+
+def _path_sidecar(path: Path) -> Path:
+    return path.with_name(path.name + OVEN_RECORDS_SIDECAR_SUFFIX)
+
+
+def _sidecar_dtype(columns: List[str]) -> np.dtype:
+    """ The time is kept as seconds since the epoch, every other column as a float64. """
+    return np.dtype([(DATETIME, np.int64)] + [(name, np.float64) for name in columns if name != DATETIME])
+
+
+def _read_header(path: Path) -> Tuple[List[str], int]:
+    """ The columns of the csv and its number of rows. """
+    with open(path, 'r', newline='') as fp:
+        columns = next(csv.reader(fp), [])
+        return columns, sum(1 for line in fp if line.strip())
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class OvenRecordsWriter:
+    """ Appends the records of the oven to oven_records.csv, one row per new record.
+
+    A record is written only if its RecNbr is above the highest RecNbr already written, so the same record
+    collected twice is written once. An existing file is continued - its columns and highest RecNbr are read
+    on open. Each row is flushed to the file when it is written, so readers see it at once, and the file is
+    fsync-ed every RECORDS_FSYNC_ROWS rows or RECORDS_FSYNC_SECONDS, and on close().
+    Each row is also appended to a binary sidecar, which read_records() loads without parsing the csv.
+    """
+
+    def __init__(self, path: Union[str, Path], columns: List[str]) -> None:
+        self._path = Path(path)
+        self._last_number, n_rows = -1, 0
+        if self._path.is_file() and self._path.stat().st_size:
+            columns, n_rows = _read_header(self._path)
+            if RECORDS_NUMBER in columns and n_rows:
+                self._last_number = int(pd.read_csv(self._path, usecols=[RECORDS_NUMBER])[RECORDS_NUMBER].max())
+            self._fp = open(self._path, 'a', newline='')
+        else:
+            self._fp = open(self._path, 'w', newline='')
+            csv.writer(self._fp, lineterminator='\n').writerow(columns)
+        self._columns = list(columns)
+        self._writer = csv.writer(self._fp, lineterminator='\n')
+        self._dtype = _sidecar_dtype(self._columns)
+        path_sidecar = _path_sidecar(self._path)
+        if path_sidecar.is_file() and path_sidecar.stat().st_size != n_rows * self._dtype.itemsize:
+            path_sidecar.unlink()  # not in sync with the csv, which is the reference
+        self._fp_sidecar = open(path_sidecar, 'ab') if n_rows == 0 or path_sidecar.is_file() else None
+        self._n_unsynced, self._t_synced_ns = 0, time_ns()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def columns(self) -> List[str]:
+        return self._columns
+
+    @property
+    def last_number(self) -> int:
+        """ The highest RecNbr written, -1 if none. """
+        return self._last_number
+
+    def append(self, record: dict) -> bool:
+        """ Writes the record if it is new. Returns True if it was written. Missing columns are left empty. """
+        number = record.get(RECORDS_NUMBER)
+        if number is not None:
+            if int(number) <= self._last_number:
+                return False
+            self._last_number = int(number)
+        self._writer.writerow([record.get(name, '') for name in self._columns])
+        if self._fp_sidecar is not None:
+            row = np.zeros(1, dtype=self._dtype)
+            row[DATETIME] = pd.Timestamp(record.get(DATETIME)).value // 10 ** 9  # the local time, as in the csv
+            for name in self._dtype.names[1:]:
+                row[name] = _to_float(record.get(name))
+            self._fp_sidecar.write(row.tobytes())
+        self.flush()
+        self._n_unsynced += 1
+        if self._n_unsynced >= RECORDS_FSYNC_ROWS or time_ns() - self._t_synced_ns >= RECORDS_FSYNC_SECONDS * 1e9:
+            self.sync()
+        return True
+
+    def flush(self) -> None:
+        """ Passes the written rows to the OS, so other processes read them. """
+        for fp in (self._fp, self._fp_sidecar):
+            if fp is not None and not fp.closed:
+                fp.flush()
+
+    def sync(self) -> None:
+        """ Flushes the written rows and waits for the OS to write them to the disk. """
+        self.flush()
+        for fp in (self._fp, self._fp_sidecar):
+            if fp is not None and not fp.closed:
+                os.fsync(fp.fileno())
+        self._n_unsynced, self._t_synced_ns = 0, time_ns()
+
+    def close(self) -> None:
+        if self._fp.closed:
+            return
+        self.sync()
+        self._fp.close()
+        self._fp_sidecar.close() if self._fp_sidecar is not None else None
+
+
+def read_records(path: Union[str, Path]) -> pd.DataFrame:
+    """ The records in oven_records.csv as a DataFrame indexed by their time, with the columns of the csv.
+    The binary sidecar is used when it holds all the rows of the csv, otherwise the csv is parsed.
+    Either way the index is a DatetimeIndex and every column is float64, with NaN for the empty or invalid values. """
+    path = Path(path)
+    path_sidecar = _path_sidecar(path)
+    if path_sidecar.is_file():
+        columns, n_rows = _read_header(path)
+        dtype = _sidecar_dtype(columns)
+        if path_sidecar.stat().st_size == n_rows * dtype.itemsize:
+            rows = np.fromfile(path_sidecar, dtype=dtype)
+            index = pd.to_datetime(rows[DATETIME], unit='s').rename(DATETIME)
+            return pd.DataFrame({name: rows[name] for name in dtype.names[1:]}, index=index)
+    df = pd.read_csv(path, index_col=DATETIME)
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.index), name=DATETIME)
+    return df.apply(pd.to_numeric, errors='coerce').astype(np.float64)
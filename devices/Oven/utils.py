@@ -23,6 +23,37 @@ def get_oven_results(oven: CR1000, start_date: (datetime, None) = None, stop_dat
     return logs
 
 
+class OvenRecordsCollector:
+    """ Collects the records that the oven stored in a table since the last collection.
+
+    Remembers the RecNbr of the last record it collected, and asks the oven only for the records after it,
+    so a record is downloaded and parsed once. The first collection gets only the newest record,
+    unless last_number is given, e.g. the last RecNbr in the records of a resumed run.
+    """
+
+    def __init__(self, oven: CR1000, tablename: str = OVEN_TABLE_NAME, last_number: (int, None) = None) -> None:
+        self._oven, self._tablename = oven, tablename
+        self._last_number = None if last_number is None or last_number < 0 else int(last_number)
+
+    @property
+    def last_number(self) -> (int, None):
+        return self._last_number
+
+    def collect(self) -> list:
+        """ The new records, oldest first, each a dict of the fields of the table with DATETIME and RecNbr. """
+        for _ in range(5):
+            try:
+                records = [fix_dict_keys(r) for r in self._oven.get_data_since(self._tablename, self._last_number)]
+                break
+            except (AttributeError, IndexError, NameError, RuntimeError, KeyError, ValueError, TypeError):
+                sleep(3)
+        else:
+            return []
+        if records:
+            self._last_number = int(records[-1]['RecNbr'])
+        return records
+
+
 def fix_dict_keys(d) -> dict:
     new_dict = {}
     for d_key, val in d.items():
@@ -6,6 +6,7 @@ from PIL import ImageTk, ImageFont, ImageDraw
 
 from devices.Camera.CameraProcess import CameraCtrl
 from devices.Camera.Tau.Tau2Grabber import Tau2Grabber
+from utils.args import args_livefeed
 from utils.misc import normalize_image
 
 HEIGHT_VIEWER = int(2.5 * 336)
@@ -25,25 +26,29 @@ def closer():
 
 def th_viewer():
     try:
-        image = camera.image
+        record = camera.snapshot(corrected=camera.has_correction)
     except (RuntimeError, ValueError, NameError, pyftdi.ftdi.FtdiError):
         return
-    if image is not None:
+    if record is not None:
         size_root = (root.winfo_height(), root.winfo_width())
         size_canvas = (lmain.winfo_height(), lmain.winfo_width())
         if size_canvas != size_root:
             lmain.config(width=root.winfo_width(), height=root.winfo_height())
-        image = normalize_image(image).resize(reversed(size_canvas))
+        image = normalize_image(record.frame).resize(reversed(size_canvas))
         fnt = ImageFont.truetype("Pillow/Tests/fonts/FreeMono.ttf", 24)
         drawer = partial(ImageDraw.Draw(image).text, fill='red', font=fnt, stroke_width=1)
-        drawer((2, 1), f'FPA {camera.fpa / 100:.1f}C')
+        drawer((2, 1), f'FPA {record.fpa / 100:.1f}C')
+        if camera.has_correction:
+            h, w = record.frame.shape
+            drawer((2, 30), f'Center {record.frame[h // 2, w // 2]:.1f}C')
         image_tk = ImageTk.PhotoImage(image)
         lmain.image_tk = image_tk
         lmain.configure(image=image_tk)
     lmain.after(ms=1000 // 30, func=th_viewer)
 
 
-camera = CameraCtrl(camera_parameters=None)
+args = args_livefeed()
+camera = CameraCtrl(camera_parameters=None, correction=args.correction or None)
 camera.start()
 root = tk.Tk()
 root.protocol('WM_DELETE_WINDOW', closer)
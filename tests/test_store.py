@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from utils.archive import archive_store
+from utils.store import REQUIRED_COLUMNS, MeasurementStore, encode_chunk
+
+SHAPE = (6, 8)
+
+
+def _make_store(path, n_chunks: int = 3, n_frames: int = 5) -> np.ndarray:
+    frames = np.random.default_rng(0).integers(0, 2 ** 14, (n_chunks * n_frames, *SHAPE), dtype='uint16')
+    with MeasurementStore(path, mode='a', frame_shape=SHAPE, columns=REQUIRED_COLUMNS) as store:
+        for start in range(0, len(frames), n_frames):
+            store.append(frames[start:start + n_frames], time_ns=np.arange(start, start + n_frames), fpa=3000 + start,
+                         housing=3100)
+    return frames
+
+
+def test_archive_round_trip(tmp_path):
+    '''A store without a blackbody column is archived and read back as it was.'''
+    frames = _make_store(tmp_path / 'src')
+    archive_store(tmp_path / 'src', tmp_path / 'dst', codec='zlib', level=6, filters=('delta', 'shuffle'),
+                  n_workers=1, verbose=False)
+    src, dst = MeasurementStore(tmp_path / 'src'), MeasurementStore(tmp_path / 'dst')
+    assert dst.column_names == src.column_names
+    np.testing.assert_array_equal(dst.frames[:], frames)
+    for name in src.column_names:
+        np.testing.assert_array_equal(dst[name], src[name])
+    assert np.isnan(dst['blackbody']).all()
+    np.testing.assert_array_equal(dst.chunk_starts, src.chunk_starts)
+
+
+def test_append_encoded_missing_column(tmp_path):
+    '''A chunk with a missing or mis-sized column is refused before anything is written.'''
+    frames = _make_store(tmp_path / 'src', n_chunks=1)
+    store = MeasurementStore(tmp_path / 'src', mode='a')
+    files = {path: path.stat().st_size for path in (tmp_path / 'src').rglob('*') if path.is_file()}
+    data = encode_chunk(frames, **store.encoding)
+    with pytest.raises(KeyError):
+        store.append_encoded(data, n_frames=len(frames), time_ns=0, fpa=1)
+    with pytest.raises(ValueError):
+        store.append_encoded(data, n_frames=len(frames), time_ns=np.arange(2), fpa=1, housing=1)
+    assert {path: path.stat().st_size for path in (tmp_path / 'src').rglob('*') if path.is_file()} == files
+    assert len(MeasurementStore(tmp_path / 'src')) == len(frames)
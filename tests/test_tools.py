@@ -0,0 +1,68 @@
+import matplotlib
+
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from utils.catalog import update_catalog
+from utils.store import MeasurementStore
+from utils.tools import LOAD_BATCH_FRAMES, LazyFrames, clean_noise, load_measurements
+
+N_FRAMES = LOAD_BATCH_FRAMES + 10  # more than one batch
+SHAPE = (6, 8)
+
+
+@pytest.fixture()
+def path_measurements(tmp_path):
+    frames = np.arange(N_FRAMES * SHAPE[0] * SHAPE[1], dtype='uint16').reshape(N_FRAMES, *SHAPE)
+    with MeasurementStore(tmp_path / 'store', mode='a', frame_shape=SHAPE) as store:
+        store.append(frames, time_ns=0, fpa=3000, housing=3100, blackbody=np.arange(N_FRAMES, dtype='uint16'))
+    return tmp_path
+
+
+def test_lazy_arithmetic(path_measurements):
+    '''The tlinear conversion of the notebook, on lazy frames.'''
+    data = load_measurements(path_measurements)
+    loaded = load_measurements(path_measurements, lazy=False)
+    assert data.is_lazy and not loaded.is_lazy
+    data.frames = 0.04 * data.frames - 273.15
+    loaded.frames = 0.04 * loaded.frames - 273.15
+    assert isinstance(data.frames, np.ndarray)
+    np.testing.assert_allclose(data.frames, loaded.frames)
+    np.testing.assert_allclose(data.frames[:, 3, 3] - data.blackbody, loaded.frames[:, 3, 3] - loaded.blackbody)
+
+
+def test_lazy_indexing(path_measurements):
+    '''Pixel, fancy and mask indexing match the loaded frames.'''
+    frames = load_measurements(path_measurements).frames
+    assert isinstance(frames, LazyFrames)
+    loaded = np.asarray(frames)
+    mask = np.arange(N_FRAMES) % 3 == 0
+    for item in [(slice(None), 3, 3), (slice(None), slice(1, 4), 2), ([5, 1, N_FRAMES - 1], 2, 2), (mask, 0),
+                 (7, 2, 2), (slice(None, 0), 1, 1), [4, 2], mask, slice(10, 20)]:
+        np.testing.assert_array_equal(frames[item], loaded[item])
+    np.testing.assert_array_equal(np.mean(frames, axis=0), loaded.mean(axis=0))
+    np.testing.assert_array_equal(frames - frames, np.zeros_like(loaded))
+
+
+def test_clean_noise_plot_before_after():
+    '''The plot_before_after flag plots the example frame before and after the filter.'''
+    frames = np.random.rand(3, 8, 8)
+    data = clean_noise({3000: {'measurements': {4000: frames.copy()}}}, plot_before_after=True, n_workers=1)
+    assert data[3000]['measurements'][4000].shape == frames.shape
+    assert plt.get_fignums()
+    plt.close('all')
+
+
+def test_load_ranges_read_only(path_measurements):
+    '''Selecting by ranges reads the catalog without writing one, and falls back to the temperatures of the files.'''
+    files = sorted(path_measurements.rglob('*'))
+    data = load_measurements(path_measurements, blackbody=(0.5, 0.9))
+    assert sorted(path_measurements.rglob('*')) == files
+    np.testing.assert_array_equal(data.blackbody, np.arange(50, 91))
+    update_catalog(path_measurements)
+    cataloged = load_measurements(path_measurements, blackbody=(0.5, 0.9))
+    np.testing.assert_array_equal(cataloged.blackbody, data.blackbody)
+    np.testing.assert_array_equal(np.asarray(cataloged.frames), np.asarray(data.frames))
@@ -1,5 +1,6 @@
+import os
 from datetime import datetime
-from functools import partial
+from itertools import islice
 from multiprocessing import cpu_count, Semaphore
 from multiprocessing.dummy import Pool
 from operator import itemgetter
@@ -8,10 +9,13 @@ from typing import Dict, Tuple, List
 
 import matplotlib.pyplot as plt
 import numpy as np
+import yaml
 from matplotlib.ticker import StrMethodFormatter
 
+from devices.Oven.constants import DATETIME, T_FPA, T_HOUSING
 from utils.constants import *
 from utils.misc import check_and_make_path
+from utils.report import PlotSpec, ReportRenderer
 
 
 def plot_double_sides(dict_of_y_right: dict,
@@ -58,49 +62,154 @@ def load_np_to_dict(path_to_load: Path) -> Tuple[str, np.ndarray]:
     return path_to_load.stem, np.load(str(path_to_load))
 
 
-def load_files_to_mem(path_to_load: (str, Path)) -> list:
-    path_list = list(filter(lambda x: 'mask' not in str(x), Path(path_to_load).rglob('*.npy')))
-    with Pool(cpu_count()) as pool:
-        list_files = list(pool.imap(load_np_to_dict, path_list))
-    list_files.sort(key=lambda x: x[0])
-    return list_files
-
-
-def average_iterated_images(list_of_images: list) -> List[Tuple[Path, float]]:
-    n_images_iterations = int(list_of_images[0][0].split('of')[-1])
-    list_of_images.sort(key=lambda x: x[0])
-    new_list = [list_of_images[i:i + n_images_iterations] for i in range(0, len(list_of_images), n_images_iterations)]
-    for idx, chunk in enumerate(new_list):
-        new_name = '_'.join(chunk[0][0].split('_')[:-1])
-        mean_img = np.stack([c[-1] for c in chunk])
-        new_list[idx] = (new_name, float(mean_img.mean()))
-    return new_list
-
-
-def get_average_temps_entire_experiment(path_to_experiment: (str, Path)) -> (List[Tuple[Path, float]], None):
-    files_list = load_files_to_mem(Path(path_to_experiment))
-    if not files_list:
-        return None
-    return average_iterated_images(files_list)
-
-
-def parse_results_paths_to_values(results_list: (List[Tuple[Path, np.ndarray]], None)) -> (List[Dict], None):
-    if not results_list:
-        return None
-    times_list = list(map(lambda x: datetime.strptime('_'.join(x[0].split('_')[:2]), FMT_TIME), results_list))
-    times_list = list(map(lambda x: int((x - times_list[0]).total_seconds()), times_list))
-    list_values = list(map(lambda x: (x[0].split('_')[2:], x[1]), results_list))
-    list_values = list(map(lambda x, t: ([DATETIME, str(t)] + x[0], x[1]), list_values, times_list))
-    dict_values = list(map(lambda x: {key: float(val) for key, val in zip(x[0][::2], x[0][1::2])}, list_values))
-    for idx in range(len(dict_values)):
-        dict_values[idx]['measurement'] = float(list_values[idx][-1])
-    return dict_values
-
-
 def get_averages_and_values_of_files_in_path(path_to_experiment: (Path, str)) -> List[Dict[str, float]]:
-    results = get_average_temps_entire_experiment(Path(path_to_experiment))
-    results = parse_results_paths_to_values(results)
-    return results
+    with ExperimentAggregator(path_to_experiment) as aggregator:
+        aggregator.update()
+        return aggregator.results
+
+
+AGGREGATE_STATE_FILENAME = 'aggregate.yaml'
+AGGREGATE_FILES_FILENAME = 'aggregate_files.txt'  # the images already read, one per line, appended on each update
+AGGREGATE_INLINE_FILES = 8  # fewer new images than this are read in the calling thread, without the pool
+
+
+def _split_name(name: str) -> Tuple[str, float, Dict[str, float]]:
+    """ '<time>_<key>_<value>_..._<i>of<n>' -> the name of the setpoint, its time in seconds and its values. """
+    setpoint = '_'.join(name.split('_')[:-1])
+    fields = setpoint.split('_')
+    t = datetime.strptime('_'.join(fields[:2]), FMT_TIME).timestamp()
+    return setpoint, t, {key: float(val) for key, val in zip(fields[2::2], fields[3::2])}
+
+
+class ExperimentAggregator:
+    """ Keeps the running mean of the images of each setpoint of an experiment, and reads only the new images.
+
+    An image is a .npy file named '<time>_<key>_<value>_..._<i>of<n>', and all the images of a setpoint share
+    the name up to '<i>of<n>'. Only the folders that changed since the last update are listed, and a few new images
+    are read inline, more in a pool of threads that is kept until close().
+    The sum and count of each setpoint are saved to aggregate.yaml in the plots folder after each update, and the
+    new images are appended to aggregate_files.txt next to it, so a restart continues from where it stopped.
+    aggregate.yaml holds the number of lines of aggregate_files.txt that were counted, so lines appended by an
+    update that did not finish are dropped.
+    """
+
+    def __init__(self, path_to_experiment: (Path, str), path_state: (Path, str, None) = None) -> None:
+        self._path = Path(path_to_experiment)
+        self._path_state = Path(path_state) if path_state else self._path / PLOTS_PATH / AGGREGATE_STATE_FILENAME
+        self._path_files = self._path_state.with_name(AGGREGATE_FILES_FILENAME)
+        self._files, self._setpoints, self._unsaved = set(), {}, []
+        self._n_files_saved, self._n_bytes_saved = 0, 0
+        self._dirs, self._pool = {}, None  # the mtime and the sub-folders of each folder, when it was last listed
+        if self._path_state.is_file():
+            with open(self._path_state, 'r') as fp:
+                state = yaml.safe_load(fp) or {}
+            self._setpoints = state.get('setpoints', {})
+            self._unsaved = list(state.get('files', []))  # the list of the files was kept in the yaml before
+            if state.get('n_files') and self._path_files.is_file():
+                with open(self._path_files, 'rb') as fp:
+                    lines = list(islice(fp, state['n_files']))
+                self._files = {line.decode().rstrip('\n') for line in lines}
+                self._n_files_saved, self._n_bytes_saved = len(lines), sum(map(len, lines))
+            self._files.update(self._unsaved)
+
+    def __len__(self) -> int:
+        return len(self._setpoints)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _new_files(self) -> List[Path]:
+        """ The images that were not read yet, from the folders whose mtime changed since they were listed. """
+        new_files, stack = [], [self._path]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = path.stat().st_mtime_ns
+            except OSError:
+                continue
+            if path in self._dirs and self._dirs[path][0] == mtime:  # no file was added to it
+                stack.extend(self._dirs[path][1])
+                continue
+            subdirs = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(Path(entry.path))
+                    elif entry.name.endswith('.npy') and 'mask' not in entry.path:
+                        name = Path(entry.path).relative_to(self._path).as_posix()
+                        if name not in self._files:
+                            new_files.append(Path(entry.path))
+            self._dirs[path] = (mtime, subdirs)
+            stack.extend(subdirs)
+        return new_files
+
+    def update(self) -> int:
+        """ Adds the images that were written since the last update, and returns their number. """
+        new_files = self._new_files()
+        if not new_files:
+            return 0
+        if len(new_files) < AGGREGATE_INLINE_FILES:
+            images = map(load_np_to_dict, new_files)
+        else:
+            self._pool = self._pool or Pool(cpu_count())
+            images = self._pool.imap(load_np_to_dict, new_files)
+        for path, (_, image) in zip(new_files, images):
+            setpoint, t, values = _split_name(path.stem)
+            entry = self._setpoints.setdefault(setpoint, dict(time=t, values=values, sum=0.0, n_pixels=0, n_images=0))
+            entry['sum'] += float(image.sum(dtype='float64'))
+            entry['n_pixels'] += int(image.size)
+            entry['n_images'] += 1
+            name = path.relative_to(self._path).as_posix()
+            self._files.add(name)
+            self._unsaved.append(name)
+        self._save()
+        return len(new_files)
+
+    def _save(self) -> None:
+        check_and_make_path(self._path_state.parent)
+        if self._unsaved:
+            lines = ''.join(f'{name}\n' for name in self._unsaved).encode()
+            with open(self._path_files, 'ab') as fp:
+                fp.truncate(self._n_bytes_saved)  # the lines of an update that did not finish
+                fp.write(lines)
+            self._n_files_saved, self._n_bytes_saved = self._n_files_saved + len(self._unsaved), \
+                self._n_bytes_saved + len(lines)
+            self._unsaved = []
+        path_tmp = self._path_state.with_suffix('.tmp')
+        with open(path_tmp, 'w') as fp:
+            yaml.safe_dump(dict(n_files=self._n_files_saved, setpoints=self._setpoints), stream=fp,
+                           default_flow_style=None)
+        path_tmp.replace(self._path_state)
+
+    @property
+    def results(self) -> List[Dict[str, float]]:
+        """ The values of each setpoint with the mean of its images as 'measurement' and the seconds since the
+        first setpoint as DATETIME, sorted by name - the same as get_averages_and_values_of_files_in_path(). """
+        names = sorted(self._setpoints)
+        if not names:
+            return []
+        t_first = self._setpoints[names[0]]['time']
+        return [{DATETIME: float(int(self._setpoints[n]['time'] - t_first)), **self._setpoints[n]['values'],
+                 'measurement': self._setpoints[n]['sum'] / max(1, self._setpoints[n]['n_pixels'])} for n in names]
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """ The results as a column per key, sorted by the blackbody temperature, ready to be plotted. """
+        results = self.results
+        if not results:
+            return {}
+        keys = list(dict.fromkeys(k for r in results for k in r))
+        columns = {k: np.array([r.get(k, np.nan) for r in results]) for k in keys}
+        order = np.argsort(columns['blackbody'], kind='stable') if 'blackbody' in columns else slice(None)
+        return {k: v[order] for k, v in columns.items()}
 
 
 def set_ax_format(ax, n_ticks: int):
@@ -185,90 +294,58 @@ def group_same_blackbody_temperatures(results: List[Dict[str, float]]) -> Dict[f
     return clustered_results
 
 
-def plot_clustered(results, path_to_save: Path):
-    clustered_results = group_same_blackbody_temperatures(results)
-    for blackbody_temperature in clustered_results.keys():
-        measurements = [item['measurement'] for item in clustered_results[blackbody_temperature]]
-        fpa = [item[T_FPA] for item in clustered_results[blackbody_temperature]]
-        housing = [item[T_HOUSING] for item in clustered_results[blackbody_temperature]]
-        time_running = [item[DATETIME] for item in clustered_results[blackbody_temperature]]
-        # plot_3d([fpa, housing, measurements],
-        #         path_to_save / Path(f"3d_{blackbody_temperature:.2f}C.png"),
-        #         'FPA', 'Housing', 'Measurements', f"Blackbody temperature {blackbody_temperature:.2f}C",
-        #         use_scatter=True)
-        p = partial(plot, dict_of_y_values=dict(measurement=measurements), yaxis_label='Measurements [$C^\circ$]',
-                    use_scatter=True, title=f"Blackbody temperature {blackbody_temperature:.2f}C", mark_mean=False)
-        p(x_values=fpa, xaxis_label='FPA Temperature [$C^\circ$]',
-          full_save_path=path_to_save / Path(f"fpa_{blackbody_temperature:.2f}C.png"))
-        p(x_values=housing, xaxis_label='Housing Temperature [$C^\circ$]',
-          full_save_path=path_to_save / f"housing_{blackbody_temperature:.2f}C.png")
-
-        plot_double_sides(dict_of_y_right={T_FPA: fpa, T_HOUSING: housing}, x_values=time_running,
-                          save_path=path_to_save / f"time_{blackbody_temperature:.2f}C.png",
-                          y_values_left=measurements, y_values_right_names=(T_FPA, T_HOUSING),
-                          y_label_left='Measurements [Levels]', y_label_right=TEMPERATURE_LABEL)
-
-
-def plot_diff(results, path_to_save):
-    fpa = [item[T_FPA] for item in results]
-    housing = [item[T_HOUSING] for item in results]
-    diff = [abs(item['blackbody'] - item['measurement']) for item in results]
-    p = partial(plot, dict_of_y_values=dict(difference=diff), yaxis_label='Difference [$C^\circ$]', mark_mean=True,
-                use_scatter=True, title=f"Difference between real and measured temperatures")
-    p(x_values=fpa, xaxis_label='FPA Temperature [$C^\circ$]',
-      full_save_path=Path(path_to_save) / Path(f"diff_fpa.png"))
-    p(x_values=housing, xaxis_label='Housing Temperature [$C^\circ$]',
-      full_save_path=Path(path_to_save) / Path(f"diff_housing.png"))
-
-
-def plot_3d_fpa_housing_diff(results, path_to_save: Path) -> None:
-    plot_3d([[item['blackbody'] for item in results],
-             [item['measurement'] for item in results],
-             [item[T_FPA] for item in results]], Path(path_to_save) / Path('3d_fpa.png'),
-            'Blackbody [$C^\circ$]', 'Measurement [$C^\circ$]', 'FPA [$C^\circ$]',
-            mark_mean=True, title='Measurement as a function of FPA and blackbody [$C^\circ$]', use_scatter=True)
-    plot_3d([[item['blackbody'] for item in results],
-             [item['measurement'] for item in results],
-             [item[T_HOUSING] for item in results]], Path(path_to_save) / Path('3d_housing.png'),
-            'Blackbody [$C^\circ$]', 'Measurement [$C^\circ$]', 'Housing [$C^\circ$]',
-            mark_mean=True, title='Measurement as a function of Housing and blackbody [$C^\circ$]', use_scatter=True)
-    plot_3d([[item[T_HOUSING] for item in results],
-             [item[T_FPA] for item in results],
-             [abs(item['blackbody'] - item['measurement']) for item in results]],
-            Path(path_to_save) / Path('3d_diff.png'),
-            'Housing [$C^\circ$]', 'FPA [$C^\circ$]', 'Difference [$C^\circ$]',
-            title='Difference as a function of Housing and FPA [$C^\circ$]', use_scatter=True)
+def report_plots(results: Dict[str, np.ndarray], path_to_save: Path) -> Dict[Path, PlotSpec]:
+    """ The plots of the report of an experiment, from the arrays of ExperimentAggregator. """
+    path_to_save = Path(path_to_save)
+    measurement, bb, fpa, housing = results['measurement'], results['blackbody'], results[T_FPA], results[T_HOUSING]
+    diff = np.abs(bb - measurement)
+    plots = {path_to_save / 'meas_vs_bb.png': PlotSpec(
+        'scatter', bb, dict(measurement=measurement), 'Blackbody Temperature [$C^\\circ$]',
+        'Measured Temperature [$C^\\circ$]', 'Real Vs Measured Temperature', mark_mean=True)}
+    for name, x, label in ((T_FPA, fpa, 'FPA'), (T_HOUSING, housing, 'Housing')):
+        plots[path_to_save / f'diff_{name}.png'] = PlotSpec(
+            'scatter', x, dict(difference=diff), f'{label} Temperature [$C^\\circ$]', 'Difference [$C^\\circ$]',
+            'Difference between real and measured temperatures', mark_mean=True)
+        plots[path_to_save / f'3d_{name}.png'] = PlotSpec(
+            '3d', bb, {'Measurement [$C^\\circ$]': measurement, f'{label} [$C^\\circ$]': x}, 'Blackbody [$C^\\circ$]',
+            title=f'Measurement as a function of {label} and blackbody [$C^\\circ$]', mark_mean=True)
+    plots[path_to_save / '3d_diff.png'] = PlotSpec(
+        '3d', housing, {'FPA [$C^\\circ$]': fpa, 'Difference [$C^\\circ$]': diff}, 'Housing [$C^\\circ$]',
+        title='Difference as a function of Housing and FPA [$C^\\circ$]')
+    for blackbody_temperature in np.unique(bb):
+        mask = bb == blackbody_temperature
+        title = f"Blackbody temperature {blackbody_temperature:.2f}C"
+        for name, x, label in ((T_FPA, fpa, 'FPA'), (T_HOUSING, housing, 'Housing')):
+            plots[path_to_save / f"{name}_{blackbody_temperature:.2f}C.png"] = PlotSpec(
+                'scatter', x[mask], dict(measurement=measurement[mask]), f'{label} Temperature [$C^\\circ$]',
+                'Measurements [$C^\\circ$]', title)
+        plots[path_to_save / f"time_{blackbody_temperature:.2f}C.png"] = PlotSpec(
+            'twin', results[DATETIME][mask], dict(measurements=measurement[mask]), 'Time [Seconds]',
+            'Measurements [Levels]', title, y_right={T_FPA: fpa[mask], T_HOUSING: housing[mask]},
+            ylabel_right=TEMPERATURE_LABEL)
+    return plots
 
 
 def process_plot_images_comparison(path_to_experiment: (Path, str), semaphore: Semaphore, flag) -> None:
     path_to_save = path_to_experiment / PLOTS_PATH / 'camera'
     check_and_make_path(path_to_save)
-    while flag:
-        semaphore.acquire()
-        plot_images_cmp(path_to_experiment, path_to_save)
-
-
-def plot_images_cmp(path_to_experiment, path_to_save):
-    results = get_averages_and_values_of_files_in_path(path_to_experiment)
+    with ExperimentAggregator(path_to_experiment) as aggregator, ReportRenderer() as renderer:
+        while flag:
+            semaphore.acquire()
+            if aggregator.update():
+                plot_images_cmp(path_to_experiment, path_to_save, aggregator=aggregator, renderer=renderer)
+
+
+def plot_images_cmp(path_to_experiment, path_to_save, aggregator: (ExperimentAggregator, None) = None,
+                    renderer: (ReportRenderer, None) = None) -> Dict[str, str]:
+    """ Renders the report of the experiment, and returns the errors of the plots that failed. """
+    if aggregator is None:
+        with ExperimentAggregator(path_to_experiment) as aggregator:
+            aggregator.update()
+    results = aggregator.arrays()
     if not results:
-        return
-    results.sort(key=lambda x: x['blackbody'])
-    # try:
-    #     plot_3d_fpa_housing_diff(results.copy(), path_to_save)
-    # except:
-    #     pass
-    try:
-        plot_clustered(results.copy(), path_to_save)
-    except:
-        pass
-    # try:
-    #     plot_diff(results.copy(), path_to_save)
-    # except:
-    #     pass
-    try:
-        plot(dict(measurement=[item['measurement'] for item in results]),
-             [item['blackbody'] for item in results],
-             path_to_save / 'meas_vs_bb.png', yaxis_label='Measured Temperature [$C^\circ$]',
-             title='Real Vs Measured Temperature', use_scatter=True, mark_mean=True)
-    except:
-        pass
+        return {}
+    if renderer is None:
+        with ReportRenderer() as renderer:
+            return renderer.render(report_plots(results, path_to_save))
+    return renderer.render(report_plots(results, path_to_save))
@@ -0,0 +1,114 @@
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+from time import time_ns
+from typing import List, Tuple, Union
+
+import yaml
+from tqdm import tqdm
+
+from utils.store import CODECS, MeasurementStore, decode_chunk, encode_chunk
+
+ARCHIVE_INDEX_FILENAME = 'archive.yaml'
+ARCHIVE_DEFAULT_SETTINGS = ('zlib:1', 'zlib:1:shuffle', 'zlib:1:delta,shuffle', 'zlib:6:delta,shuffle',
+                            'lzma:1:delta,shuffle', 'bz2:9:delta,shuffle', 'zstd:3:delta,shuffle',
+                            'lz4:1:delta,shuffle')
+
+
+def parse_setting(setting: str) -> dict:
+    """ 'codec[:level[:filter,filter]]' -> dict(codec, level, filters). e.g. 'zlib:1:delta,shuffle' """
+    codec, *rest = setting.split(':')
+    level = int(rest[0]) if rest else 1
+    filters = tuple(f for f in rest[1].split(',') if f) if len(rest) > 1 else ()
+    return dict(codec=codec, level=level, filters=filters)
+
+
+def _reencode_chunk(args: tuple) -> Tuple[bytes, int, int]:
+    """ Runs in a worker - reads one chunk of the source store, and encodes it with the target encoding.
+    Returns the encoded chunk, the raw size of its frames in bytes, and the time it took to encode it in ns. """
+    path_chunk, src_encoding, frame_shape, dst_encoding = args
+    with open(path_chunk, 'rb') as fp:
+        frames = decode_chunk(fp.read(), src_encoding['codec'], src_encoding['filters'], frame_shape)
+    t_start_ns = time_ns()
+    data = encode_chunk(frames, **dst_encoding)
+    return data, frames.nbytes, time_ns() - t_start_ns
+
+
+def summarize_chunks(store: MeasurementStore) -> List[dict]:
+    """ The range of frames, time, FPA, housing and blackbody of each chunk in the store. """
+    summary = []
+    starts, stats = store.chunk_starts, store.chunk_stats
+    for idx in range(store.n_chunks):
+        entry = dict(chunk=idx, start=int(starts[idx]), n_frames=int(starts[idx + 1] - starts[idx]))
+        for name in store.column_names:
+            entry[name] = [int(stats[f'{name}_min'][idx]), int(stats[f'{name}_max'][idx])]
+        summary.append(entry)
+    return summary
+
+
+def archive_store(path_src: Union[str, Path], path_dst: Union[str, Path], codec: str = 'zlib', level: int = 1,
+                  filters: tuple = ('shuffle',), n_workers: Union[int, None] = None,
+                  verbose: bool = True) -> dict:
+    """ Re-encodes the chunks of a measurement store into an archive store, in a pool of n_workers processes.
+
+    The archive is a MeasurementStore itself, so it is read the same way. It also holds archive.yaml, an index
+    of the encoding and of the time, FPA, housing and blackbody range of each chunk.
+    Archiving can be resumed - the chunks already in the archive are skipped.
+    Returns the throughput and compression ratio of the run.
+    """
+    src = MeasurementStore(path_src, mode='r')
+    dst = MeasurementStore(path_dst, mode='a', codec=codec, level=level, filters=filters, frame_shape=src.frame_shape,
+                           columns=src.column_names)
+    if dst.encoding != dict(codec=codec, level=level, filters=tuple(filters)):
+        raise ValueError(f'The archive {path_dst} is encoded with {dst.encoding}, expected {codec, level, filters}.')
+    starts = src.chunk_starts
+    tasks = [(src.path_chunk(idx), src.encoding, src.frame_shape, dst.encoding)
+             for idx in range(dst.n_chunks, src.n_chunks)]
+    n_bytes_raw = n_bytes_archived = encode_ns = 0
+    t_start_ns = time_ns()
+    with Pool(max(1, min(n_workers or cpu_count(), len(tasks)))) as pool:
+        results = pool.imap(_reencode_chunk, tasks)
+        for idx, (data, n_bytes, chunk_ns) in enumerate(tqdm(results, total=len(tasks), desc='Archiving',
+                                                             disable=not verbose), start=dst.n_chunks):
+            start, end = int(starts[idx]), int(starts[idx + 1])
+            columns = {name: src[name][start:end] for name in src.column_names}
+            dst.append_encoded(data, n_frames=end - start, **columns)
+            n_bytes_raw, n_bytes_archived, encode_ns = n_bytes_raw + n_bytes, n_bytes_archived + len(data), \
+                encode_ns + chunk_ns
+    stats = _make_stats(dst.encoding, n_chunks=len(tasks), n_bytes_raw=n_bytes_raw, n_bytes_archived=n_bytes_archived,
+                        wall_ns=time_ns() - t_start_ns, encode_ns=encode_ns)
+    index = dict(source=str(Path(path_src).resolve()), encoding=dict(dst.encoding, filters=list(filters)),
+                 n_frames=len(dst), n_chunks=dst.n_chunks, last_run=stats, chunks=summarize_chunks(dst))
+    with open(Path(path_dst) / ARCHIVE_INDEX_FILENAME, 'w') as fp:
+        yaml.safe_dump(index, stream=fp, default_flow_style=None, sort_keys=False)
+    return stats
+
+
+def benchmark_codecs(path_src: Union[str, Path], settings: tuple = ARCHIVE_DEFAULT_SETTINGS, n_chunks: int = 4,
+                     n_workers: Union[int, None] = None) -> List[dict]:
+    """ Encodes the first n_chunks chunks of the store with each setting in a pool of n_workers processes,
+    and returns the throughput and compression ratio of each. Settings of codecs that are not installed are skipped.
+    The chunks are only encoded, nothing is written. """
+    src = MeasurementStore(path_src, mode='r')
+    results = []
+    for setting in map(parse_setting, settings):
+        if setting['codec'] not in CODECS:
+            continue
+        tasks = [(src.path_chunk(idx), src.encoding, src.frame_shape, setting)
+                 for idx in range(min(n_chunks, src.n_chunks))]
+        t_start_ns = time_ns()
+        with Pool(max(1, min(n_workers or cpu_count(), len(tasks)))) as pool:
+            encoded = pool.map(_reencode_chunk, tasks)
+        results.append(_make_stats(setting, n_chunks=len(tasks), n_bytes_raw=sum(e[1] for e in encoded),
+                                   n_bytes_archived=sum(len(e[0]) for e in encoded),
+                                   wall_ns=time_ns() - t_start_ns, encode_ns=sum(e[2] for e in encoded)))
+    return results
+
+
+def _make_stats(encoding: dict, *, n_chunks: int, n_bytes_raw: int, n_bytes_archived: int, wall_ns: int,
+                encode_ns: int) -> dict:
+    return dict(setting=f"{encoding['codec']}:{encoding['level']}:{','.join(encoding['filters'])}",
+                n_chunks=n_chunks, raw_mb=n_bytes_raw / 2 ** 20, archived_mb=n_bytes_archived / 2 ** 20,
+                ratio=n_bytes_raw / max(1, n_bytes_archived),
+                throughput_mb_s=(n_bytes_raw / 2 ** 20) / max(1e-9, 1e-9 * wall_ns),
+                per_core_mb_s=(n_bytes_raw / 2 ** 20) / max(1e-9, 1e-9 * encode_ns))
+
@@ -30,7 +30,7 @@ def args_var_bb_fpa():
         'Set the oven to the highest temperature possible and cycle the Blackbody to different Tbb.'
         'If --random is set, the Blackbody temperature is chosen randomly. ' 
         'Otherwise, it is chosen by --blackbody_increments .'
-        'The images are saved as npz files, ordered by the time they were taken (key=time_ns).'
+        'The images are saved in a measurement store, ordered by the time they were taken (key=time_ns).'
         'If blackbody_min == blackbody_max and blackbody_increments = 0, outputs a constant bb temperature.')
     parser.add_argument('--random', help=f"If True, the Blackbody temperature will be random.", action='store_true')
     
@@ -95,7 +95,7 @@ def args_fpa_with_ffc():
 
 def args_const_tbb():
     parser = _args_base('Set the oven to the highest temperature possible and measure a constant Blackbody temperature.'
-                        ' The images are saved as a dict in a pickle file.')
+                        ' The images are streamed into a measurement store.')
 
     # camera
     parser.add_argument('--tlinear', help=f"The grey levels are linear to the temperature as: 0.04 * t - 273.15.",
@@ -118,7 +118,7 @@ def args_const_fpa():
                         'The Oven temperature is first settled at the predefined temperature, '
                         'and when the temperature of the camera settles, '
                         'measurements of the BlackBody at different setpoints commence. '
-                        'The images are saved as a dict in a pickle file.')
+                        'The images are streamed into a measurement store, keyed by the blackbody setpoint.')
 
     parser.add_argument('--n_images', help="The number of images to capture for each point.", default=3000, type=int)
 
@@ -141,3 +141,54 @@ def args_const_fpa():
     parser.add_argument('--settling_time', help=f"The time in Minutes to wait for the camera temperature to settle "
                                                 f"in an Oven setpoint before measurement.", type=int, default=30)
     return parser.parse_args()
+
+
+def args_benchmark_frame_path():
+    parser = argparse.ArgumentParser(description='Benchmarks the Tau2 frame path on a synthetic TEAX stream, '
+                                                 'without a camera connected.')
+    parser.add_argument('--n_frames', help="The number of frames to stream through each implementation.",
+                        default=600, type=int)
+    return parser.parse_args()
+
+
+def args_archive():
+    parser = argparse.ArgumentParser(description='Archives a measurement store with a parallel, multi-core encoder, '
+                                                 'or benchmarks the encoders on it.')
+    parser.add_argument('--path', help="The folder of the measurement store.", required=True, type=str)
+    parser.add_argument('--output', help="The folder of the archive. Defaults to <path>_archive.", default='', type=str)
+    parser.add_argument('--setting', help="The encoding of the archive as codec:level:filters, "
+                                          "e.g. zlib:1:delta,shuffle", default='zlib:1:shuffle', type=str)
+    parser.add_argument('--n_workers', help="The number of processes. Defaults to the number of cores.",
+                        default=0, type=int)
+    parser.add_argument('--benchmark', help="Only report the throughput and compression ratio of each encoding "
+                                            "on the first chunks of the store.", action='store_true')
+    parser.add_argument('--n_chunks', help="The number of chunks to benchmark on.", default=4, type=int)
+    return parser.parse_args()
+
+
+def args_convert_pickle():
+    parser = argparse.ArgumentParser(description='Converts the pickle files of collect_constant_fpa.py and '
+                                                 'collect_constant_bb.py to measurement stores.')
+    parser.add_argument('paths', help="The pickle files, or folders to search for pickle files.", nargs='+', type=str)
+    return parser.parse_args()
+
+
+def args_catalog():
+    parser = argparse.ArgumentParser(description='Indexes the measurement stores and npz files of a campaign, '
+                                                 'and finds the frames in the given temperature ranges.')
+    parser.add_argument('--path', help="The folder of the campaign.", required=True, type=str)
+    parser.add_argument('--rebuild', help="Re-index everything, instead of only the new measurements.",
+                        action='store_true')
+    parser.add_argument('--fpa', help="The range of the FPA temperature in [C].", nargs=2, type=float, default=None)
+    parser.add_argument('--housing', help="The range of the housing temperature in [C].", nargs=2, type=float,
+                        default=None)
+    parser.add_argument('--blackbody', help="The range of the blackbody temperature in [C].", nargs=2, type=float,
+                        default=None)
+    return parser.parse_args()
+
+
+def args_livefeed():
+    parser = argparse.ArgumentParser(description='Shows the live frames of the camera.')
+    parser.add_argument('--correction', help="A correction table or a calibration npz file. If given, the frames are "
+                                             "shown as temperature images.", default='', type=str)
+    return parser.parse_args()
@@ -0,0 +1,137 @@
+from itertools import product
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+from tqdm import tqdm
+
+CALIBRATION_FILENAME = 'calibration.npz'
+CALIBRATION_BATCH_FRAMES = 2 ** 8  # frames read at once while fitting
+CALIBRATION_PIXEL_CHUNK = 2 ** 14  # pixels reduced at once, which bounds the float64 copy of a batch
+NEWTON_ITERATIONS = 4  # to invert a model of order_bb > 1
+
+
+class RadiometricCalibration:
+    """ A per-pixel polynomial model of the grey level of each pixel, as a function of the blackbody and FPA
+    temperatures:
+        GL(pixel) = sum over i <= order_bb, j <= order_fpa of coefficients[i, j](pixel) * Tbb^i * Tfpa^j
+
+    All the pixels share the same design matrix, so they are all fitted at once with the normal equations,
+    which are accumulated over batches of frames - the frames are read once, and are never all in memory.
+    The temperatures are centered and scaled before the fit, to keep the equations well conditioned.
+    The temperatures are in the units of the data it was fitted on, e.g. [C] after Data.U100C2C().
+    """
+
+    def __init__(self, order_bb: int = 2, order_fpa: int = 2) -> None:
+        assert order_bb >= 1 and order_fpa >= 0, \
+            f'Expected order_bb >= 1 and order_fpa >= 0, got {order_bb, order_fpa}.'
+        self.order_bb, self.order_fpa = order_bb, order_fpa
+        self.coefficients = None  # (order_bb + 1, order_fpa + 1, height, width)
+        self.rmse = None  # (height, width) the root mean square error of the fit of each pixel
+        self.loc = np.zeros(2)  # the center of blackbody, fpa
+        self.scale = np.ones(2)  # the scale of blackbody, fpa
+        self.low, self.high = -np.ones(2), np.ones(2)  # the range of blackbody, fpa that the model was fitted on
+
+    def __repr__(self) -> str:
+        shape = None if self.coefficients is None else self.coefficients.shape[2:]
+        return f'RadiometricCalibration(order_bb={self.order_bb}, order_fpa={self.order_fpa}, pixels={shape})'
+
+    @property
+    def terms(self) -> list:
+        """ The (i, j) powers of the blackbody and FPA temperatures of each term of the model. """
+        return list(product(range(self.order_bb + 1), range(self.order_fpa + 1)))
+
+    def _normalize(self, blackbody, fpa) -> tuple:
+        return ((np.asarray(blackbody, dtype='float64') - self.loc[0]) / self.scale[0],
+                (np.asarray(fpa, dtype='float64') - self.loc[1]) / self.scale[1])
+
+    def design_matrix(self, blackbody: np.ndarray, fpa: np.ndarray) -> np.ndarray:
+        """ The (n, n_terms) values of the terms of the model for n frames. """
+        u, v = self._normalize(blackbody, fpa)
+        return np.stack([u ** i * v ** j for i, j in self.terms], axis=-1)
+
+    def fit(self, data, batch_size: int = CALIBRATION_BATCH_FRAMES, pixel_chunk: int = CALIBRATION_PIXEL_CHUNK,
+            verbose: bool = True) -> 'RadiometricCalibration':
+        """ Fits the model of every pixel to the frames of a Data, or anything with frames, blackbody and fpa. """
+        blackbody, fpa = np.asarray(data.blackbody, dtype='float64'), np.asarray(data.fpa, dtype='float64')
+        self.loc = np.array([blackbody.mean(), fpa.mean()])
+        self.scale = np.array([max(np.ptp(blackbody) / 2, 1e-6), max(np.ptp(fpa) / 2, 1e-6)])
+        self.low, self.high = np.array([blackbody.min(), fpa.min()]), np.array([blackbody.max(), fpa.max()])
+        n_frames, (h, w) = len(blackbody), data.frames.shape[-2:]
+        n_terms, n_pixels = len(self.terms), h * w
+        if n_frames < n_terms:
+            raise ValueError(f'Expected at least {n_terms} frames to fit {n_terms} terms, got {n_frames}.')
+        xtx, xty, yty = np.zeros((n_terms, n_terms)), np.zeros((n_terms, n_pixels)), np.zeros(n_pixels)
+
+        for first in tqdm(range(0, n_frames, batch_size), desc='Calibration', disable=not verbose):
+            x = self.design_matrix(blackbody[first:first + batch_size], fpa[first:first + batch_size])
+            y = np.asarray(data.frames[first:first + batch_size]).reshape(len(x), n_pixels)
+            xtx += x.T @ x
+            for p in range(0, n_pixels, pixel_chunk):
+                y_chunk = y[:, p:p + pixel_chunk].astype('float64')
+                xty[:, p:p + pixel_chunk] += x.T @ y_chunk
+                yty[p:p + pixel_chunk] += np.einsum('np,np->p', y_chunk, y_chunk)
+
+        coefficients = np.linalg.lstsq(xtx, xty, rcond=None)[0]
+        rss = np.maximum(yty - np.einsum('tp,tp->p', coefficients, xty), 0)  # at the optimum, rss = y'y - c'X'y
+        self.rmse = np.sqrt(rss / n_frames).reshape(h, w)
+        self.coefficients = coefficients.reshape(self.order_bb + 1, self.order_fpa + 1, h, w)
+        return self
+
+    def _gl_polynomial(self, fpa) -> np.ndarray:
+        """ The per-pixel coefficients of GL as a polynomial in the normalized blackbody temperature,
+        for each FPA temperature. Returns (n, order_bb + 1, height, width). """
+        _, v = self._normalize(0, np.atleast_1d(fpa))
+        powers = v[:, None] ** np.arange(self.order_fpa + 1)  # (n, order_fpa + 1)
+        return np.einsum('nj,ijhw->nihw', powers, self.coefficients)
+
+    def predict(self, blackbody, fpa) -> np.ndarray:
+        """ The grey levels that the model expects for the given blackbody and FPA temperatures. """
+        u, _ = self._normalize(np.atleast_1d(blackbody), 0)
+        poly = self._gl_polynomial(fpa)
+        return np.einsum('ni,nihw->nhw', u[:, None] ** np.arange(self.order_bb + 1), poly)
+
+    def temperature(self, frames: np.ndarray, fpa, n_iterations: int = NEWTON_ITERATIONS) -> np.ndarray:
+        """ Inverts the model - the blackbody temperature that each pixel of the (n, height, width) frames sees,
+        given the FPA temperature of each frame.
+
+        The model is linear in the blackbody for order_bb=1, and is solved directly. Otherwise it is solved from
+        the linear term with a few Newton iterations, vectorized over the pixels.
+        """
+        frames = np.asarray(frames, dtype='float32')
+        squeeze = frames.ndim == 2
+        frames = frames[None] if squeeze else frames
+        poly = self._gl_polynomial(np.broadcast_to(fpa, (len(frames),))).astype('float32')
+        u = (frames - poly[:, 0]) / poly[:, 1]
+        if self.order_bb > 1:
+            powers = np.arange(1, self.order_bb + 1, dtype='float32')[None, :, None, None]
+            for _ in range(n_iterations):
+                u_pow = u[:, None] ** np.arange(self.order_bb + 1, dtype='float32')[None, :, None, None]
+                residual = np.einsum('nihw,nihw->nhw', poly, u_pow) - frames
+                slope = np.einsum('nihw,nihw->nhw', poly[:, 1:] * powers, u_pow[:, :-1])
+                u -= residual / slope
+        temperature = u * self.scale[0] + self.loc[0]
+        return temperature[0] if squeeze else temperature
+
+    def save(self, path: Union[str, Path]) -> Path:
+        """ Saves the coefficient cube to an npz file, or to calibration.npz if path is a folder. """
+        path = Path(path)
+        path = path / CALIBRATION_FILENAME if path.is_dir() else path
+        np.savez(path, coefficients=self.coefficients, rmse=self.rmse, loc=self.loc, scale=self.scale,
+                 low=self.low, high=self.high, order_bb=self.order_bb, order_fpa=self.order_fpa)
+        return path
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'RadiometricCalibration':
+        path = Path(path)
+        path = path / CALIBRATION_FILENAME if path.is_dir() else path
+        with np.load(path) as fp:
+            calibration = cls(order_bb=int(fp['order_bb']), order_fpa=int(fp['order_fpa']))
+            calibration.coefficients, calibration.rmse = fp['coefficients'], fp['rmse']
+            calibration.loc, calibration.scale = fp['loc'], fp['scale']
+            if 'low' in fp.files:
+                calibration.low, calibration.high = fp['low'], fp['high']
+            else:  # saved before the range was kept, when loc was the mean and not the middle of the range
+                calibration.low = calibration.loc - calibration.scale
+                calibration.high = calibration.loc + calibration.scale
+        return calibration
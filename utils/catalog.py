@@ -0,0 +1,254 @@
+import os
+from pathlib import Path
+from typing import List, NamedTuple, Tuple, Union
+
+import numpy as np
+import yaml
+
+from utils.archive import ARCHIVE_INDEX_FILENAME
+from utils.store import CHUNK_STATS_DTYPE, COLUMNS, STORE_META_FILENAME, MeasurementStore
+
+CATALOG_FILENAME = 'catalog.yaml'
+CATALOG_CHUNKS_FILENAME = 'catalog_chunks.bin'
+CATALOG_FRAMES_FILENAME = 'catalog_frames.bin'
+CATALOG_VERSION = 1
+TEMPERATURE_COLUMNS = ('fpa', 'housing', 'blackbody')  # kept in [100C], queried in [C]
+
+# each row is a chunk of a source: a chunk of a store, or a whole npz file. row is its first row in the frames table.
+CATALOG_CHUNK_DTYPE = np.dtype([('source', np.int32), ('chunk', np.int32), ('start', np.int64),
+                                ('n_frames', np.int64), ('row', np.int64)] + CHUNK_STATS_DTYPE.descr)
+
+# each row is a frame: its source, its index in the source and its columns
+CATALOG_FRAME_DTYPE = np.dtype([('source', np.int32), ('index', np.int64)] + list(COLUMNS.items()))
+
+
+class CatalogHit(NamedTuple):
+    """ Consecutive frames of a source that match a query. kind is either 'store' or 'npz'. """
+    path: Path
+    kind: str
+    frames: slice
+
+
+def find_sources(path: Union[str, Path]) -> Tuple[List[Path], List[Path]]:
+    """ The measurement stores and the npz files under path, sorted by name. Archives are skipped,
+    as they are copies of other stores. """
+    path = Path(path)
+    stores = sorted({p.parent for p in path.rglob(STORE_META_FILENAME)
+                     if not (p.parent / ARCHIVE_INDEX_FILENAME).is_file()})
+    npz = sorted(p for p in path.rglob('*.npz') if not any(s in p.parents for s in stores))
+    return stores, npz
+
+
+def _find_camera_params(path: Path, root: Path) -> dict:
+    """ The camera_params.yaml written by save_run_parameters() next to the source, or in one of its parents. """
+    for parent in (path, *path.parents):
+        if (parent / 'camera_params.yaml').is_file():
+            with open(parent / 'camera_params.yaml', 'r') as fp:
+                return yaml.safe_load(fp) or {}
+        if parent == root:
+            break
+    return {}
+
+
+def _to_catalog_range(name: str, low_high: tuple) -> tuple:
+    low, high = low_high
+    if name in TEMPERATURE_COLUMNS:
+        return int(np.floor(100 * low)), int(np.ceil(100 * high))
+    return low, high
+
+
+class Catalog:
+    """ An index of the frames of a measurement campaign, to find frames by their temperatures without opening them.
+
+    The catalog lives in the root of the campaign:
+        catalog.yaml       - the sources: the path, kind, size and camera parameters of each store and npz file.
+        catalog_chunks.bin - the range of frames, time and FPA, housing and blackbody temperatures of each chunk.
+        catalog_frames.bin - the source, index, time and temperatures of each frame.
+    update() adds the new sources and the chunks appended to the known stores since the last update.
+    Temperatures in queries are in [C], e.g. catalog.query(fpa=(30, 35), blackbody=(20, 40)).
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self._path = Path(path)
+        if (self._path / CATALOG_FILENAME).is_file():
+            with open(self._path / CATALOG_FILENAME, 'r') as fp:
+                self._meta = yaml.safe_load(fp)
+        else:
+            self._meta = dict(version=CATALOG_VERSION, n_chunks=0, n_frames=0, sources=[])
+        self._chunks = self._read_table(CATALOG_CHUNKS_FILENAME, CATALOG_CHUNK_DTYPE, self._meta['n_chunks'])
+        self._frames = self._read_table(CATALOG_FRAMES_FILENAME, CATALOG_FRAME_DTYPE, self._meta['n_frames'])
+
+    def _read_table(self, filename: str, dtype: np.dtype, count: int) -> np.ndarray:
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._path / filename, dtype=dtype, mode='r', shape=(count,))
+
+    def __repr__(self) -> str:
+        return f'Catalog({str(self._path)!r}, {len(self)} frames of {len(self.sources)} sources)'
+
+    def __len__(self) -> int:
+        return int(self._meta['n_frames'])
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def sources(self) -> List[dict]:
+        return self._meta['sources']
+
+    @property
+    def chunk_table(self) -> np.ndarray:
+        return self._chunks
+
+    @property
+    def frame_table(self) -> np.ndarray:
+        return self._frames
+
+    def path_source(self, source: int) -> Path:
+        return self._path / self.sources[source]['path']
+
+    def is_stale(self) -> bool:
+        """ True if the campaign has sources or chunks that are not in the catalog, or there is no catalog.
+        Nothing is written, and only the chunk index of each store is read. """
+        if not (self._path / CATALOG_FILENAME).is_file():
+            return True
+        known = {entry['path']: entry for entry in self.sources}
+        paths_stores, paths_npz = find_sources(self._path)
+        for path in paths_stores + paths_npz:
+            entry = known.get(path.relative_to(self._path).as_posix())
+            if entry is None or (path.is_dir() and MeasurementStore(path, mode='r').n_chunks > entry['n_chunks']):
+                return True
+        return False
+
+    def update(self, rebuild: bool = False) -> 'Catalog':
+        """ Scans the campaign and adds whatever is not in the catalog yet. rebuild=True re-indexes everything. """
+        if rebuild:
+            self._meta = dict(version=CATALOG_VERSION, n_chunks=0, n_frames=0, sources=[])
+        n_chunks, n_frames = self._meta['n_chunks'], self._meta['n_frames']
+        self._chunks = self._frames = None  # release the memory-maps before the tables are truncated
+        for filename, dtype, count in ((CATALOG_CHUNKS_FILENAME, CATALOG_CHUNK_DTYPE, n_chunks),
+                                       (CATALOG_FRAMES_FILENAME, CATALOG_FRAME_DTYPE, n_frames)):
+            with open(self._path / filename, 'ab') as fp:  # drops what an interrupted update left uncommitted
+                fp.truncate(count * dtype.itemsize)
+
+        known = {entry['path']: idx for idx, entry in enumerate(self.sources)}
+        paths_stores, paths_npz = find_sources(self._path)
+        with open(self._path / CATALOG_CHUNKS_FILENAME, 'ab') as fp_chunks, \
+                open(self._path / CATALOG_FRAMES_FILENAME, 'ab') as fp_frames:
+            for kind, path in [('store', p) for p in paths_stores] + [('npz', p) for p in paths_npz]:
+                rel = path.relative_to(self._path).as_posix()
+                if rel not in known:
+                    known[rel] = len(self.sources)
+                    self.sources.append(dict(path=rel, kind=kind, n_frames=0, n_chunks=0,
+                                             camera_params=_find_camera_params(path.parent, self._path)))
+                entry = self.sources[known[rel]]
+                chunks, frames = self._index_store(path, known[rel], entry) if kind == 'store' \
+                    else self._index_npz(path, known[rel], entry)
+                if not len(chunks):
+                    continue
+                chunks['row'] = n_frames + np.concatenate(([0], np.cumsum(chunks['n_frames'])[:-1]))
+                fp_chunks.write(chunks.tobytes())
+                fp_frames.write(frames.tobytes())
+                n_chunks, n_frames = n_chunks + len(chunks), n_frames + len(frames)
+                entry['n_chunks'] += len(chunks)
+                entry['n_frames'] += len(frames)
+        self._meta.update(n_chunks=n_chunks, n_frames=n_frames)
+        path_tmp = self._path / f'{CATALOG_FILENAME}.tmp'
+        with open(path_tmp, 'w') as fp:
+            yaml.safe_dump(self._meta, stream=fp, default_flow_style=None, sort_keys=False)
+        os.replace(path_tmp, self._path / CATALOG_FILENAME)  # commits the rows written above
+        self._chunks = self._read_table(CATALOG_CHUNKS_FILENAME, CATALOG_CHUNK_DTYPE, n_chunks)
+        self._frames = self._read_table(CATALOG_FRAMES_FILENAME, CATALOG_FRAME_DTYPE, n_frames)
+        return self
+
+    @staticmethod
+    def _index_store(path: Path, source: int, entry: dict) -> Tuple[np.ndarray, np.ndarray]:
+        """ The chunks of the store that were appended since it was last indexed, and their frames. """
+        store = MeasurementStore(path, mode='r')
+        if not entry['camera_params']:
+            entry['camera_params'] = store.attrs.get('camera_params', {})
+        first, starts = entry['n_chunks'], store.chunk_starts
+        chunks = np.zeros(store.n_chunks - first, dtype=CATALOG_CHUNK_DTYPE)
+        chunks['source'], chunks['chunk'] = source, np.arange(first, store.n_chunks)
+        chunks['start'], chunks['n_frames'] = starts[first:-1], np.diff(starts[first:])
+        stats = store.chunk_stats[first:]
+        for name in CHUNK_STATS_DTYPE.names:
+            chunks[name] = stats[name]
+        frames = np.zeros(len(store) - int(starts[first]), dtype=CATALOG_FRAME_DTYPE)
+        frames['source'], frames['index'] = source, np.arange(int(starts[first]), len(store))
+        for name in store.column_names:
+            frames[name] = store.column(name)[int(starts[first]):]
+        entry['unset'] = sorted(set(COLUMNS) - set(store.column_names))
+        return chunks, frames
+
+    @staticmethod
+    def _index_npz(path: Path, source: int, entry: dict) -> Tuple[np.ndarray, np.ndarray]:
+        """ An npz file is a single chunk, which is indexed once. Only its columns are read. """
+        if entry['n_chunks']:
+            return np.empty(0, dtype=CATALOG_CHUNK_DTYPE), np.empty(0, dtype=CATALOG_FRAME_DTYPE)
+        with np.load(path) as fp:
+            if 'frames' not in fp.files:
+                return np.empty(0, dtype=CATALOG_CHUNK_DTYPE), np.empty(0, dtype=CATALOG_FRAME_DTYPE)
+            fpa = np.atleast_1d(fp['fpa'])
+            frames = np.zeros(len(fpa), dtype=CATALOG_FRAME_DTYPE)
+            frames['source'], frames['index'], frames['fpa'] = source, np.arange(len(fpa)), fpa
+            for name in set(COLUMNS) - {'fpa'}:
+                if name in fp.files:
+                    frames[name] = np.broadcast_to(fp[name], (len(fpa),))
+        chunks = np.zeros(1 if len(frames) else 0, dtype=CATALOG_CHUNK_DTYPE)
+        if len(frames):
+            chunks['source'], chunks['n_frames'] = source, len(frames)
+            for name in COLUMNS:
+                chunks[f'{name}_min'], chunks[f'{name}_max'] = frames[name].min(), frames[name].max()
+        return chunks, frames
+
+    def chunks(self, **ranges) -> np.ndarray:
+        """ The rows of the chunks that may hold frames in all the given [low, high] ranges. """
+        mask = np.ones(len(self._chunks), dtype=bool)
+        for name, low_high in ranges.items():
+            low, high = _to_catalog_range(name, low_high)
+            mask &= (self._chunks[f'{name}_max'] >= low) & (self._chunks[f'{name}_min'] <= high)
+        return np.asarray(self._chunks[mask])
+
+    def select(self, **ranges) -> np.ndarray:
+        """ The rows of the frames in all the given [low, high] ranges. Only the frames of the chunks that overlap
+        the ranges are checked. """
+        chunks = self.chunks(**ranges)
+        if not len(chunks):
+            return np.empty(0, dtype=CATALOG_FRAME_DTYPE)
+        rows = np.concatenate([np.arange(row, row + n) for row, n in zip(chunks['row'], chunks['n_frames'])])
+        frames = np.asarray(self._frames[rows])
+        mask = np.ones(len(frames), dtype=bool)
+        for name, low_high in ranges.items():
+            low, high = _to_catalog_range(name, low_high)
+            mask &= (frames[name] >= low) & (frames[name] <= high)
+        return frames[mask]
+
+    def values(self, frames: np.ndarray, name: str) -> np.ndarray:
+        """ The column of the rows of select(), as floats with NaN for the frames of sources that do not keep it,
+        e.g. the blackbody of a store that was collected without one. """
+        unset = [idx for idx, entry in enumerate(self.sources) if name in entry.get('unset', [])]
+        if not unset:
+            return frames[name]
+        values = frames[name].astype('float64')
+        values[np.isin(frames['source'], unset)] = np.nan
+        return values
+
+    def query(self, **ranges) -> List[CatalogHit]:
+        """ The slices of frames in all the given [low, high] ranges, e.g. query(fpa=(30, 35), blackbody=(20, 40))
+        returns the frames with an FPA of 30C-35C that were taken of a blackbody at 20C-40C. """
+        frames = self.select(**ranges)
+        if not len(frames):
+            return []
+        breaks = np.flatnonzero((np.diff(frames['source']) != 0) | (np.diff(frames['index']) != 1)) + 1
+        firsts, lasts = np.concatenate(([0], breaks)), np.concatenate((breaks, [len(frames)])) - 1
+        return [CatalogHit(path=self.path_source(int(frames['source'][f])),
+                           kind=self.sources[int(frames['source'][f])]['kind'],
+                           frames=slice(int(frames['index'][f]), int(frames['index'][l]) + 1))
+                for f, l in zip(firsts, lasts)]
+
+
+def update_catalog(path: Union[str, Path], rebuild: bool = False) -> Catalog:
+    """ Adds the new measurements under path to its catalog, creating the catalog if needed. """
+    return Catalog(path).update(rebuild=rebuild)
@@ -1,20 +1,32 @@
 import argparse
+import sys
 from datetime import datetime
 from pathlib import Path
+import threading as th
 from time import sleep, time_ns
 from typing import Union, Tuple
-import multiprocessing as mp
-from zipfile import ZIP_DEFLATED, ZipFile
 import numpy as np
 import yaml
-from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from tqdm import tqdm
 
 from devices.BlackBodyCtrl import BlackBodyThread
 from devices.Camera import T_FPA, T_HOUSING
 from devices.Camera.CameraProcess import CameraCtrl
+from devices.Camera.FrameRing import FrameBatch
 from devices.Oven.OvenProcess import OVEN_RECORDS_FILENAME, OvenCtrl
 from devices.Oven.plots import plot_oven_records_in_path
+from utils.catalog import update_catalog
+from utils.store import StoreWriter
+
+
+def _append_batch(dict_meas: dict, batch: FrameBatch, blackbody: float) -> None:
+    dict_meas.setdefault('frames', []).append(batch.frames)
+    dict_meas.setdefault('blackbody', []).append(np.full(len(batch.frames), blackbody))
+    dict_meas.setdefault(T_FPA, []).append(batch.fpa)
+    dict_meas.setdefault(T_HOUSING, []).append(batch.housing)
+    dict_meas.setdefault('time_ns', []).append(batch.time_ns)
 
 
 def collect_measurements(bb_generator, blackbody, camera, n_samples, limit_fpa, t_ffc) -> dict:
@@ -28,41 +40,23 @@ def collect_measurements(bb_generator, blackbody, camera, n_samples, limit_fpa,
                 sleep(5)  # allows for thermal stabilization
                 while t_ffc == 0 and not camera.ffc:
                     sleep(0.5)
-                for _ in range(n_samples):
-                    fpa = camera.fpa
-                    dict_meas.setdefault('frames', []).append(camera.image)
-                    dict_meas.setdefault('blackbody', []).append(bb)
-                    dict_meas.setdefault(T_FPA, []).append(fpa)
-                    dict_meas.setdefault(T_HOUSING, []).append(camera.housing)
-                    dict_meas.setdefault('time_ns', []).append(time_ns())
+                batch = camera.grab_n(n_frames=n_samples, timeout=None)
+                fpa = int(batch.fpa[-1])
+                _append_batch(dict_meas, batch=batch, blackbody=bb)
                 progressbar.update()
                 progressbar.set_postfix_str(f'BB {bb:.1f}C, '
                                             f'FPA {fpa / 100:.1f}C, '
                                             f'Remaining {(limit_fpa - fpa) / 100:.1f}C')
 
                 if fpa >= limit_fpa:
-                    return dict_meas
-
-
-def mp_save_measurements_to_zip(path_to_save: Path, lock_new_meas: mp.Semaphore):
-    set_save_measurements = set()
-    path_zip = path_to_save / 'measurements.zip'
-    while True:
-        lock_new_meas.acquire()
-        for path in filter(lambda p: p not in set_save_measurements, path_to_save.glob('*.npz')):
-            set_save_measurements.add(path)
-            with ZipFile(path_zip, 'a', compression=ZIP_DEFLATED, compresslevel=9) as fp_zip:
-                fp_zip.write(path, arcname=path.name)
-            try:
-                path.unlink()  # try to remove the file that was zipped
-            except:
-                pass
+                    return {k: np.concatenate(v) for k, v in dict_meas.items()}
 
 
 def continuous_collection(*, bb_generator, blackbody, camera, n_samples, time_to_collect_minutes: int,
-                          sample_rate: int, filename: str, path_to_save: Path) -> None:
+                          sample_rate: int, writer: StoreWriter, path_to_save: Path) -> None:
+    """ Grabs the frames of each blackbody temperature straight into a slot of the writer, for
+    time_to_collect_minutes. The writer stores them in the background while the next temperature is collected. """
     assert time_to_collect_minutes > 0, f'time_to_collect_minutes must be positive, got {time_to_collect_minutes}.'
-    dict_meas = {}
     fpa = -float('inf')
 
     time_to_collect_ns, t_start_ns = time_to_collect_minutes * 6e10, time_ns()
@@ -71,21 +65,27 @@ def continuous_collection(*, bb_generator, blackbody, camera, n_samples, time_to
             blackbody.temperature = bb
             sleep(1)  # allows for thermal stabilization
             progressbar.set_description_str(f'BB {bb:.1f}C')
-            for _ in range(n_samples):
-                fpa = camera.fpa
-                dict_meas.setdefault('frames', []).append(camera.image)
-                dict_meas.setdefault('blackbody', []).append(bb)
-                dict_meas.setdefault(T_FPA, []).append(fpa)
-                dict_meas.setdefault(T_HOUSING, []).append(camera.housing)
-                dict_meas.setdefault('time_ns', []).append(time_ns())
-                progressbar.update()
+            slot, frames = writer.reserve()
+            batch = camera.grab_n(n_frames=n_samples, out=frames, timeout=None)
+            writer.commit(slot, n_frames=len(batch.frames), step=sample_rate, time_ns=batch.time_ns, fpa=batch.fpa,
+                          housing=batch.housing, blackbody=round(100 * bb))
+            fpa = int(batch.fpa[-1])
+            progressbar.update(len(batch.frames))
             time_remaining = 1e-9 * (time_to_collect_ns - (time_ns() - t_start_ns))
             progressbar.set_postfix_str(f'FPA {fpa / 100:.1f}C, Remaining {time_remaining:.1f} Seconds.')
             if time_remaining <= 0:
                 break
-    if sample_rate != 1:
-        dict_meas = {k: v[::sample_rate] for k, v in dict_meas.items()}
-    save_results(path_to_save=path_to_save, filename=filename, dict_meas=dict_meas)
+    th.Thread(target=save_oven_plot, kwargs=dict(path_to_save=path_to_save), daemon=True).start()
+
+
+def stop_writer(signum, frame, *, writer: StoreWriter, path_to_save: Path) -> None:
+    """ A signal handler that flushes the writer, catalogs the measurements and exits.
+    Bind the writer and the path with partial() before passing it to signal.signal(). """
+    print('\nFlushing the measurements to disk...', flush=True)
+    writer.close()
+    update_catalog(path_to_save)
+    print(f'Writer stopped: {writer.stats}', flush=True)
+    sys.exit(0)
 
 
 def save_results(path_to_save, filename, dict_meas):
@@ -96,14 +96,17 @@ def save_results(path_to_save, filename, dict_meas):
              fpa=fpa,
              housing=np.array(dict_meas[T_HOUSING]).astype('uint16'),
              blackbody=(100 * np.array(dict_meas['blackbody'])).astype('uint16'),
-             frames=np.stack(dict_meas['frames']).astype('uint16'))
+             frames=np.asarray(dict_meas['frames'] if isinstance(dict_meas['frames'], np.ndarray)
+                               else np.stack(dict_meas['frames']), dtype='uint16'))
+    save_oven_plot(path_to_save=path_to_save)
+
 
-    # save temperature plot
+def save_oven_plot(path_to_save: Path) -> None:
     try:
-        fig, ax = plt.subplots()
-        plot_oven_records_in_path(idx=0, fig=fig, ax=ax, path_to_log=path_to_save / OVEN_RECORDS_FILENAME)
-        plt.savefig(path_to_save / 'temperature.png')
-        plt.close()
+        fig = Figure()
+        FigureCanvasAgg(fig)  # renders off-screen, so the plot can be saved from any thread
+        plot_oven_records_in_path(idx=0, fig=fig, ax=fig.subplots(), path_to_log=path_to_save / OVEN_RECORDS_FILENAME)
+        fig.savefig(path_to_save / 'temperature.png')
     except:
         pass
 
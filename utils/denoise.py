@@ -0,0 +1,122 @@
+from multiprocessing import Pool, cpu_count, shared_memory
+from pathlib import Path
+from time import time_ns
+from typing import Union
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+from tqdm import tqdm
+
+from utils.store import MeasurementStore, decode_chunk, encode_chunk
+
+DENOISE_BATCH_FRAMES = 2 ** 8  # frames in the shared buffer of the workers
+
+_shm_worker = None  # the shared buffer, attached once by each worker
+
+
+def _attach(name: str) -> None:
+    global _shm_worker
+    _shm_worker = shared_memory.SharedMemory(name=name)
+
+
+def _filter_slice(args: tuple) -> None:
+    """ Runs in a worker - filters the frames [start, stop) of the shared buffer in place. """
+    shape, dtype, start, stop, sigma = args
+    frames = np.ndarray(shape, dtype=dtype, buffer=_shm_worker.buf)[start:stop]
+    frames[:] = gaussian_filter(frames, sigma=(0, sigma, sigma))
+
+
+def filter_frames(frames: np.ndarray, sigma: float, out: (np.ndarray, None) = None) -> np.ndarray:
+    """ Gaussian filter of a (n, height, width) stack of frames along the spatial axes only. """
+    return gaussian_filter(frames, sigma=(0, sigma, sigma), output=out)
+
+
+class GaussianDenoiser:
+    """ Gaussian filters stacks of frames along the spatial axes in a pool of n_workers processes.
+
+    The frames are copied into a buffer in shared memory, which each worker attached once when the pool started,
+    so no frame is ever pickled. Each worker filters its own slice of frames in place. Stacks that are larger than
+    batch_frames are filtered batch by batch, so any stack can be denoised, e.g. a memory-map.
+    Use as a context manager, or call close() to stop the workers and free the shared memory.
+    """
+
+    def __init__(self, sigma: float = 2, n_workers: Union[int, None] = None,
+                 batch_frames: int = DENOISE_BATCH_FRAMES) -> None:
+        self._sigma, self._batch_frames = sigma, batch_frames
+        self._n_workers = max(1, n_workers or cpu_count())
+        self._shm, self._pool = None, None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _ensure_buffer(self, nbytes: int) -> None:
+        if self._shm is not None and self._shm.size >= nbytes:
+            return
+        self.close()  # the workers are attached to the old buffer
+        self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._pool = Pool(self._n_workers, initializer=_attach, initargs=(self._shm.name,))
+
+    def __call__(self, frames: np.ndarray, out: (np.ndarray, None) = None) -> np.ndarray:
+        """ Returns the filtered frames. out=frames filters the frames in place. """
+        if not hasattr(frames, 'shape'):  # a list of frames
+            frames = np.stack(frames)
+        out = np.empty(frames.shape, dtype=frames.dtype) if out is None else out
+        n_frames, shape = len(frames), tuple(frames.shape[1:])
+        batch_frames = min(self._batch_frames, n_frames)
+        if batch_frames == 0:
+            return out
+        dtype = np.dtype(frames.dtype)
+        self._ensure_buffer(batch_frames * int(np.prod(shape)) * dtype.itemsize)
+        buffer = np.ndarray((batch_frames, *shape), dtype=dtype, buffer=self._shm.buf)
+        for first in range(0, n_frames, batch_frames):
+            n = min(batch_frames, n_frames - first)
+            buffer[:n] = frames[first:first + n]
+            bounds = np.linspace(0, n, min(self._n_workers, n) + 1).astype(int)
+            self._pool.map(_filter_slice, [((batch_frames, *shape), dtype.str, start, stop, self._sigma)
+                                           for start, stop in zip(bounds[:-1], bounds[1:])])
+            out[first:first + n] = buffer[:n]
+        del buffer
+        return out
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._shm is not None:
+            try:
+                self._shm.close()
+                self._shm.unlink()
+            except (BufferError, FileNotFoundError, OSError):
+                pass
+            self._shm = None
+
+
+def _denoise_chunk(args: tuple) -> bytes:
+    """ Runs in a worker - decodes one chunk of the source store, filters it and encodes it. """
+    path_chunk, encoding, frame_shape, sigma = args
+    with open(path_chunk, 'rb') as fp:
+        frames = decode_chunk(fp.read(), encoding['codec'], encoding['filters'], frame_shape)
+    return encode_chunk(filter_frames(frames, sigma), **encoding)
+
+
+def denoise_store(path_src: Union[str, Path], path_dst: Union[str, Path], sigma: float = 2,
+                  n_workers: Union[int, None] = None, verbose: bool = True) -> float:
+    """ Writes a copy of a measurement store with every frame Gaussian filtered, one chunk per worker at a time.
+    Can be resumed - the chunks already in the destination are skipped. Returns the time it took in seconds. """
+    src = MeasurementStore(path_src, mode='r')
+    dst = MeasurementStore(path_dst, mode='a', frame_shape=src.frame_shape, columns=src.column_names, **src.encoding)
+    starts = src.chunk_starts
+    tasks = [(src.path_chunk(idx), src.encoding, src.frame_shape, sigma) for idx in range(dst.n_chunks, src.n_chunks)]
+    t_start_ns = time_ns()
+    with Pool(max(1, min(n_workers or cpu_count(), len(tasks)))) as pool:
+        results = pool.imap(_denoise_chunk, tasks)
+        for idx, data in enumerate(tqdm(results, total=len(tasks), desc='Gaussian Filter', disable=not verbose),
+                                   start=dst.n_chunks):
+            start, end = int(starts[idx]), int(starts[idx + 1])
+            dst.append_encoded(data, n_frames=end - start, **{name: src[name][start:end] for name in src.column_names})
+    dst.set_attrs(**src.attrs, gaussian_sigma=sigma)
+    return 1e-9 * (time_ns() - t_start_ns)
@@ -9,6 +9,8 @@ import numpy as np
 from PIL import Image
 from tqdm import tqdm
 
+from utils.pixel_stats import PixelStats
+
 
 def show_image(image: (Image.Image, np.ndarray), title=None, v_min=None, v_max=None, to_close: bool = True,
                show_axis: bool = False):
@@ -77,8 +79,10 @@ def save_average_from_images(path: (Path, str), suffix: str = 'npy'):
             continue
         images_list = list(dir_path.glob(f'*.{suffix}'))
         if images_list:
-            avg = np.mean(np.stack(
-                [np.load(str(x)) for x in dir_path.glob(f'*.{suffix}')]), 0).astype('uint16')
+            stats = PixelStats()
+            for x in images_list:  # one image in memory at a time
+                stats.update(np.load(str(x))[None])
+            avg = stats.mean.astype('uint16')
             np.save(str(dir_path / 'average.npy'), avg)
             normalize_image(avg).save(
                 str(dir_path / 'average.jpeg'), format='jpeg')
@@ -0,0 +1,109 @@
+from pathlib import Path
+from typing import Iterable, Union
+
+import numpy as np
+
+
+class PixelStats:
+    """ Single-pass per-pixel mean, variance, min and max of a stream of frames.
+
+    Frames are added a batch at a time with update(), so only one batch is ever in memory.
+    Each batch is reduced on its own and merged into the running statistics (Chan et al.), and two PixelStats of
+    different parts of a run can be merged the same way - e.g. the statistics of chunks computed in other processes.
+    The mean is kept as a float64 sum, which is exact for integer frames, so it is the same as np.mean(frames, 0).
+    The variance is the population variance, same as np.var(frames, axis=0).
+    """
+
+    def __init__(self, shape: (tuple, None) = None) -> None:
+        self.count = 0
+        self._sum = self._m2 = self._min = self._max = None
+        if shape is not None:
+            self._reset(tuple(shape))
+
+    def _reset(self, shape: tuple) -> None:
+        self._sum, self._m2 = np.zeros(shape), np.zeros(shape)
+        self._min, self._max = np.full(shape, np.inf), np.full(shape, -np.inf)
+
+    def __repr__(self) -> str:
+        return f'PixelStats({self.count} frames of shape {self.shape})'
+
+    @property
+    def shape(self) -> (tuple, None):
+        return None if self._sum is None else self._sum.shape
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self._sum / max(1, self.count)
+
+    @property
+    def var(self) -> np.ndarray:
+        return self._m2 / max(1, self.count)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.var)
+
+    @property
+    def min(self) -> np.ndarray:
+        return self._min
+
+    @property
+    def max(self) -> np.ndarray:
+        return self._max
+
+    def update(self, frames: np.ndarray) -> 'PixelStats':
+        """ Adds a batch of frames of shape (n, height, width). """
+        frames = np.asarray(frames)
+        if len(frames) == 0:
+            return self
+        sum_ = frames.sum(0, dtype='float64')
+        m2 = np.square(frames - sum_ / len(frames)).sum(0)
+        return self._merge(len(frames), sum_, m2, frames.min(0), frames.max(0))
+
+    def merge(self, other: 'PixelStats') -> 'PixelStats':
+        """ Adds the frames that other was updated with. """
+        if other.count == 0:
+            return self
+        return self._merge(other.count, other._sum, other._m2, other._min, other._max)
+
+    def _merge(self, count: int, sum_: np.ndarray, m2: np.ndarray, min_: np.ndarray,
+               max_: np.ndarray) -> 'PixelStats':
+        if self._sum is None:
+            self._reset(sum_.shape)
+        if sum_.shape != self._sum.shape:
+            raise ValueError(f'Expected frames of shape {self._sum.shape}, got {sum_.shape}.')
+        total = self.count + count
+        if self.count:
+            delta = sum_ / count - self._sum / self.count
+            self._m2 = self._m2 + m2 + np.square(delta) * (self.count * count / total)
+        else:
+            self._m2 = self._m2 + m2
+        self._sum = self._sum + sum_
+        np.minimum(self._min, min_, out=self._min)
+        np.maximum(self._max, max_, out=self._max)
+        self.count = total
+        return self
+
+    def __iadd__(self, other: 'PixelStats') -> 'PixelStats':
+        return self.merge(other)
+
+    def save(self, path: Union[str, Path]) -> None:
+        np.savez(path, count=self.count, sum=self._sum, m2=self._m2, min=self._min, max=self._max)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'PixelStats':
+        stats = cls()
+        with np.load(path) as fp:
+            stats.count = int(fp['count'])
+            if stats.count:
+                stats._sum, stats._m2, stats._min, stats._max = fp['sum'], fp['m2'], fp['min'], fp['max']
+        return stats
+
+
+def accumulate(batches: Iterable[np.ndarray]) -> PixelStats:
+    """ The per-pixel statistics of all the frames in an iterable of batches, e.g. store.frames.iter_chunks(). """
+    stats = PixelStats()
+    for batch in batches:
+        stats.update(batch)
+    return stats
+
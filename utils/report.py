@@ -0,0 +1,253 @@
+import multiprocessing as mp
+import queue
+import zlib
+from hashlib import sha1
+from pathlib import Path
+from time import time_ns
+from typing import Dict, NamedTuple, Optional, Union
+
+import numpy as np
+
+from utils.logger import make_logger, make_logging_handlers
+
+REPORT_WORKERS = 2  # rendering processes
+REPORT_N_TICKS = 10
+REPORT_MARGIN = 0.05  # of the range of the data, around it
+REPORT_POLL_SECONDS = 1  # how often render() checks that the rendering processes are alive while it waits
+REPORT_TIMEOUT_SECONDS = 120  # for all the plots of a report
+
+
+class PlotSpec(NamedTuple):
+    """ The data and labels of one plot of a report.
+
+    kind is 'scatter' - each y against x, 'twin' - y against x on the left axis and y_right on the right axis,
+    or '3d' - a scatter of x and the two y, which are named by the labels of their axes.
+    mark_mean adds the mean of each y at each (rounded) x.
+    """
+    kind: str
+    x: np.ndarray
+    y: Dict[str, np.ndarray]
+    xlabel: str = ''
+    ylabel: str = ''
+    title: str = ''
+    y_right: Optional[Dict[str, np.ndarray]] = None
+    ylabel_right: str = ''
+    mark_mean: bool = False
+
+    @property
+    def right(self) -> Dict[str, np.ndarray]:
+        """ y_right, empty if there is none. """
+        return self.y_right or {}
+
+    @property
+    def layout(self) -> tuple:
+        """ What the artists of the figure depend on - a figure is made again only when it changes. """
+        return self.kind, tuple(self.y), tuple(self.right), self.mark_mean
+
+    def digest(self) -> str:
+        """ A hash of the data and labels, to know if the plot changed since it was rendered. """
+        h = sha1(repr((self.kind, self.xlabel, self.ylabel, self.title, self.ylabel_right, self.mark_mean,
+                       tuple(self.y), tuple(self.right))).encode())
+        for values in (self.x, *self.y.values(), *self.right.values()):
+            h.update(np.ascontiguousarray(values, dtype='float64').tobytes())
+        return h.hexdigest()
+
+
+def _means_per_x(x: np.ndarray, y: np.ndarray) -> tuple:
+    vals, inverse = np.unique(np.round(x, 1), return_inverse=True)
+    return vals, np.bincount(inverse, weights=y) / np.bincount(inverse)
+
+
+def _limits(values) -> tuple:
+    values = np.concatenate([np.ravel(v) for v in values]) if values else np.zeros(1)
+    values = values[np.isfinite(values)]
+    low, high = (values.min(), values.max()) if len(values) else (0, 1)
+    margin = REPORT_MARGIN * (high - low) if high > low else 0.5
+    return low - margin, high + margin
+
+
+def _new_figure(plt, spec: PlotSpec) -> dict:
+    """ Creates the figure and artists of a plot, which are reused by _update_figure() on the next renders. """
+    from matplotlib.ticker import MaxNLocator
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection='3d' if spec.kind == '3d' else None)
+    figure = dict(fig=fig, ax=ax, layout=spec.layout, artists={})
+    for axis in (ax.xaxis, ax.yaxis):
+        axis.set_major_locator(MaxNLocator(REPORT_N_TICKS))
+    if spec.kind == '3d':
+        return figure
+    for name in spec.y:
+        if spec.kind == 'scatter':
+            figure['artists'][name] = ax.scatter([], [], label=name.capitalize())
+        else:
+            figure['artists'][name], = ax.plot([], [], label=name.capitalize(), color='red')
+        if spec.mark_mean:
+            figure['artists'][f'{name}_mean'], = ax.plot([], [], label=f'{name.capitalize()} Avg', color='red')
+    if spec.right:
+        figure['ax_right'] = ax.twinx()
+        for name, style in zip(spec.right, ['dashdot', 'dotted', 'dashed', 'solid']):
+            figure['artists'][f'right_{name}'], = figure['ax_right'].plot([], [], label=name.capitalize(),
+                                                                          linestyle=style)
+        figure['ax_right'].yaxis.set_major_locator(MaxNLocator(REPORT_N_TICKS))
+    ax.grid()
+    fig.legend() if spec.right else ax.legend()
+    return figure
+
+
+def _update_figure(figure: dict, spec: PlotSpec) -> None:
+    """ Sets the data of the artists of the figure, instead of drawing a new figure. """
+    ax, artists, x = figure['ax'], figure['artists'], np.asarray(spec.x)
+    if spec.kind == '3d':  # 3d collections cannot be updated in place
+        ax.cla()
+        ys = list(spec.y.values())
+        ax.scatter(x, *ys[:2])
+        if spec.mark_mean:
+            vals, inverse = np.unique(x, return_inverse=True)
+            means = [np.bincount(inverse, weights=y) / np.bincount(inverse) for y in ys[:2]]
+            ax.scatter(vals, *means, label='Average')
+        ax.set_xlabel(spec.xlabel)
+        ax.set_ylabel(list(spec.y)[0])
+        ax.set_zlabel(list(spec.y)[1])
+        ax.set_title(spec.title)
+        return
+    ax.set_title(spec.title)
+    ax.set_xlabel(spec.xlabel)
+    ax.set_ylabel(spec.ylabel)
+    for name, y in spec.y.items():
+        y = np.asarray(y)
+        if spec.kind == 'scatter':
+            artists[name].set_offsets(np.column_stack((x, y)))
+        else:
+            artists[name].set_data(x, y)
+        if spec.mark_mean:
+            artists[f'{name}_mean'].set_data(*_means_per_x(x, y))
+    ax.set_xlim(*_limits([x]))
+    ax.set_ylim(*_limits(list(spec.y.values())))
+    if spec.right:
+        for name, y in spec.right.items():
+            artists[f'right_{name}'].set_data(x, y)
+        figure['ax_right'].set_ylim(*_limits(list(spec.right.values())))
+        figure['ax_right'].set_ylabel(spec.ylabel_right)
+
+
+def _render_loop(queue_jobs: mp.Queue, queue_done: mp.Queue) -> None:
+    """ Runs in a rendering process - keeps the figure of each plot it rendered, and updates it on the next jobs.
+    A job is (path, spec), and None stops the loop. Puts (path, seconds, error) for each job. """
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    figures = {}
+    while True:
+        job = queue_jobs.get()
+        if job is None:
+            break
+        path, spec = job
+        t_start_ns, error = time_ns(), ''
+        try:
+            figure = figures.get(path)
+            if figure is None or figure['layout'] != spec.layout:
+                plt.close(figure['fig']) if figure else None
+                figure = figures[path] = _new_figure(plt, spec)
+            _update_figure(figure, spec)
+            figure['fig'].tight_layout()
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            figure['fig'].savefig(path)
+        except (ValueError, TypeError, KeyError, IndexError, OSError, RuntimeError) as err:
+            error = repr(err)
+        queue_done.put((path, 1e-9 * (time_ns() - t_start_ns), error))
+    plt.close('all')
+
+
+class ReportRenderer:
+    """ Renders the plots of a report in a pool of n_workers processes with the Agg backend.
+
+    Each plot always goes to the same process, which keeps its figure and only sets the new data of its artists.
+    Only the plots whose data changed since they were last rendered are sent to the processes.
+    If a process died the processes are restarted, and the plots that were not rendered yet fail and are retried
+    on the next render, as are the plots that were not rendered within REPORT_TIMEOUT_SECONDS.
+    The time each report took is logged. Use as a context manager, or call close() to stop the processes.
+    """
+
+    def __init__(self, n_workers: int = REPORT_WORKERS, verbose: bool = True) -> None:
+        self._n_workers = max(1, n_workers)
+        self._digests = {}
+        self._queues_jobs, self._queue_done, self._workers = [], None, []
+        self._log = make_logger('Report', make_logging_handlers(None, verbose))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _start(self) -> None:
+        self._queue_done = mp.Queue()
+        for _ in range(self._n_workers):
+            self._queues_jobs.append(mp.Queue())
+            self._workers.append(mp.Process(target=_render_loop, args=(self._queues_jobs[-1], self._queue_done),
+                                            daemon=True))
+            self._workers[-1].start()
+
+    def _restart_if_dead(self) -> bool:
+        """ Restarts all the rendering processes if one of them died, because a process that died while putting
+        its result can leave the shared queue of the results locked. Returns True if they were restarted. """
+        dead = [(idx, worker.exitcode) for idx, worker in enumerate(self._workers) if not worker.is_alive()]
+        if not dead:
+            return False
+        self._log.warning(f'Rendering processes died (index, exit code): {dead}, restarting them.')
+        self.close()
+        self._start()
+        return True
+
+    def render(self, plots: Dict[Union[str, Path], PlotSpec]) -> Dict[str, str]:
+        """ Renders the plots that changed, and waits for them. Returns the error of each plot that failed. """
+        t_start_ns = time_ns()
+        jobs = []
+        for path, spec in plots.items():
+            path, digest = str(path), spec.digest()
+            if self._digests.get(path) != digest:
+                jobs.append((path, spec))
+                self._digests[path] = digest
+        if jobs and not self._workers:
+            self._start()
+        elif jobs:
+            self._restart_if_dead()
+        pending = {}  # the index of the process of each plot that was not rendered yet
+        for path, spec in jobs:
+            pending[path] = zlib.crc32(path.encode()) % self._n_workers
+            self._queues_jobs[pending[path]].put((path, spec))
+        errors, busy = {}, 0.
+        while pending:
+            try:
+                path, seconds, error = self._queue_done.get(timeout=REPORT_POLL_SECONDS)
+            except queue.Empty:
+                if self._restart_if_dead():
+                    error = 'A rendering process died.'
+                elif time_ns() - t_start_ns > REPORT_TIMEOUT_SECONDS * 1e9:
+                    error = 'Timed out.'
+                else:
+                    continue
+                for path in pending:
+                    errors[path] = error
+                    self._digests.pop(path, None)  # retried on the next render
+                    self._log.warning(f'Failed to render {path}: {error}')
+                pending.clear()
+                continue
+            if pending.pop(path, None) is None:
+                continue  # a late result of a plot that already timed out
+            busy += seconds
+            if error:
+                errors[path] = error
+                self._digests.pop(path, None)  # retried on the next render
+                self._log.warning(f'Failed to render {path}: {error}')
+        self._log.info(f'Rendered {len(jobs)} of {len(plots)} plots in {1e-9 * (time_ns() - t_start_ns):.2f}s '
+                       f'({busy:.2f}s of rendering).')
+        return errors
+
+    def close(self) -> None:
+        for queue_jobs in self._queues_jobs:
+            queue_jobs.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            worker.terminate() if worker.is_alive() else None
+        self._queues_jobs, self._workers = [], []
@@ -0,0 +1,657 @@
+import atexit
+import bz2
+import lzma
+import multiprocessing as mp
+import os
+import pickle
+import queue
+import signal
+import threading as th
+import zlib
+from ctypes import c_double
+from multiprocessing import Pool, shared_memory
+from pathlib import Path
+from time import time_ns
+from typing import Iterator, Tuple, Union
+
+import numpy as np
+import yaml
+
+from devices.Camera import HEIGHT_IMAGE_TAU2, WIDTH_IMAGE_TAU2
+from utils.pixel_stats import PixelStats
+
+STORE_DIRNAME = 'measurements'
+STORE_META_FILENAME = 'store.yaml'
+STORE_INDEX_FILENAME = 'chunks.bin'
+STORE_STATS_FILENAME = 'chunk_stats.bin'
+STORE_FRAMES_DIRNAME = 'frames'
+STORE_VERSION = 1
+
+# the per-frame columns of the store. Temperatures are in [100C], same as the npz files.
+COLUMNS = dict(time_ns='int64', fpa='uint16', housing='uint16', blackbody='uint16')
+
+# each row commits one chunk of frames: the index of its first frame and the number of frames in it
+CHUNK_INDEX_DTYPE = np.dtype([('start', np.int64), ('n_frames', np.int64)])
+
+# the min and max of each column in each chunk, e.g. fpa_min and fpa_max. Written along with the index.
+CHUNK_STATS_DTYPE = np.dtype([(f'{name}_{stat}', dtype) for name, dtype in COLUMNS.items() for stat in ('min', 'max')])
+REQUIRED_COLUMNS = ('time_ns', 'fpa', 'housing')  # a store may leave the other columns unset, e.g. no blackbody
+
+STORE_CHUNK_FRAMES = 2 ** 8  # frames per chunk when a long acquisition is streamed into a store
+WRITER_SLOTS = 4
+WRITER_RESERVE_TIMEOUT_SECONDS = 10  # a slot is freed within a write, so waiting longer means the writer is stuck
+WRITER_POLL_SECONDS = 0.5  # how often reserve() checks that the writer is alive while it waits
+WRITER_CLOSE_TIMEOUT_SECONDS = 60  # of the close() on exit
+WRITER_STATS_KEYS = ('n_batches', 'n_frames', 'queue_depth_max', 'wait_mean_ms', 'wait_max_ms', 'write_mean_ms',
+                     'write_max_ms')
+_STOP = None  # sentinel that tells the writer to flush and exit
+
+# codec name -> (compress(data, level), decompress(data)). zstd and lz4 are used when their packages are installed.
+CODECS = dict(zlib=(lambda data, level: zlib.compress(data, level), zlib.decompress),
+              lzma=(lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+              bz2=(lambda data, level: bz2.compress(data, max(1, level)), bz2.decompress),
+              none=(lambda data, level: bytes(data), bytes))
+try:
+    import zstandard
+
+    CODECS['zstd'] = (lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+                      lambda data: zstandard.ZstdDecompressor().decompress(data))
+except ImportError:
+    pass
+try:
+    import lz4.frame
+
+    CODECS['lz4'] = (lambda data, level: lz4.frame.compress(data, compression_level=level), lz4.frame.decompress)
+except ImportError:
+    pass
+
+
+def _delta_encode(frames: np.ndarray) -> np.ndarray:
+    """ Keeps the first frame, and the difference of every other frame from the previous one (wraps in uint16). """
+    out = frames.copy()
+    np.subtract(frames[1:], frames[:-1], out=out[1:])
+    return out
+
+
+def _delta_decode(frames: np.ndarray) -> np.ndarray:
+    return np.cumsum(frames, axis=0, dtype=np.uint16)
+
+
+def _shuffle_encode(frames: np.ndarray) -> np.ndarray:
+    """ Groups the low bytes of all the pixels before the high bytes. The high bytes of 14-bit data barely change,
+    so they compress to almost nothing. """
+    return frames.view(np.uint8).reshape(-1, 2).T.copy().view(np.uint16).reshape(frames.shape)
+
+
+def _shuffle_decode(frames: np.ndarray) -> np.ndarray:
+    return frames.view(np.uint8).reshape(2, -1).T.copy().view(np.uint16).reshape(frames.shape)
+
+
+# filters are applied to the frames of a chunk in order before the codec, and undone in reverse order after it
+FILTERS = dict(delta=(_delta_encode, _delta_decode), shuffle=(_shuffle_encode, _shuffle_decode))
+
+
+def encode_chunk(frames: np.ndarray, codec: str, level: int, filters: tuple = ()) -> bytes:
+    frames = np.ascontiguousarray(frames, dtype=np.uint16)
+    for name in filters:
+        frames = FILTERS[name][0](frames)
+    return CODECS[codec][0](frames.data, level)
+
+
+def decode_chunk(data: bytes, codec: str, filters: tuple, frame_shape: tuple) -> np.ndarray:
+    frames = np.frombuffer(CODECS[codec][1](data), dtype=np.uint16).reshape(-1, *frame_shape)
+    for name in reversed(filters):
+        frames = FILTERS[name][1](frames)
+    return frames
+
+
+def _chunk_pixel_stats(args: tuple) -> PixelStats:
+    """ Runs in a worker - decodes one chunk, and reduces the selected frames in it. """
+    path_chunk, encoding, frame_shape, offsets = args
+    with open(path_chunk, 'rb') as fp:
+        frames = decode_chunk(fp.read(), encoding['codec'], encoding['filters'], frame_shape)
+    return PixelStats(frame_shape).update(frames if offsets is None else frames[offsets])
+
+
+class ChunkedFrames:
+    """ A read-only, lazily decompressed view of the frames of a MeasurementStore.
+
+    Supports len(), shape, integer and slice indexing and fancy indexing with an array of indices.
+    Only the chunks that hold the requested frames are read, and the last chunk read is cached.
+    """
+
+    def __init__(self, store: 'MeasurementStore') -> None:
+        self._store = store
+        self._cached_idx, self._cached_chunk = None, None
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self._store), *self._store.frame_shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype('uint16')
+
+    def chunk(self, idx: int) -> np.ndarray:
+        if idx != self._cached_idx:
+            self._cached_chunk, self._cached_idx = self._store.read_chunk(idx), idx
+        return self._cached_chunk
+
+    def iter_chunks(self) -> Iterator[np.ndarray]:
+        for idx in range(self._store.n_chunks):
+            yield self._store.read_chunk(idx)
+
+    def __getitem__(self, item) -> np.ndarray:
+        if isinstance(item, (int, np.integer)):
+            item = int(item) + len(self) if item < 0 else int(item)
+            if not 0 <= item < len(self):
+                raise IndexError(f'Frame {item} is out of range for {len(self)} frames.')
+            idx, offset = self._store.locate(item)
+            return self.chunk(idx)[offset].copy()
+        if isinstance(item, slice):
+            indices = np.arange(len(self))[item]
+        else:
+            indices = np.asarray(item)
+            if indices.dtype == bool:
+                if indices.shape != (len(self),):
+                    raise IndexError(f'Expected a mask of {len(self)} frames, got {indices.shape}.')
+                indices = np.flatnonzero(indices)
+            indices = indices.astype(np.int64, copy=False).ravel()
+            if len(indices) and (indices.min() < -len(self) or indices.max() >= len(self)):
+                raise IndexError(f'Frames {indices.min()}..{indices.max()} are out of range for {len(self)} frames.')
+            indices = np.where(indices < 0, indices + len(self), indices)
+        out = np.empty((len(indices), *self._store.frame_shape), dtype=self.dtype)
+        chunk_of_frame = np.searchsorted(self._store.chunk_starts, indices, side='right') - 1
+        for idx in np.unique(chunk_of_frame):
+            mask = chunk_of_frame == idx
+            out[mask] = self.chunk(int(idx))[indices[mask] - self._store.chunk_starts[idx]]
+        return out
+
+
+class MeasurementStore:
+    """ A chunked, compressed and appendable store of frames and their per-frame columns.
+
+    The store is a directory:
+        store.yaml  - the frame shape, the codec and filters, and the dtypes of the columns.
+        frames/     - one compressed file per appended batch of frames.
+        <column>.bin - the raw values of each column, appended per batch. They are memory-mapped on read.
+        chunk_stats.bin - the min and max of each column in each chunk, to find chunks without reading the columns.
+        chunks.bin  - the index of the chunks. A chunk exists only once its row is appended here, so a batch that
+                      was cut by a crash is ignored, and trimmed away when the store is reopened for writing.
+    Frames are read lazily through the frames property, and can be selected by the columns with select().
+    """
+
+    def __init__(self, path: Union[str, Path], mode: str = 'r', codec: str = 'zlib', level: int = 1,
+                 filters: tuple = ('shuffle',), frame_shape: Tuple[int, int] = (HEIGHT_IMAGE_TAU2, WIDTH_IMAGE_TAU2),
+                 columns: (tuple, None) = None) -> None:
+        assert mode in ('r', 'a'), f'mode must be either r or a, got {mode}.'
+        self._path, self._mode = Path(path), mode
+        if not (self._path / STORE_META_FILENAME).is_file():
+            if mode == 'r':
+                raise FileNotFoundError(f'No measurement store in {self._path}.')
+            if codec not in CODECS:
+                raise ValueError(f'codec must be one of {list(CODECS)}, got {codec}.')
+            if not set(filters).issubset(FILTERS):
+                raise ValueError(f'filters must be of {list(FILTERS)}, got {filters}.')
+            columns = tuple(COLUMNS) if columns is None else tuple(columns)
+            if not set(REQUIRED_COLUMNS).issubset(columns) or not set(columns).issubset(COLUMNS):
+                raise ValueError(f'columns must hold {list(REQUIRED_COLUMNS)} and be of {list(COLUMNS)}, '
+                                 f'got {columns}.')
+            (self._path / STORE_FRAMES_DIRNAME).mkdir(parents=True, exist_ok=True)
+            meta = dict(version=STORE_VERSION, codec=codec, level=int(level), filters=list(filters),
+                        frame_shape=list(frame_shape),
+                        columns={name: dtype for name, dtype in COLUMNS.items() if name in columns})
+            with open(self._path / STORE_META_FILENAME, 'w') as fp:
+                yaml.safe_dump(meta, stream=fp, default_flow_style=False)
+        with open(self._path / STORE_META_FILENAME, 'r') as fp:
+            self._meta = yaml.safe_load(fp)
+        self._meta.setdefault('filters', [])
+        if self._meta['codec'] not in CODECS:
+            raise ValueError(f'The store {self._path} is compressed with {self._meta["codec"]}, '
+                             f'which is not installed.')
+        self._columns_cache = {}
+        self.refresh()
+        if mode == 'a':
+            self._trim_uncommitted()
+
+    def __repr__(self) -> str:
+        return f'MeasurementStore({str(self._path)!r}, {len(self)} frames in {self.n_chunks} chunks)'
+
+    def __len__(self) -> int:
+        return int(self._chunk_starts[-1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def frame_shape(self) -> tuple:
+        return tuple(self._meta['frame_shape'])
+
+    @property
+    def column_names(self) -> tuple:
+        return tuple(self._meta['columns'])
+
+    @property
+    def n_chunks(self) -> int:
+        return len(self._index)
+
+    @property
+    def chunk_starts(self) -> np.ndarray:
+        """ The index of the first frame of each chunk, followed by the total number of frames. """
+        return self._chunk_starts
+
+    @property
+    def frames(self) -> ChunkedFrames:
+        return ChunkedFrames(self)
+
+    def refresh(self) -> None:
+        """ Re-reads the chunk index, to see the chunks appended by a writer since the store was opened. """
+        path_index = self._path / STORE_INDEX_FILENAME
+        size = path_index.stat().st_size if path_index.is_file() else 0
+        n_chunks = size // CHUNK_INDEX_DTYPE.itemsize
+        self._index = np.fromfile(path_index, dtype=CHUNK_INDEX_DTYPE, count=n_chunks) if n_chunks \
+            else np.empty(0, dtype=CHUNK_INDEX_DTYPE)
+        self._chunk_starts = np.append(self._index['start'], self._index['start'][-1] + self._index['n_frames'][-1]) \
+            if n_chunks else np.zeros(1, dtype=np.int64)
+        self._columns_cache.clear()
+
+    def _trim_uncommitted(self) -> None:
+        n_committed = len(self)
+        for name, dtype in self._meta['columns'].items():
+            path = self._path / f'{name}.bin'
+            if path.is_file() and path.stat().st_size > n_committed * np.dtype(dtype).itemsize:
+                os.truncate(path, n_committed * np.dtype(dtype).itemsize)
+        for path in (self._path / STORE_FRAMES_DIRNAME).glob('*'):
+            if path.suffix == '.tmp' or int(path.stem) >= self.n_chunks:
+                path.unlink()
+        path_stats = self._path / STORE_STATS_FILENAME
+        n_stats = path_stats.stat().st_size // CHUNK_STATS_DTYPE.itemsize if path_stats.is_file() else 0
+        if n_stats > self.n_chunks:
+            os.truncate(path_stats, self.n_chunks * CHUNK_STATS_DTYPE.itemsize)
+        elif n_stats < self.n_chunks:  # the store was written before the stats were kept
+            with open(path_stats, 'r+b' if n_stats else 'wb') as fp:
+                fp.seek(n_stats * CHUNK_STATS_DTYPE.itemsize)
+                fp.write(self._compute_chunk_stats(n_stats, self.n_chunks).tobytes())
+
+    def _path_chunk(self, idx: int) -> Path:
+        return self._path / STORE_FRAMES_DIRNAME / f'{idx:08d}.{self._meta["codec"]}'
+
+    def append(self, frames: np.ndarray, **columns) -> int:
+        """ Appends a batch of frames as one chunk, with a value per frame for each column of the store.
+        Returns the index of the first frame of the batch. """
+        if self._mode != 'a':
+            raise PermissionError(f'The store {self._path} was opened as read-only.')
+        self._check_columns(columns)
+        frames = np.ascontiguousarray(frames, dtype=np.uint16)
+        if frames.shape[1:] != self.frame_shape:
+            raise ValueError(f'Expected frames of shape {self.frame_shape}, got {frames.shape[1:]}.')
+        if len(frames) == 0:
+            return len(self)
+        data = encode_chunk(frames, self._meta['codec'], self._meta['level'], tuple(self._meta['filters']))
+        return self.append_encoded(data, n_frames=len(frames), **columns)
+
+    def _check_columns(self, columns: dict) -> None:
+        if set(columns) != set(self._meta['columns']):
+            raise KeyError(f'Expected the columns {sorted(self._meta["columns"])}, got {sorted(columns)}.')
+
+    def append_encoded(self, data: bytes, n_frames: int, **columns) -> int:
+        """ Appends a chunk that was already encoded with the codec, level and filters of the store.
+        The columns are checked before anything is written, so a bad batch leaves the store as it was. """
+        if self._mode != 'a':
+            raise PermissionError(f'The store {self._path} was opened as read-only.')
+        self._check_columns(columns)
+        if int(n_frames) != n_frames or n_frames < 0:
+            raise ValueError(f'n_frames must be a non-negative integer, got {n_frames}.')
+        n_frames = int(n_frames)
+        columns = {name: np.broadcast_to(np.asarray(columns[name]), (n_frames,)).astype(dtype)
+                   for name, dtype in self._meta['columns'].items()}
+        start, idx = len(self), self.n_chunks
+        path_chunk = self._path_chunk(idx)
+        path_tmp = path_chunk.with_suffix('.tmp')
+        with open(path_tmp, 'wb') as fp:
+            fp.write(data)
+        os.replace(path_tmp, path_chunk)
+        stats = self._new_chunk_stats(1)
+        for name, values in columns.items():
+            with open(self._path / f'{name}.bin', 'ab') as fp:
+                fp.write(values.tobytes())
+            if n_frames:
+                stats[f'{name}_min'], stats[f'{name}_max'] = values.min(), values.max()
+        with open(self._path / STORE_STATS_FILENAME, 'ab') as fp:
+            fp.write(stats.tobytes())
+        with open(self._path / STORE_INDEX_FILENAME, 'ab') as fp:
+            fp.write(np.array([(start, n_frames)], dtype=CHUNK_INDEX_DTYPE).tobytes())
+        self.refresh()
+        return start
+
+    def locate(self, frame_idx: int) -> Tuple[int, int]:
+        """ Returns the chunk that holds the frame, and the offset of the frame in the chunk. """
+        idx = int(np.searchsorted(self._chunk_starts, frame_idx, side='right')) - 1
+        return idx, frame_idx - int(self._chunk_starts[idx])
+
+    @property
+    def encoding(self) -> dict:
+        """ The codec, level and filters of the chunks. """
+        return dict(codec=self._meta['codec'], level=self._meta['level'], filters=tuple(self._meta['filters']))
+
+    def path_chunk(self, idx: int) -> Path:
+        return self._path_chunk(idx)
+
+    def read_chunk(self, idx: int) -> np.ndarray:
+        with open(self._path_chunk(idx), 'rb') as fp:
+            return decode_chunk(fp.read(), self._meta['codec'], tuple(self._meta['filters']), self.frame_shape)
+
+    @property
+    def chunk_stats(self) -> np.ndarray:
+        """ The min and max of each column in each chunk, e.g. store.chunk_stats['blackbody_min']. """
+        path = self._path / STORE_STATS_FILENAME
+        n_stats = path.stat().st_size // CHUNK_STATS_DTYPE.itemsize if path.is_file() else 0
+        if n_stats < self.n_chunks:  # the store was written before the stats were kept, and was not reopened since
+            return self._compute_chunk_stats(0, self.n_chunks)
+        return np.fromfile(path, dtype=CHUNK_STATS_DTYPE, count=self.n_chunks)
+
+    def _new_chunk_stats(self, n_chunks: int) -> np.ndarray:
+        """ Stats of columns the store does not keep are an empty range, min > max, so no range query matches them. """
+        stats = np.zeros(n_chunks, dtype=CHUNK_STATS_DTYPE)
+        for name, dtype in COLUMNS.items():
+            if name not in self._meta['columns']:
+                stats[f'{name}_min'] = np.iinfo(dtype).max
+        return stats
+
+    def _compute_chunk_stats(self, first: int, last: int) -> np.ndarray:
+        stats = self._new_chunk_stats(last - first)
+        if last <= first:
+            return stats
+        starts = self._chunk_starts[first:last + 1]
+        offsets = starts[:-1] - starts[0]
+        for name in self._meta['columns']:
+            values = np.asarray(self.column(name)[starts[0]:starts[-1]])
+            stats[f'{name}_min'] = np.minimum.reduceat(values, offsets)
+            stats[f'{name}_max'] = np.maximum.reduceat(values, offsets)
+        return stats
+
+    def column(self, name: str) -> np.ndarray:
+        """ A read-only memory-map of the committed values of the column.
+        A column of COLUMNS that the store does not keep reads as NaN. """
+        if name in COLUMNS and name not in self._meta['columns']:
+            return np.full(len(self), np.nan)
+        if name not in self._columns_cache:
+            dtype = np.dtype(self._meta['columns'][name])
+            if len(self) == 0:
+                self._columns_cache[name] = np.empty(0, dtype=dtype)
+            else:
+                self._columns_cache[name] = np.memmap(self._path / f'{name}.bin', dtype=dtype, mode='r',
+                                                      shape=(len(self),))
+        return self._columns_cache[name]
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.column(name)
+
+    def select(self, **ranges) -> np.ndarray:
+        """ Returns the indices of the frames whose columns fall in the given [low, high] ranges.
+        e.g. store.frames[store.select(fpa=(3000, 3500), blackbody=(2000, 2000))] """
+        mask = np.ones(len(self), dtype=bool)
+        for name, (low, high) in ranges.items():
+            values = self.column(name)
+            mask &= (values >= low) & (values <= high)
+        return np.flatnonzero(mask)
+
+    def read(self, **ranges) -> dict:
+        """ Loads the frames and columns of the frames selected by the ranges, reading only the chunks that hold them.
+        e.g. store.read(blackbody=(3000, 3000)) loads a single blackbody setpoint. """
+        indices = self.select(**ranges)
+        return dict(frames=self.frames[indices], **{name: np.array(self.column(name)[indices])
+                                                    for name in self.column_names})
+
+    def pixel_stats(self, n_workers: Union[int, None] = None, **ranges) -> PixelStats:
+        """ The per-pixel mean, variance, min and max of the frames in the [low, high] ranges of the columns,
+        or of all the frames, e.g. store.pixel_stats(blackbody=(3000, 3000)).
+        The chunks are decoded and reduced in a pool of n_workers processes and merged as they are returned,
+        so the memory holds a single chunk per worker. """
+        indices = self.select(**ranges) if ranges else None
+        tasks = []
+        for idx in range(self.n_chunks):
+            offsets = None
+            if indices is not None:
+                offsets = indices[(indices >= self._chunk_starts[idx]) & (indices < self._chunk_starts[idx + 1])]
+                if not len(offsets):
+                    continue
+                offsets = offsets - self._chunk_starts[idx]
+            tasks.append((self._path_chunk(idx), self.encoding, self.frame_shape, offsets))
+        stats = PixelStats(self.frame_shape)
+        if not tasks:
+            return stats
+        with Pool(max(1, min(n_workers or mp.cpu_count(), len(tasks)))) as pool:
+            for chunk_stats in pool.imap_unordered(_chunk_pixel_stats, tasks):
+                stats.merge(chunk_stats)
+        return stats
+
+    @property
+    def setpoints(self) -> np.ndarray:
+        """ The distinct blackbody temperatures in the store, in [100C]. """
+        return np.unique(self.column('blackbody'))
+
+    @property
+    def attrs(self) -> dict:
+        """ Metadata of the run, e.g. the camera parameters and the arguments of the script. """
+        return self._meta.get('attrs', {})
+
+    def set_attrs(self, **attrs) -> None:
+        if self._mode != 'a':
+            raise PermissionError(f'The store {self._path} was opened as read-only.')
+        self._meta.setdefault('attrs', {}).update(attrs)
+        path_tmp = self._path / f'{STORE_META_FILENAME}.tmp'
+        with open(path_tmp, 'w') as fp:
+            yaml.safe_dump(self._meta, stream=fp, default_flow_style=False)
+        os.replace(path_tmp, self._path / STORE_META_FILENAME)
+
+    def close(self) -> None:
+        self._columns_cache.clear()
+
+
+def store_from_pickle(path_pkl: Union[str, Path], path_store: Union[str, Path, None] = None) -> MeasurementStore:
+    """ Converts the pickle of collect_constant_fpa.py or collect_constant_bb.py to a MeasurementStore.
+
+    collect_constant_fpa.py pickles the frames, fpa and housing as dicts keyed by the blackbody in [100C].
+    collect_constant_bb.py pickles them as lists, with a single blackbody in [C].
+    The rest of the keys are kept as the attrs of the store. The pickles have no time, so time_ns is zero.
+    The store is written next to the pickle by default, with the same name.
+    """
+    path_pkl = Path(path_pkl)
+    path_store = Path(path_store) if path_store else path_pkl.with_suffix('')
+    with open(path_pkl, 'rb') as fp:
+        dict_meas = pickle.load(fp)
+    frames, fpa, housing = dict_meas.pop('frames'), dict_meas.pop('fpa'), dict_meas.pop('housing')
+    if isinstance(frames, dict):
+        stops = [(t_bb, frames[t_bb], fpa[t_bb], housing[t_bb]) for t_bb in frames]
+    else:
+        stops = [(round(100 * dict_meas.pop('blackbody')), frames, fpa, housing)]
+    store = MeasurementStore(path_store, mode='a', frame_shape=np.shape(stops[0][1])[1:])
+    if len(store):
+        raise FileExistsError(f'The store {path_store} already holds {len(store)} frames.')
+    store.set_attrs(**{str(k): v for k, v in dict_meas.items()})
+    for t_bb, frames, fpa, housing in stops:
+        for start in range(0, len(frames), STORE_CHUNK_FRAMES):
+            chunk = np.stack(frames[start:start + STORE_CHUNK_FRAMES])
+            store.append(chunk, time_ns=0, fpa=np.asarray(fpa[start:start + len(chunk)]),
+                         housing=np.asarray(housing[start:start + len(chunk)]), blackbody=t_bb)
+    return store
+
+
+class StoreWriter(mp.Process):
+    """ Appends batches of frames to a MeasurementStore in a separate process, so acquisition never waits on disk.
+
+    The batches are passed in n_slots shared-memory slots of max_frames frames each. A producer reserves a free slot,
+    fills it (e.g. camera.grab_n(n, out=frames)) and commits it, and the writer returns the slot once it is on disk.
+    When all the slots are in flight, reserve() blocks - the time spent waiting is the back-pressure on acquisition,
+    and is reported in stats together with the queue depth and the write times.
+    On SIGTERM or SIGINT the writer stops taking new batches, flushes the committed ones and exits.
+    If a write fails the writer stops, and the next reserve() or commit() raises a RuntimeError with the error.
+    close() flushes everything, stops the writer and frees the shared memory. It is also called on exit, so a
+    producer that fails before closing does not leave the interpreter waiting on the writer.
+    """
+
+    def __init__(self, path: Union[str, Path], max_frames: int, n_slots: int = WRITER_SLOTS,
+                 frame_shape: Tuple[int, int] = (HEIGHT_IMAGE_TAU2, WIDTH_IMAGE_TAU2), **store_kwargs) -> None:
+        super().__init__(name='mp_store_writer', daemon=True)
+        assert max_frames > 0 and n_slots > 0, f'max_frames and n_slots must be positive, got {max_frames, n_slots}.'
+        self._path, self._store_kwargs = Path(path), dict(frame_shape=frame_shape, **store_kwargs)
+        self._shape = (n_slots, max_frames, *frame_shape)
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self._shape)) * 2)
+        self._slots = np.ndarray(self._shape, dtype=np.uint16, buffer=self._shm.buf)
+        self._free, self._committed, self._errors = mp.Queue(), mp.Queue(), mp.Queue()
+        self._error = None
+        for idx in range(n_slots):
+            self._free.put(idx)
+        self._stats = mp.Array(c_double, len(WRITER_STATS_KEYS))
+        self._n_in_flight = mp.Value('i', 0)
+        self._wait_sum_ns, self._wait_max_ns, self._n_waits = 0, 0, 0
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state.pop('_slots', None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._slots = np.ndarray(self._shape, dtype=np.uint16, buffer=self._shm.buf)
+
+    @property
+    def max_frames(self) -> int:
+        return self._shape[1]
+
+    def start(self) -> None:
+        super().start()
+        atexit.register(self.close, WRITER_CLOSE_TIMEOUT_SECONDS)
+
+    @property
+    def error(self) -> (str, None):
+        """ The error that stopped the writer, None while it is fine. """
+        if self._error is None:
+            try:
+                self._error = self._errors.get(timeout=0.1 if self.pid is not None and not self.is_alive() else 0)
+            except (queue.Empty, ValueError, OSError):
+                pass
+        return self._error
+
+    def _raise_if_dead(self) -> None:
+        if self.error is not None:
+            raise RuntimeError(f'The writer of {self._path} failed: {self._error}')
+        if self.pid is not None and not self.is_alive():
+            raise RuntimeError(f'The writer of {self._path} stopped with exit code {self.exitcode}.')
+
+    def reserve(self, timeout: (float, None) = WRITER_RESERVE_TIMEOUT_SECONDS) -> Tuple[int, np.ndarray]:
+        """ Returns a free slot and its (max_frames, height, width) frames array, blocking while all are in use.
+        Raises a TimeoutError if no slot is freed within timeout seconds (None waits forever), and a RuntimeError
+        if the writer died. """
+        t_start_ns = time_ns()
+        while True:
+            self._raise_if_dead()
+            t_left = WRITER_POLL_SECONDS if timeout is None else timeout - 1e-9 * (time_ns() - t_start_ns)
+            try:
+                idx = self._free.get(timeout=max(0., min(WRITER_POLL_SECONDS, t_left)))
+                break
+            except queue.Empty:
+                if timeout is not None and t_left <= WRITER_POLL_SECONDS:
+                    raise TimeoutError(f'No slot of the writer of {self._path} was freed in {timeout}s.')
+        wait_ns = time_ns() - t_start_ns
+        self._n_waits += 1
+        self._wait_sum_ns += wait_ns
+        self._wait_max_ns = max(self._wait_max_ns, wait_ns)
+        return idx, self._slots[idx]
+
+    def commit(self, slot: int, n_frames: int, step: int = 1, **columns) -> None:
+        """ Queues the first n_frames frames of the slot for writing, taking every step-th frame.
+        The columns hold a value per frame (or a single value for all), the same as MeasurementStore.append().
+        Raises a RuntimeError if the writer died. """
+        self._raise_if_dead()
+        columns = {k: np.broadcast_to(np.asarray(v), (n_frames,))[::step].copy() for k, v in columns.items()}
+        with self._n_in_flight.get_lock():
+            self._n_in_flight.value += 1
+            depth = self._n_in_flight.value
+        with self._stats.get_lock():
+            self._stats[WRITER_STATS_KEYS.index('queue_depth_max')] = \
+                max(depth, self._stats[WRITER_STATS_KEYS.index('queue_depth_max')])
+        self._committed.put((slot, n_frames, step, columns))
+
+    def append(self, frames: np.ndarray, **columns) -> None:
+        """ Copies the frames into a free slot and commits them. """
+        for start in range(0, len(frames), self.max_frames):
+            slot, out = self.reserve()
+            chunk = frames[start:start + self.max_frames]
+            out[:len(chunk)] = chunk
+            self.commit(slot, n_frames=len(chunk),
+                        **{k: np.broadcast_to(np.asarray(v), (len(frames),))[start:start + len(chunk)]
+                           for k, v in columns.items()})
+
+    @property
+    def stats(self) -> dict:
+        """ The number of batches and frames written, the maximal number of batches in flight, the mean and max time
+        reserve() waited for a free slot and the mean and max time to write a batch, in [ms]. """
+        stats = dict(zip(WRITER_STATS_KEYS, self._stats[:]))
+        stats['wait_mean_ms'] = 1e-6 * self._wait_sum_ns / max(1, self._n_waits)
+        stats['wait_max_ms'] = 1e-6 * self._wait_max_ns
+        return stats
+
+    def run(self) -> None:
+        is_draining = th.Event()
+        signal.signal(signal.SIGTERM, lambda *args: is_draining.set())
+        signal.signal(signal.SIGINT, lambda *args: is_draining.set())
+        write_sum_ns = 0
+        try:
+            with MeasurementStore(self._path, mode='a', **self._store_kwargs) as store:
+                while True:
+                    try:
+                        item = self._committed.get(timeout=0.5)
+                    except queue.Empty:
+                        if is_draining.is_set():
+                            break  # everything committed before the signal was written
+                        continue
+                    if item is _STOP:
+                        break
+                    slot, n_frames, step, columns = item
+                    t_start_ns = time_ns()
+                    store.append(self._slots[slot, :n_frames:step], **columns)
+                    write_ns = time_ns() - t_start_ns
+                    self._free.put(slot)
+                    with self._n_in_flight.get_lock():
+                        self._n_in_flight.value -= 1
+                    write_sum_ns += write_ns
+                    with self._stats.get_lock():
+                        n_batches = self._stats[WRITER_STATS_KEYS.index('n_batches')] + 1
+                        self._stats[WRITER_STATS_KEYS.index('n_batches')] = n_batches
+                        self._stats[WRITER_STATS_KEYS.index('n_frames')] += len(range(0, n_frames, step))
+                        self._stats[WRITER_STATS_KEYS.index('write_mean_ms')] = 1e-6 * write_sum_ns / n_batches
+                        self._stats[WRITER_STATS_KEYS.index('write_max_ms')] = \
+                            max(1e-6 * write_ns, self._stats[WRITER_STATS_KEYS.index('write_max_ms')])
+        except (OSError, ValueError, TypeError, KeyError, IndexError, AssertionError, RuntimeError, MemoryError,
+                yaml.YAMLError) as err:
+            self._errors.put(repr(err))  # raised by the next reserve() or commit() of the producer
+        finally:
+            self._slots = None
+            self._shm.close()
+
+    def close(self, timeout: (float, None) = None) -> None:
+        """ Waits for all the committed batches to be written, stops the writer and frees the shared memory. """
+        atexit.unregister(self.close)
+        try:
+            self._committed.put(_STOP)
+            self.join(timeout=timeout)
+        except (ValueError, AssertionError, OSError):
+            pass
+        self._slots = None
+        try:
+            self._shm.close()
+            self._shm.unlink()
+        except (BufferError, FileNotFoundError, OSError):
+            pass
@@ -1,8 +1,8 @@
 from dataclasses import dataclass
-from typing import List, Union
+from typing import Iterator, List, NamedTuple, Tuple, Union
 import pickle
+import zipfile
 from functools import cached_property, partial
-from multiprocessing import Pool, cpu_count
 from pathlib import Path
 
 import matplotlib.pyplot as plt
@@ -10,9 +10,13 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 from numpy.polynomial.polynomial import Polynomial
-from scipy.ndimage import gaussian_filter
 from tqdm import tqdm
 
+from utils.catalog import TEMPERATURE_COLUMNS, Catalog, find_sources
+from utils.denoise import GaussianDenoiser
+from utils.pixel_stats import PixelStats
+from utils.store import MeasurementStore
+
 
 def celsius2kelvin(celsius: np.ndarray) -> np.ndarray:
     return celsius + 273.15
@@ -22,19 +26,158 @@ def kelvin2celsius(kelvin: np.ndarray) -> np.ndarray:
     return kelvin - 273.15
 
 
+LOAD_BATCH_FRAMES = 2 ** 8  # frames converted at once when a LazyFrames is iterated or materialized
+
+
+def _square_crop(shape: tuple, crop_size: int = 0) -> Tuple[slice, slice]:
+    """ The slices that same_dim() applies to a frame of the given shape. """
+    h, w = shape[-2:]
+    diff = abs(h - w) // 2
+    rows = slice(diff, h - diff) if h > w else slice(0, h)
+    cols = slice(diff, w - diff) if w > h else slice(0, w)
+    if crop_size > 0:
+        rows = slice(rows.start + crop_size, rows.stop - crop_size)
+        cols = slice(cols.start + crop_size, cols.stop - crop_size)
+    return rows, cols
+
+
+def _memmap_npz(path: Path, key: str) -> np.ndarray:
+    """ Memory-maps an array of an npz file saved with np.savez. Arrays that are compressed can't be mapped,
+    so they are loaded. """
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(f'{key}.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        with np.load(path) as fp:
+            return fp[key]
+    with open(path, 'rb') as fp:
+        fp.seek(info.header_offset)
+        header = fp.read(30)  # the local file header, which is followed by the filename and the extra field
+        fp.seek(info.header_offset + 30 + int.from_bytes(header[26:28], 'little') +
+                int.from_bytes(header[28:30], 'little'))
+        version = np.lib.format.read_magic(fp)
+        shape, fortran_order, dtype = np.lib.format._read_array_header(fp, version)
+        offset = fp.tell()
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape, offset=offset, order='F' if fortran_order else 'C')
+
+
+class LazyFrames(np.lib.mixins.NDArrayOperatorsMixin):
+    """ The frames of several npz files and measurement stores, as one read-only array that is never fully loaded.
+
+    The npz files are memory-mapped and the stores are decompressed chunk by chunk, so only the frames that are
+    indexed are read. The frames are kept as uint16, and are cropped to a square and cast to dtype on access.
+    take() reorders or filters the frames without reading them.
+    Arithmetic and numpy functions (e.g. 0.04 * frames - 273.15) load the frames and return an np.ndarray, and
+    indexing pixels (e.g. frames[:, 128, 128]) reads the frames in batches and keeps only those pixels.
+    """
+
+    def __init__(self, sources: list, dtype: (str, np.dtype) = 'float32', crop_size: int = 0,
+                 indices: (np.ndarray, None) = None) -> None:
+        self._sources, self._dtype, self._crop_size = list(sources), np.dtype(dtype), crop_size
+        self._crop = _square_crop(self._sources[0].shape, crop_size) if self._sources else (slice(None), slice(None))
+        for src in self._sources:
+            if _square_crop(src.shape, crop_size) != self._crop:
+                raise ValueError(f'All the frames must have the same shape, got {src.shape[1:]} and '
+                                 f'{self._sources[0].shape[1:]}.')
+        self._starts = np.cumsum([0] + [len(src) for src in self._sources])
+        self._indices = np.arange(self._starts[-1]) if indices is None else np.asarray(indices, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    @property
+    def shape(self) -> tuple:
+        rows, cols = self._crop
+        return len(self), rows.stop - rows.start, cols.stop - cols.start
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    def astype(self, dtype: (str, np.dtype)) -> 'LazyFrames':
+        return LazyFrames(self._sources, dtype=dtype, crop_size=self._crop_size, indices=self._indices)
+
+    def take(self, indices) -> 'LazyFrames':
+        """ A LazyFrames of the given frames, in the given order. Nothing is read. """
+        return LazyFrames(self._sources, dtype=self._dtype, crop_size=self._crop_size,
+                          indices=self._indices[indices])
+
+    def _read(self, indices: np.ndarray) -> np.ndarray:
+        rows, cols = self._crop
+        out = np.empty((len(indices), *self.shape[1:]), dtype=self._dtype)
+        source_of_frame = np.searchsorted(self._starts, indices, side='right') - 1
+        for idx in np.unique(source_of_frame):
+            mask = source_of_frame == idx
+            local = indices[mask] - self._starts[idx]
+            if len(local) > 1 and np.all(np.diff(local) == 1):  # a contiguous run is read as a slice
+                frames = self._sources[idx][int(local[0]):int(local[-1]) + 1]
+            else:
+                frames = self._sources[idx][local]
+            out[mask] = frames[:, rows, cols]
+        return out
+
+    def __getitem__(self, item) -> np.ndarray:
+        if isinstance(item, tuple):
+            if isinstance(item[0], (int, np.integer)):
+                return self[item[0]][item[1:]]
+            indices = self._indices[item[0]]
+            if not item[1:]:
+                return self._read(indices)
+            pixels = (slice(None), *item[1:])
+            return np.concatenate([self._read(indices[start:start + LOAD_BATCH_FRAMES])[pixels]
+                                   for start in range(0, max(1, len(indices)), LOAD_BATCH_FRAMES)])
+        if isinstance(item, (int, np.integer)):
+            return self._read(self._indices[[item]])[0]
+        return self._read(self._indices[item])
+
+    def iter_batches(self, batch_size: int = LOAD_BATCH_FRAMES) -> Iterator[np.ndarray]:
+        """ Yields the frames in order, batch_size frames at a time. """
+        for start in range(0, len(self), batch_size):
+            yield self._read(self._indices[start:start + batch_size])
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for batch in self.iter_batches():
+            yield from batch
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        """ Loads all the frames into one array. """
+        out = np.empty(self.shape, dtype=self._dtype if dtype is None else dtype)
+        for start, batch in zip(range(0, len(self), LOAD_BATCH_FRAMES), self.iter_batches()):
+            out[start:start + len(batch)] = batch
+        return out
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [np.asarray(x) if isinstance(x, LazyFrames) else x for x in inputs]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def max(self):
+        return max(batch.max() for batch in self.iter_batches())
+
+    def min(self):
+        return min(batch.min() for batch in self.iter_batches())
+
+
 @dataclass
 class Data:
-    frames: np.ndarray
+    frames: (np.ndarray, LazyFrames)
     fpa: np.ndarray
     housing: np.ndarray
     blackbody: np.ndarray
 
     def __post_init__(self):
-        self.frames = np.stack(self.frames).astype('float32')
+        if not isinstance(self.frames, LazyFrames):
+            self.frames = np.stack(self.frames).astype('float32')
         self.fpa = np.array(self.fpa).astype('float32') 
         self.housing = np.array(self.housing).astype('float32')
         self.blackbody = np.array(self.blackbody).astype('float32')
 
+    @property
+    def is_lazy(self) -> bool:
+        return isinstance(self.frames, LazyFrames)
+
     def U100C2C(self):
         self.fpa /= 100
         self.housing /= 100
@@ -67,38 +210,64 @@ class Data:
 
     @cached_property
     def h(self):
-        return self.frames[0].shape[-2]
+        return self.frames.shape[-2]
     
     @cached_property
     def w(self):
-        return self.frames[0].shape[-1]
+        return self.frames.shape[-1]
+
+    def take(self, indices):
+        """ Keeps only the given measurements, in the given order. Lazy frames are not read. """
+        self.frames = self.frames.take(indices) if self.is_lazy else self.frames[indices]
+        self.housing = self.housing[indices] if self.housing is not None and len(self.housing) == len(self.fpa) \
+            else self.housing
+        self.fpa = self.fpa[indices]
+        self.blackbody = self.blackbody[indices]
 
     def sort(self, key: str):
         if key == 'fpa':
             indices = np.lexsort([self.blackbody, self.fpa])
         elif key == 'blackbody':
             indices = np.lexsort([self.fpa, self.blackbody])
-        self.frames = self.frames[indices]
-        self.fpa = self.fpa[indices]
-        self.blackbody = self.blackbody[indices]
-        self.housing = self.housing[indices] if self.housing is not None and len(self.housing) == len(indices) else self.housing
+        self.take(indices)
+
+    def load(self):
+        """ Reads lazy frames into memory. """
+        if self.is_lazy:
+            self.frames = np.asarray(self.frames)
+        return self
 
     @property
     def max_gl(self):
-        return np.max(self.frames)
+        return self.frames.max()
 
     @property
     def min_gl(self):
-        return np.min(self.frames)
-
-
-
-def _loader(p) -> dict:
-    fp = np.load(p)
-    return {k:fp[k] for k in fp.keys()}
-
-
-def load_measurements(path_to_files: Union[str, Path] = None) -> Data:
+        return self.frames.min()
+
+
+def _open_frames(path: Path) -> (np.ndarray, None):
+    """ The frames of a measurement store or an npz file, without reading them. None if it has no frames. """
+    if path.is_dir():
+        store = MeasurementStore(path, mode='r')
+        return store.frames if len(store) else None
+    with zipfile.ZipFile(path) as zf:
+        if 'frames.npy' not in zf.namelist():
+            return None
+    return _memmap_npz(path, 'frames')
+
+
+def load_measurements(path_to_files: Union[str, Path] = None, lazy: bool = True, crop_size: int = 0,
+                      dtype: str = 'float32', **ranges) -> Data:
+    """ Loads the measurement stores and the npz files under path_to_files.
+
+    Only the FPA, housing and blackbody temperatures are read. With lazy=True the frames are memory-mapped and
+    read on access, cropped to a square and cast to dtype - so a campaign larger than the memory can be loaded.
+    With lazy=False they are read into a single array.
+    ranges select the frames by the catalog of the campaign, in [C], e.g. fpa=(30, 35), blackbody=(20, 40).
+    Only the files that hold the selected frames are opened. The catalog is only read - it is built and updated by
+    build_catalog.py. Without an up-to-date catalog, the temperatures of all the files are read and filtered.
+    """
     if path_to_files:
         path_to_files = Path(path_to_files)
     else:
@@ -108,18 +277,52 @@ def load_measurements(path_to_files: Union[str, Path] = None) -> Data:
             path_to_files = path_to_files.parent
         path_to_files = path_to_files / "rawData"
 
-    data = {}
-    list_path = list(sorted(list(path_to_files.glob('*.npz'))))
-    with Pool(min(len(list_path), cpu_count())) as pool:
-        results = list(tqdm(pool.imap(_loader, list_path), desc='Loading', total=len(list_path)))
-    for res in filter(lambda x: 'frames' in x.keys(), results):
-        for k, v in res.items():
-            data.setdefault(k, []).extend(v)
-
-    # constraint all frames to a rectangular shape
-    data['frames'] = [same_dim(p) for p in data['frames']]
-
-    return Data(frames=data['frames'], fpa=data['fpa'], housing=data['housing'], blackbody=data['blackbody'])
+    catalog = Catalog(path_to_files) if ranges else None
+    if ranges and catalog.is_stale():
+        if not set(ranges).issubset(TEMPERATURE_COLUMNS):
+            raise FileNotFoundError(f'The catalog of {path_to_files} is missing or out of date, which the ranges '
+                                    f'{sorted(ranges)} need. Run build_catalog.py {path_to_files} first.')
+        print(f'The catalog of {path_to_files} is missing or out of date, reads the temperatures of all the files. '
+              f'Run build_catalog.py {path_to_files} to select the frames faster.')
+        data = load_measurements(path_to_files, lazy=True, crop_size=crop_size, dtype=dtype)
+        mask = np.ones(len(data), dtype=bool)
+        for name, (low, high) in ranges.items():
+            mask &= (getattr(data, name) >= np.floor(100 * low)) & (getattr(data, name) <= np.ceil(100 * high))
+        if not mask.any():
+            raise FileNotFoundError(f'No measurements in {path_to_files} in the ranges {ranges}.')
+        data.take(np.flatnonzero(mask))
+        return data if lazy else data.load()
+    if ranges:
+        rows = catalog.select(**ranges)
+        if not len(rows):
+            raise FileNotFoundError(f'No measurements in {path_to_files} in the ranges {ranges}.')
+        ids = np.unique(rows['source'])
+        sources = [_open_frames(catalog.path_source(int(source))) for source in ids]
+        starts = np.cumsum([0] + [len(src) for src in sources])[np.searchsorted(ids, rows['source'])]
+        frames = LazyFrames(sources, dtype=dtype, crop_size=crop_size, indices=starts + rows['index'])
+        data = Data(frames=frames, **{k: catalog.values(rows, k) for k in ('fpa', 'housing', 'blackbody')})
+        return data if lazy else data.load()
+
+    paths_stores, paths_npz = find_sources(path_to_files)
+    sources, data = [], {}
+    for path in tqdm(paths_stores + paths_npz, desc='Loading', disable=not (paths_stores or paths_npz)):
+        if (frames := _open_frames(path)) is None:
+            continue
+        sources.append(frames)
+        if path.is_dir():
+            with MeasurementStore(path, mode='r') as store:
+                columns = {k: np.array(store[k]) for k in ('fpa', 'housing', 'blackbody')}
+        else:
+            with np.load(path) as fp:
+                columns = {k: np.broadcast_to(fp[k], (len(frames),)) for k in ('fpa', 'housing', 'blackbody')}
+        for k, v in columns.items():
+            data.setdefault(k, []).append(v)
+    if not sources:
+        raise FileNotFoundError(f'No measurements in {path_to_files}.')
+
+    frames = LazyFrames(sources, dtype=dtype, crop_size=crop_size)
+    data = Data(frames=frames, **{k: np.concatenate(v) for k, v in data.items()})
+    return data if lazy else data.load()
 
 
 def same_dim(image: np.ndarray, crop_size: int = 0):
@@ -137,48 +340,43 @@ def same_dim(image: np.ndarray, crop_size: int = 0):
     return image
 
 
-def clean_noise(data: dict, sigma: int = 2, plot_before_after: bool = False):
+def clean_noise(data: dict, sigma: int = 2, plot_before_after: bool = False, n_workers: Union[int, None] = None,
+                in_place: bool = False):
+    """ Gaussian filters the frames of each FPA and blackbody in a pool of n_workers processes.
+    With in_place=True the arrays of the frames are overwritten, instead of replaced by filtered copies. """
     ex_fpa = np.random.choice(list(data.keys()))
     ex_bb = np.random.choice(list(data[ex_fpa]['measurements'].keys()))
-    ex_idx = np.random.choice(data[ex_fpa]['measurements'][ex_bb].shape[0])
-    before = data[ex_fpa]['measurements'][ex_bb][ex_idx].copy()
+    ex_idx = np.random.choice(len(data[ex_fpa]['measurements'][ex_bb]))
+    before = np.array(data[ex_fpa]['measurements'][ex_bb][ex_idx])
 
     n_samples = len(data) * len(data[list(data.keys())[0]]['measurements'])
-    # data_list = []
-    # for t_fpa, d in data.items():
-    #     for t_bb, v in d.items():
-    #         data_list.append((t_fpa, t_bb, v))
-    #
-    # with Pool(cpu_count()) as pool:
-    #     data_list = list(tqdm(pool.imap(_cleaner, data_list, chunksize=2**2),
-    #                           desc='Gaussian Filter', total=n_samples))
-    #
-    # for (t_fpa, t_bb, images) in data_list:
-    #     data[t_fpa][t_bb] = images
-    # del data_list
-
-    with tqdm(total=n_samples, desc='Gaussian Filter') as pbar:
+    with GaussianDenoiser(sigma=sigma, n_workers=n_workers) as denoiser, \
+            tqdm(total=n_samples, desc='Gaussian Filter') as pbar:
         for fpa, d in data.items():
             for t_bb, dt in d['measurements'].items():
-                data[fpa]['measurements'][t_bb] = np.stack([gaussian_filter(p, sigma=sigma) for p in dt])
+                is_array = isinstance(dt, np.ndarray) and dt.flags.writeable
+                data[fpa]['measurements'][t_bb] = denoiser(dt, out=dt if in_place and is_array else None)
                 pbar.update()
     if plot_before_after:
-        after = data[ex_fpa]['measurements'][ex_bb][ex_idx, ...]
-        vmin, vmax = min(after.min(), before.min()), max(after.max(), before.max())
-        fig, axs = plt.subplots(1, 2, figsize=(16, 9), sharey='all', sharex='all', facecolor='white')
-        im = axs[0].imshow(before, cmap='coolwarm')
-        im.set_clim(vmin, vmax)
-        plt.colorbar(im, ax=axs[0])
-        axs[0].set_title('Before')
-        im = axs[1].imshow(after, cmap='coolwarm')
-        im.set_clim(vmin, vmax)
-        plt.colorbar(im, ax=axs[1])
-        axs[1].set_title('After')
-        plt.tight_layout()
-        plt.show()
+        plot_denoise_before_after(before, data[ex_fpa]['measurements'][ex_bb][ex_idx, ...])
     return data
 
 
+def plot_denoise_before_after(before: np.ndarray, after: np.ndarray):
+    vmin, vmax = min(after.min(), before.min()), max(after.max(), before.max())
+    fig, axs = plt.subplots(1, 2, figsize=(16, 9), sharey='all', sharex='all', facecolor='white')
+    im = axs[0].imshow(before, cmap='coolwarm')
+    im.set_clim(vmin, vmax)
+    plt.colorbar(im, ax=axs[0])
+    axs[0].set_title('Before')
+    im = axs[1].imshow(after, cmap='coolwarm')
+    im.set_clim(vmin, vmax)
+    plt.colorbar(im, ax=axs[1])
+    axs[1].set_title('After')
+    plt.tight_layout()
+    plt.show()
+
+
 def fit_housing_to_fpa(data: dict, *, order: int = 2, plot: bool = False) -> Polynomial:
     df = pd.DataFrame({t_fpa: pd.DataFrame(data[t_fpa]['housing']).mean() for t_fpa in data.keys()})
     df = df.reindex(sorted(df.columns), axis=1)
@@ -201,55 +399,111 @@ def fit_housing_to_fpa(data: dict, *, order: int = 2, plot: bool = False) -> Pol
     return p.convert(window=p.domain, domain=p.domain)
 
 
+class CellStats(NamedTuple):
+    """ Statistics of the frames of each (FPA, blackbody) cell, with the cells sorted by FPA and then blackbody.
+
+    cell is the cell of each frame, so cell-wise values are spread to the frames with values[cell],
+    e.g. mask(std > 5) is a boolean mask of the frames of noisy cells.
+    mean and std are the mean over the pixels of the per-pixel mean and std of the frames of the cell.
+    pixel_mean and pixel_std are the per-pixel statistics of each cell, if they were kept.
+    """
+    fpa: np.ndarray
+    blackbody: np.ndarray
+    count: np.ndarray
+    mean: np.ndarray
+    std: np.ndarray
+    cell: np.ndarray
+    pixel_mean: Union[np.ndarray, None] = None
+    pixel_std: Union[np.ndarray, None] = None
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+    def mask(self, cells: np.ndarray) -> np.ndarray:
+        """ A boolean mask of the frames in the given cells, which is either a mask or the indices of the cells. """
+        cells = np.asarray(cells)
+        return cells[self.cell] if cells.dtype == bool else np.isin(self.cell, cells)
+
+    def indices(self, cell: int) -> np.ndarray:
+        """ The indices of the frames of the cell. """
+        return np.flatnonzero(self.cell == cell)
+
+
+def group_cells(fpa: np.ndarray, blackbody: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Groups the frames by their (FPA, blackbody) cell.
+    Returns the order that sorts the frames by cell, the cell of each frame and the start of each cell in the order,
+    followed by the number of frames. """
+    fpa, blackbody = np.asarray(fpa), np.asarray(blackbody)
+    order = np.lexsort([blackbody, fpa])
+    is_new = np.ones(len(order), dtype=bool)
+    is_new[1:] = (np.diff(fpa[order]) != 0) | (np.diff(blackbody[order]) != 0)
+    cell = np.empty(len(order), dtype=np.int64)
+    cell[order] = np.cumsum(is_new) - 1
+    return order, cell, np.append(np.flatnonzero(is_new), len(order))
+
+
+def cell_stats(data: Data, keep_pixels: bool = False, batch_size: int = LOAD_BATCH_FRAMES,
+               verbose: bool = False) -> CellStats:
+    """ Computes the statistics of each (FPA, blackbody) cell in a single pass over the frames, batch_size frames
+    at a time. Only the PixelStats of the cell that continues into the next batch are carried between batches,
+    unless keep_pixels.
+    """
+    order, cell, starts = group_cells(data.fpa, data.blackbody)
+    n_cells, (h, w) = len(starts) - 1, data.frames.shape[-2:]
+    mean, std = np.zeros(n_cells), np.zeros(n_cells)
+    pixel_mean = np.zeros((n_cells, h, w), dtype='float32') if keep_pixels else None
+    pixel_std = np.zeros((n_cells, h, w), dtype='float32') if keep_pixels else None
+    cell_sorted, stats = cell[order], PixelStats()
+
+    for first in tqdm(range(0, len(order), batch_size), desc='Cell statistics', disable=not verbose):
+        batch = data.frames[order[first:first + batch_size]]
+        cells = cell_sorted[first:first + batch_size]
+        segments = np.append(np.flatnonzero(np.diff(cells)) + 1, len(cells))
+        for c, seg_start, seg_end in zip(cells[np.append(0, segments[:-1])], np.append(0, segments[:-1]), segments):
+            stats.update(batch[seg_start:seg_end])
+            if first + seg_end < starts[c + 1]:  # the cell continues in the next batch
+                break
+            mean[c], std[c] = stats.mean.mean(), stats.std.mean()
+            if keep_pixels:
+                pixel_mean[c], pixel_std[c] = stats.mean, stats.std
+            stats = PixelStats()
+    return CellStats(fpa=np.asarray(data.fpa)[order[starts[:-1]]],
+                     blackbody=np.asarray(data.blackbody)[order[starts[:-1]]],
+                     count=np.diff(starts), mean=mean, std=std, cell=cell, pixel_mean=pixel_mean, pixel_std=pixel_std)
+
+
 def make_uniqe_dict(data) -> dict:
+    order, cell, starts = group_cells(data.fpa, data.blackbody)
     uniqus = {}
-    for fpa, bb, frame in zip(data.fpa, data.blackbody, data.frames):
-        uniqus.setdefault(fpa, {}).setdefault(bb, []).append(frame)
+    for first, last in zip(starts[:-1], starts[1:]):
+        indices = order[first:last]
+        uniqus.setdefault(data.fpa[indices[0]], {})[data.blackbody[indices[0]]] = data.frames[indices]
     return uniqus
 
 
 def make_std_dict(data):
+    stats = cell_stats(data)
     stds = {}
-    uniqus = make_uniqe_dict(data)
-
-    for fpa, v in uniqus.items():
-        for bb, vv in v.items():
-            uniqus[fpa][bb] = np.stack(vv)
-            stds.setdefault(fpa, {}).setdefault(bb, uniqus[fpa][bb].std(0).mean())
-
+    for fpa, bb, std in zip(stats.fpa, stats.blackbody, stats.std):
+        stds.setdefault(fpa, {})[bb] = std
     return stds
 
 
 def constrain_measurements_by_std(data: Data, threshold: int = 5, plot_top_three: bool = False, verbose: bool = False):
-    stds = make_std_dict(data)
-
-    list_above_threshold = []
-    for fpa, v in stds.items():
-        for bb, vv in v.items():
-            list_above_threshold.append((fpa, bb, vv)) if vv > threshold else None
-    list_above_threshold.sort(key=lambda x: x[-1], reverse=True)
+    stats = cell_stats(data, verbose=verbose)
+    noisy = np.flatnonzero(stats.std > threshold)
+    noisy = noisy[np.argsort(stats.std[noisy])[::-1]]
     if verbose:
-        [print(p) for p in list_above_threshold]
-    list_above_threshold = [(fpa, bb) for fpa, bb, _ in list_above_threshold]
-
-    list_indices_in_data = []
-    for idx, (fpa, bb) in enumerate(zip(data.fpa, data.blackbody)):
-        if (fpa, bb) in list_above_threshold:
-            list_indices_in_data.append(idx)
+        [print((stats.fpa[c], stats.blackbody[c], stats.std[c])) for c in noisy]
 
     if plot_top_three:
-        df = pd.DataFrame.from_dict(make_uniqe_dict(data))
-        for idx in range(min(3, len(list_above_threshold))):
-            fpa, bb = list_above_threshold[idx]
+        for c in noisy[:3]:
+            values = data.frames[stats.indices(c), 128, 128]
             plt.figure()
-            plt.plot(np.stack(df.loc[bb][fpa])[:, 128, 128])
-            plt.title(f"{fpa} {bb} {np.stack(df.loc[bb][fpa])[:, 128, 128].std():.2g}")
+            plt.plot(values)
+            plt.title(f"{stats.fpa[c]} {stats.blackbody[c]} {values.std():.2g}")
             plt.show()
             plt.close()
 
-    indices = list(set(range(len(data.fpa))) - set(list_indices_in_data))
-    data.fpa = data.fpa[indices]
-    data.housing = data.housing[indices]
-    data.blackbody = data.blackbody[indices]
-    data.frames = data.frames[indices]
-    return data
\ No newline at end of file
+    data.take(np.flatnonzero(~stats.mask(noisy)))
+    return data